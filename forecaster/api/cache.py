@@ -0,0 +1,122 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class SeriesCache:
+    """
+    Size-bounded LRU cache of query results, invalidated by a data version.
+
+    Every key is stored together with the data version it was computed
+    under. bump_version() (called after train_data changes) makes all
+    existing entries stale at once; they are dropped as they are looked up
+    or evicted.
+
+    With a Redis client, results and the version are also shared through
+    Redis: entries expire after redis_ttl seconds and Redis's own eviction
+    bounds their size. The shared version is re-read at most every
+    version_ttl seconds, so in-process LRU hits cost no round trip; a bump
+    from another process is seen within version_ttl, one from this process
+    at once. Redis errors fall back to the in-process cache.
+    """
+
+    def __init__(self, max_entries: int, redis_client=None, namespace: str = "series-cache",
+                 redis_ttl: int = 24 * 3600, version_ttl: float = 1.0):
+        self.max_entries = max_entries
+        self.redis = redis_client
+        self.namespace = namespace
+        self.redis_ttl = redis_ttl
+        self.version_ttl = version_ttl
+        self._entries = OrderedDict()  # key -> (version, value)
+        self._version = 0
+        self._shared_version = None  # (version, monotonic time it was read) of the Redis version
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "redis_hits": 0, "misses": 0, "evictions": 0, "stale": 0,
+                       "redis_errors": 0}
+
+    def _redis_call(self, method, *args):
+        if self.redis is None:
+            return None
+        try:
+            return getattr(self.redis, method)(*args)
+        except Exception as e:
+            with self._lock:
+                self._stats["redis_errors"] += 1
+            print(f"WARNING: Series cache Redis {method} failed: {e}")
+            return None
+
+    def version(self) -> int:
+        """Current data version (the Redis one as read within the last version_ttl seconds)."""
+        if self.redis is None:
+            return self._version
+        with self._lock:
+            cached = self._shared_version
+        if cached is not None and time.monotonic() - cached[1] < self.version_ttl:
+            return cached[0]
+        shared = self._redis_call("get", f"{self.namespace}:version")
+        version = self._version if shared is None else int(shared)  # No version yet, or Redis unavailable
+        with self._lock:
+            self._shared_version = (version, time.monotonic())
+        return version
+
+    def bump_version(self) -> int:
+        """Invalidates every cached result; call after the underlying data changes."""
+        with self._lock:
+            self._version += 1
+            version = self._version
+        shared = self._redis_call("incr", f"{self.namespace}:version")
+        with self._lock:
+            self._shared_version = None if shared is None else (int(shared), time.monotonic())
+        return int(shared) if shared is not None else version
+
+    def get_or_load(self, key: tuple, loader):
+        """
+        Returns the cached result for key under the current data version, or
+        calls loader() and caches its JSON-serializable result.
+        """
+        version = self.version()
+        redis_key = f"{self.namespace}:{version}:{json.dumps(key, default=str)}"
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                if cached[0] == version:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return cached[1]
+                del self._entries[key]
+                self._stats["stale"] += 1
+
+        shared = self._redis_call("get", redis_key)
+        if shared is not None:
+            value = json.loads(shared)
+            with self._lock:
+                self._stats["redis_hits"] += 1
+        else:
+            value = loader()
+            with self._lock:
+                self._stats["misses"] += 1
+            self._redis_call("set", redis_key, json.dumps(value, default=str), self.redis_ttl)
+
+        with self._lock:
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss/eviction counters, hit ratio, entries held and data version."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["max_entries"] = self.max_entries
+        lookups = stats["hits"] + stats["redis_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["hits"] + stats["redis_hits"]) / lookups, 4) if lookups else None
+        stats["version"] = self.version()
+        return stats
@@ -0,0 +1,182 @@
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from kp_forecaster.config import DUCKDB_OPEN_RETRIES
+from kp_forecaster.data_source import connect
+
+
+class ConnectionManager:
+    """
+    Shares one DuckDB database handle between all threads of the API process.
+
+    Writes run on the long-lived writer connection, one at a time and in
+    arrival order. Reads run on a cursor of that connection owned by the
+    calling thread, so they neither reopen the file nor wait for writes.
+
+    DuckDB lets only one process open a file for writing, and the Celery
+    worker reads the same file read-only. Once no cursor has been in use for
+    idle_release seconds, the handle is closed to release the file lock. The
+    next request reopens it. Pass idle_release=None to keep it open for good.
+    """
+
+    def __init__(self, database: str, idle_release: float = None, open_retries: int = DUCKDB_OPEN_RETRIES):
+        self.database = database
+        self.idle_release = idle_release
+        self.open_retries = open_retries
+        self._conn = None
+        self._generation = 0
+        self._cursors = {}  # thread ident -> (generation, cursor)
+        self._lock = threading.Lock()  # Guards the handle and the counters
+        self._idle = threading.Condition(self._lock)
+        self._tickets = itertools.count()
+        self._serving = 0  # Ticket of the write that may run next
+        self._write_turn = threading.Condition(threading.Lock())
+        self._timer = None
+        self._active = 0
+        self._last_used = time.monotonic()
+        self._stats = {
+            "opens": 0, "closes": 0,
+            "reads": 0, "read_wait_seconds": 0.0, "max_read_wait_seconds": 0.0,
+            "writes": 0, "write_wait_seconds": 0.0, "max_write_wait_seconds": 0.0,
+        }
+        self._queued = 0  # Guarded by self._write_turn
+
+    def _open(self):
+        # Called with self._lock held
+        if self._conn is None:
+            # Retries while a worker holds the file open
+            self._conn = connect(self.database, retries=self.open_retries)
+            self._generation += 1
+            self._stats["opens"] += 1
+        return self._conn
+
+    def _acquire(self, kind: str, started: float):
+        # Called with self._lock held
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._active += 1
+        wait = time.perf_counter() - started
+        self._stats[f"{kind}s"] += 1
+        self._stats[f"{kind}_wait_seconds"] += wait
+        self._stats[f"max_{kind}_wait_seconds"] = max(self._stats[f"max_{kind}_wait_seconds"], wait)
+
+    def _release(self):
+        with self._lock:
+            self._active -= 1
+            self._last_used = time.monotonic()
+            if self._active == 0:
+                self._idle.notify_all()
+                if self.idle_release is not None:
+                    self._timer = threading.Timer(self.idle_release, self._release_if_idle)
+                    self._timer.daemon = True
+                    self._timer.start()
+
+    def _release_if_idle(self):
+        with self._lock:
+            idle_for = time.monotonic() - self._last_used
+            if self._active == 0 and self._conn is not None and idle_for >= self.idle_release:
+                self._close_handle()
+
+    def _close_handle(self):
+        # Called with self._lock held and no cursor in use
+        for _, cursor in self._cursors.values():
+            cursor.close()
+        self._cursors.clear()
+        self._conn.close()
+        self._conn = None
+        self._stats["closes"] += 1
+
+    def _thread_cursor(self):
+        # Called with self._lock held
+        conn = self._open()
+        ident = threading.get_ident()
+        generation, cursor = self._cursors.get(ident, (None, None))
+        if generation != self._generation:
+            cursor = conn.cursor()
+            self._cursors[ident] = (self._generation, cursor)
+        return cursor
+
+    @contextmanager
+    def reader(self):
+        """
+        Yields the calling thread's read cursor.
+
+        The cursor is reused by later reads of the same thread, so it must not
+        be closed or handed to another thread.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            cursor = self._thread_cursor()
+            self._acquire("read", started)
+        try:
+            yield cursor
+        finally:
+            self._release()
+
+    def open_cursor(self):
+        """
+        Returns a dedicated read cursor that can be used from any thread, e.g.
+        by a streaming response. It counts as active until release_cursor.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            cursor = self._open().cursor()
+            self._acquire("read", started)
+        return cursor
+
+    def release_cursor(self, cursor):
+        """Closes a cursor from open_cursor."""
+        cursor.close()
+        self._release()
+
+    @contextmanager
+    def writer(self):
+        """
+        Yields the writer connection once every write queued before this one
+        has finished. Writes are serialized; reads keep running.
+        """
+        started = time.perf_counter()
+        with self._write_turn:
+            ticket = next(self._tickets)
+            self._queued += 1
+            while ticket != self._serving:
+                self._write_turn.wait()
+        try:
+            with self._lock:
+                conn = self._open()
+                self._acquire("write", started)
+            try:
+                yield conn
+            finally:
+                self._release()
+        finally:
+            with self._write_turn:
+                self._queued -= 1
+                self._serving += 1
+                self._write_turn.notify_all()
+
+    def close(self, timeout: float = None):
+        """Closes the handle once the cursors in use are released, e.g. at shutdown."""
+        with self._lock:
+            self._idle.wait_for(lambda: self._active == 0, timeout)
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._conn is not None and self._active == 0:
+                self._close_handle()
+
+    def stats(self):
+        """
+        Pool metrics: opens/closes of the database handle, reads and writes
+        served with their total and maximum wait times, active cursors, writes
+        waiting in the queue and whether the handle is open.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["active_cursors"] = self._active
+            stats["queued_writes"] = self._queued
+            stats["thread_cursors"] = len(self._cursors)
+            stats["open"] = self._conn is not None
+        return stats
@@ -1,203 +1,578 @@
 import duckdb
-import datetime
+import io
+import time
 from typing import List
 import os
 import pandas as pd
+from kp_forecaster.config import (
+    PRODUCT_TABLE, DAILY_SALES_TABLE, FORECAST_RESULTS_TABLE, FORECAST_LATEST_TABLE
+)
+from kp_forecaster.feature_store import ensure_feature_store, refresh_product_features, refresh_features_after_append
+from kp_forecaster.data_source import (
+    ensure_product_dimension, register_products, product_condition, product_histories,
+    ensure_daily_rollup, add_to_daily_rollup, lookup_product_key, product_filter, product_matches
+)
+from kp_forecaster.forecast_store import (
+    ensure_forecast_tables, backfill_latest_forecasts, insert_forecast, register_staged_forecasts, staged_forecasts
+)
+from .connections import ConnectionManager
+from .cache import SeriesCache
 
 from fastapi.middleware.cors import CORSMiddleware  # <-- Add this import
 
 os.makedirs("data", exist_ok=True)
 DUCKDB_FILE = "data/train.duckdb"
 DUCKDB_TABLE = "train_data"
-OUTPUT_TABLE = "forecast_results"
+OUTPUT_TABLE = FORECAST_RESULTS_TABLE
+LATEST_TABLE = FORECAST_LATEST_TABLE
+HISTORY_PAGE_SIZE = 100 # Default number of forecast_history rows per page
+HISTORY_MAX_PAGE_SIZE = 1000
+TRAIN_CACHE_MAX_ENTRIES = 512 # Aggregated train-data series kept in memory
+# Set TRAIN_CACHE_REDIS=1 to share cached series (and the data version) through Redis
+TRAIN_CACHE_REDIS = os.getenv("TRAIN_CACHE_REDIS", "0") == "1"
+TRAIN_CACHE_VERSION_TTL = 1.0 # Seconds an API process reuses the shared data version before re-reading it
+# Seconds without queries after which the database file is closed, so that the
+# Celery worker can open it (None keeps it open). Short, so the file is released
+# between request bursts and a worker's retries (DUCKDB_OPEN_RETRIES) find a gap
+DUCKDB_IDLE_RELEASE = 0.25
+EXPORT_FORMATS = ("csv", "parquet")
+EXPORT_BATCH_ROWS = 50_000 # Rows per Arrow record batch when streaming an export
+INGEST_BATCH_ROWS = 50_000 # Rows per Arrow record batch appended from an upload
+INGEST_BLOCK_BYTES = 8 * 1024 * 1024 # Bytes of CSV parsed at a time from an upload
+
+# Columns read from an upload (train_data without id and product_key), and the
+# SQL that cleans the raw text of those that need more than a cast
+UPLOAD_COLUMNS = ["CHANNEL", "LOKASI", "TANGGAL", "KODE_BARANG", "KLASIFIKASI_BARANG",
+                  "WARNA_BARANG", "UKURAN_BARANG", "BERAT_SATUAN", "JUMLAH", "BERAT_TOTAL"]
+UPLOAD_CLEANING = {
+    "TANGGAL": "CAST(COALESCE(try_strptime(TANGGAL, ['%m/%d/%Y %H:%M:%S', '%m/%d/%Y']), "
+               "TRY_CAST(TANGGAL AS TIMESTAMP)) AS DATE)",
+    "BERAT_SATUAN": "CAST(BERAT_SATUAN AS DOUBLE)",
+    "JUMLAH": "CAST(JUMLAH AS DOUBLE)",
+    "BERAT_TOTAL": "CAST(replace(BERAT_TOTAL, ',', '') AS DOUBLE)",
+}
 
 OUTPUT_DIR = "output"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-conn = duckdb.connect(DUCKDB_FILE)
-
-# Ensure the table exists
-conn.execute(f"""
-CREATE TABLE IF NOT EXISTS {DUCKDB_TABLE} (
-    id INTEGER,
-    CHANNEL TEXT,
-    LOKASI TEXT,
-    TANGGAL DATE,
-    KODE_BARANG TEXT,
-    KLASIFIKASI_BARANG TEXT,
-    WARNA_BARANG TEXT,
-    UKURAN_BARANG TEXT,
-    BERAT_SATUAN FLOAT,
-    JUMLAH INTEGER,
-    BERAT_TOTAL FLOAT
-)
-""")
-
-conn.execute(f"""
-    CREATE SEQUENCE IF NOT EXISTS forecast_history_id_seq START 1;
-    CREATE TABLE IF NOT EXISTS forecast_history (
-        id INTEGER PRIMARY KEY DEFAULT nextval('forecast_history_id_seq'),
-        product_id TEXT,
-        date_start DATE,
-        date_end DATE,
-        csv_path TEXT,
-        timestamp TIMESTAMP DEFAULT NOW()
-    )
-""")
+def import_forecast_csvs(conn):
+    """
+    Copy forecasts that were only saved as CSV files (before forecast_results
+    existed) into forecast_results. Missing files are skipped.
 
-def get_connection():
+    Returns:
+        int: Number of forecasts imported.
     """
-    Create and return a new DuckDB connection.
+    pending = conn.execute(f"""
+    SELECT id, csv_path FROM forecast_history h
+    WHERE NOT EXISTS (SELECT 1 FROM {OUTPUT_TABLE} r WHERE r.forecast_id = h.id)
+    """).fetchall()
+    imported = 0
+    for forecast_id, csv_path in pending:
+        if not csv_path or not os.path.exists(csv_path):
+            continue
+        conn.execute(f"""
+        INSERT INTO {OUTPUT_TABLE}
+        SELECT ?, CAST(TANGGAL AS DATE), CAST(TOTAL_JUMLAH AS DOUBLE) FROM read_csv_auto(?)
+        """, [forecast_id, csv_path])
+        imported += 1
+    if imported:
+        print(f"Imported {imported} forecast CSV files into {OUTPUT_TABLE}")
+    return imported
+
+# One database handle shared by all request threads, released when idle
+db_pool = ConnectionManager(DUCKDB_FILE, idle_release=DUCKDB_IDLE_RELEASE)
+
+def make_train_cache():
+    """
+    Cache of aggregated train-data series, Redis-backed if TRAIN_CACHE_REDIS is set.
+    """
+    redis_client = None
+    if TRAIN_CACHE_REDIS:
+        from redis import Redis
+        redis_client = Redis(host=os.getenv("REDIS_HOST", "localhost"), port=int(os.getenv("REDIS_PORT", 6379)),
+                             socket_timeout=0.5)
+    return SeriesCache(TRAIN_CACHE_MAX_ENTRIES, redis_client, namespace="train-data",
+                       version_ttl=TRAIN_CACHE_VERSION_TTL)
+
+# Daily train-data series by product and date range; invalidated by every upload
+train_cache = make_train_cache()
+
+def get_cache_stats():
     """
-    return duckdb.connect(DUCKDB_FILE)
+    Hit/miss metrics of the train-data series cache.
+    """
+    return train_cache.stats()
 
-def validate_and_append_to_db(file_path: str):
+def get_pool_stats():
     """
-    Validate and append data from the uploaded file to the DuckDB table.
+    Metrics of the shared DuckDB connection (waits, active cursors, queued writes).
     """
-    conn = get_connection()  # Create a new connection
-    conn.execute(f"CREATE TEMPORARY TABLE temp_upload AS SELECT * FROM read_csv_auto('{file_path}')")
+    return db_pool.stats()
+
+with db_pool.writer() as conn:
+    # Ensure the table exists
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {DUCKDB_TABLE} (
+        id INTEGER,
+        CHANNEL TEXT,
+        LOKASI TEXT,
+        TANGGAL DATE,
+        KODE_BARANG TEXT,
+        KLASIFIKASI_BARANG TEXT,
+        WARNA_BARANG TEXT,
+        UKURAN_BARANG TEXT,
+        BERAT_SATUAN FLOAT,
+        JUMLAH INTEGER,
+        BERAT_TOTAL FLOAT
+    )
+    """)
 
-    min_date, max_date = conn.execute("""
-    SELECT MIN(TANGGAL), MAX(TANGGAL) FROM temp_upload
-    """).fetchone()
+    # forecast_history, forecast_results, forecast_latest and forecast_staging
+    ensure_forecast_tables(conn)
+    backfill_latest_forecasts(conn)
+    import_forecast_csvs(conn)
 
-    overlapping_data = conn.execute(f"""
-    SELECT *
-    FROM {DUCKDB_TABLE}
-    WHERE TANGGAL BETWEEN CAST('{min_date}' AS DATE) AND CAST('{max_date}' AS DATE)
-    """).fetchall()
+    # Forecasts workers staged while the API held the database
+    register_staged_forecasts(conn, DUCKDB_FILE)
 
-    if overlapping_data:
-        raise ValueError("Uploaded data contains overlapping dates with existing data.")
+    # Integer product keys for train_data rows
+    ensure_product_dimension(conn)
 
-    conn.execute(f"INSERT INTO {DUCKDB_TABLE} SELECT * FROM temp_upload")
-    conn.close()  # Close the connection
+    # Daily totals per product, read instead of the raw transactions
+    ensure_daily_rollup(conn)
 
-def preprocess_uploaded_file(file_path: str) -> str:
+    # Materialized per-product features used as the pipeline's training matrix
+    ensure_feature_store(conn)
+
+def validate_and_append_to_db(file_path: str, batch_rows: int = INGEST_BATCH_ROWS):
     """
-    Preprocess the uploaded Excel or CSV file:
-    - Reads .xls/.xlsx/.csv
-    - Converts TANGGAL to datetime
-    - Drops MATCH, BULAN, TAHUN columns if present
-    - Returns path to processed CSV file
+    Validate and append the uploaded file to the DuckDB table in one streaming pass.
+
+    Record batches from iter_upload_batches are cleaned in SQL (TANGGAL parsing,
+    BERAT_TOTAL comma stripping) and appended to train_data inside a single
+    transaction, so memory is bounded by the batch size rather than the file
+    size. The upload is rolled back if it overlaps dates already in the table.
+
+    Returns:
+        dict: rows, rows_without_date, batches, seconds and rows_per_second of the ingestion.
+    """
+    with db_pool.writer() as conn:
+        stats = _append_upload(conn, file_path, batch_rows)
+    print(f"Ingested {stats['rows']} rows in {stats['batches']} batches ({stats['rows_per_second']} rows/s)")
+    return stats
+
+def _append_upload(conn, file_path: str, batch_rows: int):
+    start = time.perf_counter()
+    columns = ", ".join(UPLOAD_COLUMNS)
+    cleaned = ", ".join(UPLOAD_CLEANING.get(col, col) + f" AS {col}" for col in UPLOAD_COLUMNS)
+    upload = f"(SELECT id, {cleaned} FROM upload_batch)"
+    matches = product_matches("t")  # Matches NULL ID columns too, so no row is dropped by the join
+
+    try:
+        conn.execute("BEGIN TRANSACTION")
+        rows, dated, batches, min_date, max_date, product_ids = 0, 0, 0, None, None, set()
+        for batch in iter_upload_batches(file_path, batch_rows):
+            # Cleaned straight from the Arrow batch; a temporary table per batch
+            # would be kept alive by the transaction until it commits
+            conn.register("upload_batch", batch)
+
+            # Key the uploaded rows by product, adding new products to the dimension first
+            register_products(conn, upload)
+            batch_rows_inserted = conn.execute(f"""
+            INSERT INTO {DUCKDB_TABLE} (id, {columns}, product_key)
+            SELECT t.id, {", ".join(f"t.{col}" for col in UPLOAD_COLUMNS)}, p.product_key
+            FROM {upload} t JOIN {PRODUCT_TABLE} p ON {matches}
+            """).fetchone()[0]
+            batch_min, batch_max, batch_dated, batch_products = conn.execute(f"""
+            SELECT MIN(t.TANGGAL), MAX(t.TANGGAL), COUNT(t.TANGGAL), list(DISTINCT p.product_id)
+            FROM {upload} t JOIN {PRODUCT_TABLE} p ON {matches}
+            """).fetchone()
+            conn.unregister("upload_batch")
+            if batch_min is not None:
+                min_date = batch_min if min_date is None else min(min_date, batch_min)
+                max_date = batch_max if max_date is None else max(max_date, batch_max)
+            product_ids.update(batch_products or [])
+            rows += batch_rows_inserted
+            dated += batch_dated
+            batches += 1
+
+        # Every inserted row with a date lies within [min_date, max_date]; any
+        # other row there is an overlap (rows whose TANGGAL did not parse are NULL)
+        if min_date is not None:
+            in_range = conn.execute(f"""
+            SELECT COUNT(*) FROM {DUCKDB_TABLE} WHERE TANGGAL BETWEEN ? AND ?
+            """, [min_date, max_date]).fetchone()[0]
+            if in_range > dated:
+                raise ValueError("Uploaded data contains overlapping dates with existing data.")
+            add_to_daily_rollup(conn, min_date, max_date)
+        conn.execute("COMMIT")
+    except Exception as e:
+        conn.execute("ROLLBACK")
+        if isinstance(e, duckdb.ConversionException):
+            raise ValueError(f"Preprocessing failed: {e}")
+        raise
+    # The rows are committed; cached training data is stale even if the refresh below fails
+    train_cache.bump_version()
+
+    # Extend the materialized features of the uploaded products with the new dates. A
+    # failure leaves the upload in place: missing rows are built when a product is forecast
+    if min_date is not None:
+        try:
+            refresh_features_after_append(conn, sorted(product_ids), min_date)
+        except Exception as e:
+            print(f"WARNING: Could not refresh features after the upload: {e}")
+
+    if rows > dated:
+        print(f"WARNING: {rows - dated} uploaded rows have a TANGGAL that could not be parsed; stored without a date")
+    seconds = time.perf_counter() - start
+    return {"rows": rows, "rows_without_date": rows - dated, "batches": batches, "seconds": round(seconds, 3),
+            "rows_per_second": round(rows / seconds) if seconds > 0 else None}
+
+def refresh_features(product_id: str):
+    """
+    Materialize any missing feature rows for a product before it is forecast.
+    """
+    with db_pool.writer() as conn:
+        return refresh_product_features(conn, product_id)
+
+def get_product_histories():
+    """
+    History span (first/last sale date, days) of every product in train_data.
+    """
+    with db_pool.reader() as conn:
+        return product_histories(conn)
+
+def iter_upload_batches(file_path: str, batch_rows: int = INGEST_BATCH_ROWS):
     """
-    import pandas as pd
-    import os
+    Read an uploaded .csv/.xlsx/.xls file as Arrow record batches of raw text.
+
+    Only the train_data columns are kept (MATCH, BULAN, TAHUN and any other
+    extra column are dropped), all as strings so that cleaning and type
+    conversion happen in validate_and_append_to_db. Each batch carries an id
+    column with the row's position in the file.
+
+    CSV files are read with the Arrow streaming reader and .xlsx files with
+    openpyxl in read-only mode, so neither is loaded whole; .xls files can only
+    be read whole and are then split into batches.
+
+    Raises:
+        ValueError: If the file type is unsupported or a column is missing.
+
+    Yields:
+        pyarrow.RecordBatch: Up to batch_rows rows.
+    """
+    import pyarrow as pa
 
     ext = os.path.splitext(file_path)[-1].lower()
-    if ext in [".xls", ".xlsx"]:
-        df = pd.read_excel(file_path)
-    elif ext == ".csv":
-        df = pd.read_csv(file_path)
+    offset = 0
+
+    def with_id(batch):
+        ids = pa.array(range(offset, offset + len(batch)), type=pa.int32())
+        return pa.RecordBatch.from_arrays([ids] + batch.columns, names=["id"] + batch.schema.names)
+
+    if ext == ".csv":
+        batches = _iter_csv_batches(file_path, batch_rows)
+    elif ext == ".xlsx":
+        batches = _iter_xlsx_batches(file_path, batch_rows)
+    elif ext == ".xls":
+        df = pd.read_excel(file_path, dtype=str)
+        _check_upload_columns(df.columns)
+        table = pa.Table.from_pandas(df[UPLOAD_COLUMNS], preserve_index=False)
+        batches = iter(table.to_batches(batch_rows))
     else:
         raise ValueError("Unsupported file type for preprocessing.")
 
-    # Try to parse TANGGAL with the expected format, fallback to auto
-    try:
-        df['TANGGAL'] = pd.to_datetime(df['TANGGAL'], format='%m/%d/%Y %H:%M:%S')
-    except Exception:
-        df['TANGGAL'] = pd.to_datetime(df['TANGGAL'], errors='coerce')
-
-    # Drop MATCH, BULAN, TAHUN if present
-    for col in ['MATCH', 'BULAN', 'TAHUN']:
-        if col in df.columns:
-            df = df.drop(columns=[col])
+    for batch in batches:
+        yield with_id(batch)
+        offset += len(batch)
 
-    df['BERAT_TOTAL'] = df['BERAT_TOTAL'].astype(str).str.replace(',', '').astype(float)
+def _iter_csv_batches(file_path: str, batch_rows: int):
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
 
-    # Save to a new processed CSV file
-    processed_path = file_path.rsplit('.', 1)[0] + "_processed.csv"
-    df.to_csv(processed_path)
-    return processed_path
+    # Arrow reports missing columns and malformed rows when a block is read
+    try:
+        reader = pa_csv.open_csv(
+            file_path,
+            read_options=pa_csv.ReadOptions(block_size=INGEST_BLOCK_BYTES),
+            convert_options=pa_csv.ConvertOptions(
+                column_types={col: pa.string() for col in UPLOAD_COLUMNS},
+                include_columns=UPLOAD_COLUMNS,
+                strings_can_be_null=True,
+            ),
+        )
+        for block in reader:
+            yield from pa.Table.from_batches([block]).to_batches(batch_rows)
+    except (pa.ArrowInvalid, pa.ArrowKeyError) as e:
+        raise ValueError(f"Invalid CSV upload: {e}")
+
+def _check_upload_columns(columns):
+    missing = [col for col in UPLOAD_COLUMNS if col not in columns]
+    if missing:
+        raise ValueError(f"Uploaded file is missing columns: {missing}")
+
+def _iter_xlsx_batches(file_path: str, batch_rows: int):
+    import pyarrow as pa
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(name) for name in next(rows, ())]
+        _check_upload_columns(header)
+        positions = [header.index(col) for col in UPLOAD_COLUMNS]
+
+        def to_batch(chunk):
+            arrays = [pa.array([None if row[i] is None else str(row[i]) for row in chunk], type=pa.string())
+                      for i in positions]
+            return pa.RecordBatch.from_arrays(arrays, names=UPLOAD_COLUMNS)
+
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == batch_rows:
+                yield to_batch(chunk)
+                chunk = []
+        if chunk:
+            yield to_batch(chunk)
+    finally:
+        workbook.close()
 
 def get_all_data():
     """
     Fetch all data from the DuckDB table.
     """
-    conn = get_connection()  # Create a new connection
-    query = f"SELECT * FROM {DUCKDB_TABLE} ORDER BY TANGGAL"
-    df = conn.execute(query).fetchdf()
-    conn.close()  # Close the connection
-    return df
+    query = f"SELECT * EXCLUDE (product_key) FROM {DUCKDB_TABLE} ORDER BY TANGGAL"
+    with db_pool.reader() as conn:
+        return conn.execute(query).fetchdf()
 
-def get_data(target_product_id: str):
+class _ChunkSink(io.RawIOBase):
     """
-    Fetch data for the specified product ID from the DuckDB table.
+    Write-only stream that hands out what was written since the last drain.
+    tell() keeps counting across drains, as the Parquet writer needs real offsets.
     """
-    conn = get_connection()  # Create a new connection
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def export_train_data(fmt: str = "csv", product_id: str = None, start_date=None, end_date=None,
+                      batch_rows: int = EXPORT_BATCH_ROWS):
+    """
+    Stream train_data as CSV or Parquet, one DuckDB Arrow record batch at a time.
+
+    The product and date filters are pushed down into the query, and each record
+    batch is encoded and handed out before the next one is fetched, so memory
+    stays flat regardless of table size. The format and product ID are validated
+    before this returns, so invalid filters raise here rather than mid-stream;
+    the cursor is only opened once the stream is iterated, so a response that is
+    never sent (e.g. the client disconnected) holds no cursor.
+
+    Args:
+        fmt (str): 'csv' or 'parquet'.
+        product_id (str, optional): Only export this product.
+        start_date, end_date (date, optional): Only export rows within these dates.
+        batch_rows (int): Rows per record batch.
+
+    Returns:
+        Iterator[bytes]: Encoded chunks of the export.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Invalid format. Expected one of {list(EXPORT_FORMATS)}.")
+    if product_id:
+        product_filter(product_id)  # Validates the format
+    return _encode_batches(fmt, product_id, start_date, end_date, batch_rows)
+
+def _encode_batches(fmt: str, product_id, start_date, end_date, batch_rows: int):
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+
+    conn = db_pool.open_cursor()
     try:
-        kode_barang, klasifikasi_barang, warna_barang, ukuran_barang = target_product_id.split("_")
-    except ValueError:
-        raise ValueError("Invalid target_product_id format. Expected format: KODE_BARANG_KLASIFIKASI_BARANG_WARNA_BARANG_UKURAN_BARANG")
+        conditions, params = [], []
+        if product_id:
+            condition, condition_params = product_condition(conn, product_id)
+            conditions.append(condition)
+            params += condition_params
+        if start_date:
+            conditions.append("TANGGAL >= ?")
+            params.append(start_date)
+        if end_date:
+            conditions.append("TANGGAL <= ?")
+            params.append(end_date)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        query = f"SELECT * EXCLUDE (product_key) FROM {DUCKDB_TABLE} {where} ORDER BY TANGGAL"
+        reader = conn.execute(query, params).fetch_record_batch(batch_rows)
+
+        sink = _ChunkSink()
+        if fmt == "parquet":
+            writer = pq.ParquetWriter(sink, reader.schema)
+        else:
+            writer = pa_csv.CSVWriter(sink, reader.schema)
+        for batch in reader:
+            writer.write_batch(batch)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+        writer.close()
+        yield sink.drain()
+    finally:
+        db_pool.release_cursor(conn)
 
-    query = f"""
-    SELECT * FROM {DUCKDB_TABLE}
-    WHERE KODE_BARANG = '{kode_barang}'
-      AND KLASIFIKASI_BARANG = '{klasifikasi_barang}'
-      AND WARNA_BARANG = '{warna_barang}'
-      AND UKURAN_BARANG = '{ukuran_barang}'
+def get_data(target_product_id: str):
+    """
+    Fetch data for the specified product ID from the DuckDB table.
     """
-    df = conn.execute(query).fetchdf()
-    conn.close()  # Close the connection
-    return df
+    with db_pool.reader() as conn:
+        try:
+            condition, params = product_condition(conn, target_product_id)
+        except ValueError:
+            raise ValueError("Invalid target_product_id format. Expected format: KODE_BARANG_KLASIFIKASI_BARANG_WARNA_BARANG_UKURAN_BARANG")
+
+        query = f"""
+        SELECT * EXCLUDE (product_key) FROM {DUCKDB_TABLE}
+        WHERE {condition}
+        """
+        return conn.execute(query, params).fetchdf()
 
 def append_forecast_results(product_id: str, rows: List[dict]):
-    conn = get_connection()
-
-    # Determine the date range
-    date_start = min(row.TANGGAL for row in rows)
-    date_end = max(row.TANGGAL for row in rows)
+    """
+    Store a forecast sent as JSON rows (the /internal/store-forecast path):
+    one forecast_history row plus its daily rows in forecast_results,
+    bulk-inserted in a single statement and transaction.
 
-    # Save results to a CSV file
-    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-    csv_filename = f"{product_id}_{date_start}_to_{date_end}_{timestamp}.csv"
-    csv_path = os.path.join(OUTPUT_DIR, csv_filename)
+    Returns:
+        int: ID of the new forecast.
+    """
     df = pd.DataFrame({
-        "TANGGAL": [row.TANGGAL for row in rows],
-        "TOTAL_JUMLAH": [row.TOTAL_JUMLAH for row in rows]
+        "TANGGAL": pd.to_datetime([row.TANGGAL for row in rows]),
+        "TOTAL_JUMLAH": [float(row.TOTAL_JUMLAH) for row in rows]
     })
-    df.to_csv(csv_path, index=False)
-
-    # Insert into forecast_history table
-    conn.execute(
-        f"""
-        INSERT INTO forecast_history (product_id, date_start, date_end, csv_path)
-        VALUES (?, ?, ?, ?)
-        """,
-        [product_id, date_start, date_end, csv_path]
-    )
-    conn.close()
 
-def get_history_forecast(as_dict: bool = False):
+    with db_pool.writer() as conn:
+        conn.execute("BEGIN TRANSACTION")
+        try:
+            conn.register("forecast_rows", df)
+            forecast_id = insert_forecast(conn, product_id, "forecast_rows")
+            conn.unregister("forecast_rows")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return forecast_id
+
+def register_forecasts(stage_keys: List[str] = None):
+    """
+    Store forecasts that workers staged as Parquet files while the API held
+    the database (all of them by default).
+
+    Returns:
+        dict: Stage key -> forecast ID.
+    """
+    with db_pool.writer() as conn:
+        return register_staged_forecasts(conn, DUCKDB_FILE, stage_keys)
+
+HISTORY_COLUMNS = """
+    h.id, h.product_id,
+    h.date_start::TEXT as date_start,
+    h.date_end::TEXT as date_end,
+    h.csv_path,
+    h.timestamp::TEXT as timestamp
+"""
+
+def get_history_forecast(as_dict: bool = False, product_id: str = None, since=None, until=None,
+                         before: int = None, limit: int = HISTORY_PAGE_SIZE):
     """
-    Fetch the forecast history from the database.
+    Fetch one page of the forecast history, newest first.
+
+    Filters run in SQL (product_id through the (product_id, timestamp) index).
+    Pages are keyset-paginated on the forecast ID, which grows with the
+    timestamp: pass the last ID of a page as `before` to get the next one, so
+    every page costs the same however long the history is.
 
     Args:
         as_dict (bool): If True, return the result as a list of dictionaries. 
                         Otherwise, return as a list of tuples.
+        product_id (str, optional): Only forecasts of this product.
+        since, until (date, optional): Only forecasts made on or between these dates.
+        before (int, optional): Only forecasts with a smaller ID.
+        limit (int): Maximum number of rows, at most HISTORY_MAX_PAGE_SIZE.
 
     Returns:
         List[dict] or List[tuple]: The forecast history data.
     """
-    conn = get_connection()
+    conditions, params = [], []
+    if product_id:
+        conditions.append("h.product_id = ?")
+        params.append(product_id)
+    if since:
+        conditions.append("h.timestamp >= CAST(? AS DATE)")
+        params.append(since)
+    if until:
+        conditions.append("h.timestamp < CAST(? AS DATE) + INTERVAL 1 DAY")
+        params.append(until)
+    if before is not None:
+        conditions.append("h.id < ?")
+        params.append(before)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    if staged_forecasts(DUCKDB_FILE):
+        register_forecasts()
     query = f"""
-    SELECT id, product_id, 
-           date_start::TEXT as date_start, 
-           date_end::TEXT as date_end, 
-           csv_path, 
-           timestamp::TEXT as timestamp
-    FROM forecast_history
-    """
-    cursor = conn.execute(query)
-    result = cursor.fetchall()
+    SELECT {HISTORY_COLUMNS}
+    FROM forecast_history h
+    {where}
+    ORDER BY h.id DESC
+    LIMIT ?
+    """
+    with db_pool.reader() as conn:
+        cursor = conn.execute(query, params + [min(limit, HISTORY_MAX_PAGE_SIZE)])
+        result = cursor.fetchall()
+        columns = [desc[0] for desc in cursor.description]
     
     if as_dict:
-        columns = [desc[0] for desc in cursor.description]
-        conn.close()
         return [dict(zip(columns, row)) for row in result]
     
-    conn.close()
+    return result
+
+def get_latest_forecasts(as_dict: bool = False):
+    """
+    Fetch the newest forecast_history entry of every product, by product ID.
+
+    Returns:
+        List[dict] or List[tuple]: One forecast history row per product.
+    """
+    if staged_forecasts(DUCKDB_FILE):
+        register_forecasts()
+    query = f"""
+    SELECT {HISTORY_COLUMNS}
+    FROM {LATEST_TABLE} l
+    JOIN forecast_history h ON h.id = l.forecast_id
+    ORDER BY h.product_id
+    """
+    with db_pool.reader() as conn:
+        cursor = conn.execute(query)
+        result = cursor.fetchall()
+        columns = [desc[0] for desc in cursor.description]
+
+    if as_dict:
+        return [dict(zip(columns, row)) for row in result]
+
     return result
 
 def get_forecast_by_id(forecast_id: int):
@@ -208,21 +583,36 @@ def get_forecast_by_id(forecast_id: int):
         forecast_id (int): The ID of the forecast to fetch.
 
     Returns:
-        pd.DataFrame: A DataFrame containing the forecast results.
+        pd.DataFrame: TANGGAL and TOTAL_JUMLAH of the forecast, by date.
     """
-    conn = get_connection()
     query = f"""
-    SELECT * FROM {OUTPUT_TABLE}
-    WHERE id = {forecast_id}
+    SELECT TANGGAL, TOTAL_JUMLAH FROM {OUTPUT_TABLE}
+    WHERE forecast_id = ?
+    ORDER BY TANGGAL
     """
-    df = conn.execute(query).fetchdf()
-    conn.close()
-    return df
+    with db_pool.reader() as conn:
+        return conn.execute(query, [forecast_id]).fetchdf()
+
+def export_forecast_csv(forecast_id: int):
+    """
+    Render a stored forecast as CSV (TANGGAL,TOTAL_JUMLAH), the format the
+    per-run CSV files used to have.
+
+    Returns:
+        str or None: The CSV text, or None if the forecast does not exist.
+    """
+    df = get_forecast_by_id(forecast_id)
+    if df.empty:
+        return None
+    df["TANGGAL"] = pd.to_datetime(df["TANGGAL"]).dt.strftime("%Y-%m-%d")
+    return df.to_csv(index=False)
 
 def get_train_data_by_product_id(start_data: str, end_date:str, product_id: str):
     """
     Fetch train data for a specific product ID within a date range.
 
+    Results are served from train_cache until the next upload.
+
     Args:
         start_date (str): The start date in 'YYYY-MM-DD' format.
         end_date (str): The end date in 'YYYY-MM-DD' format.
@@ -231,62 +621,88 @@ def get_train_data_by_product_id(start_data: str, end_date:str, product_id: str)
     Returns:
         List[dict]: A list of dictionaries containing the train data.
     """
-    conn = get_connection()
-    kode_barang, klasifikasi_barang, warna_barang, ukuran_barang = product_id.split("_")
-    query = f"""
-    SELECT TANGGAL::TEXT as TANGGAL, SUM(BERAT_TOTAL) as JUMLAH
-    FROM {DUCKDB_TABLE}
-    WHERE TANGGAL BETWEEN '{start_data}' AND '{end_date}'
-      AND KODE_BARANG = '{kode_barang}'
-      AND KLASIFIKASI_BARANG = '{klasifikasi_barang}'
-      AND WARNA_BARANG = '{warna_barang}'
-      AND UKURAN_BARANG = '{ukuran_barang}'
-    GROUP BY TANGGAL
-    ORDER BY TANGGAL
+    return train_cache.get_or_load(
+        ("daily", product_id, str(start_data), str(end_date)),
+        lambda: _query_train_data(start_data, end_date, product_id)
+    )
+
+def get_product_data_version(product_id: str):
     """
-    cursor = conn.execute(query)
-    result = cursor.fetchall()
-    
-    columns = [desc[0] for desc in cursor.description]
-    conn.close()
+    Version of a product's train data: its row count, last sale date and
+    total from the daily rollup. Uploads only append, so any upload touching
+    the product changes it, while uploads of other products do not.
+
+    Returns:
+        str: Data version, identical as long as the product's data is unchanged.
+    """
+    product_filter(product_id)  # Validates the format
+    with db_pool.reader() as conn:
+        rows, last_date, total = conn.execute(f"""
+        SELECT COALESCE(SUM(row_count), 0), MAX(TANGGAL), SUM(total_weight)
+        FROM {DAILY_SALES_TABLE}
+        WHERE product_key = ?
+        """, [lookup_product_key(conn, product_id)]).fetchone()
+    return f"{rows}:{last_date}:{total}"
+
+def _query_train_data(start_data, end_date, product_id: str):
+    product_filter(product_id)  # Validates the format
+    # Days with transactions, from the daily rollup
+    with db_pool.reader() as conn:
+        query = f"""
+        SELECT TANGGAL::TEXT as TANGGAL, total_weight as JUMLAH
+        FROM {DAILY_SALES_TABLE}
+        WHERE product_key = ?
+          AND TANGGAL BETWEEN ? AND ?
+          AND row_count > 0
+        ORDER BY TANGGAL
+        """
+        cursor = conn.execute(query, [lookup_product_key(conn, product_id), start_data, end_date])
+        result = cursor.fetchall()
+        columns = [desc[0] for desc in cursor.description]
     
     return [dict(zip(columns, row)) for row in result]
 
 def get_forecast_history_by_id(forecast_id: int):
     """
-    Fetch forecast history by ID.
+    Fetch a forecast_history entry with its forecast rows, in one query.
 
     Args:
         forecast_id (int): The ID of the forecast to fetch.
 
     Returns:
-        pd.DataFrame: A DataFrame containing the forecast history.
+        dict or None: product_id, date_start, date_end, timestamp and the
+                      forecast as a list of {TANGGAL, TOTAL_JUMLAH}, or None if
+                      the ID does not exist.
     """
-    conn = get_connection()
     query = f"""
-    SELECT * FROM forecast_history
-    WHERE id = {forecast_id}
-    LIMIT 1
+    SELECT h.product_id,
+           strftime(h.date_start, '%Y-%m-%d') AS date_start,
+           strftime(h.date_end, '%Y-%m-%d') AS date_end,
+           strftime(h.timestamp, '%Y-%m-%d %H:%M:%S') AS timestamp,
+           strftime(r.TANGGAL, '%Y-%m-%d') AS TANGGAL,
+           r.TOTAL_JUMLAH
+    FROM forecast_history h
+    LEFT JOIN {OUTPUT_TABLE} r ON r.forecast_id = h.id
+    WHERE h.id = ?
+    ORDER BY r.TANGGAL
     """
-    df = conn.execute(query).fetchdf()
-
-    csv_path = df['csv_path'].values[0]
-    df_forecast = pd.read_csv(csv_path)
-
-    # Convert the DataFrame to a list of dictionaries
-    df_forecast = df_forecast.to_dict(orient='records')
-
-    data = {
-        "product_id": df['product_id'].values[0],
-        "date_start": pd.to_datetime(df['date_start'].values[0]).strftime("%Y-%m-%d"),
-        "date_end": pd.to_datetime(df['date_end'].values[0]).strftime("%Y-%m-%d"),
-        "timestamp": pd.to_datetime(df['timestamp'].values[0]).strftime("%Y-%m-%d %H:%M:%S"),
-        "forecast": df_forecast
+    with db_pool.reader() as conn:
+        rows = conn.execute(query, [forecast_id]).fetchall()
+    if not rows:
+        return None
+
+    product_id, date_start, date_end, timestamp = rows[0][:4]
+    return {
+        "product_id": product_id,
+        "date_start": date_start,
+        "date_end": date_end,
+        "timestamp": timestamp,
+        "forecast": [
+            {"TANGGAL": day, "TOTAL_JUMLAH": value}
+            for *_, day, value in rows if day is not None
+        ],
     }
 
-    conn.close()
-    return data
-
 # If you have a FastAPI app instance, add CORS middleware setup here.
 # Example (add this to your FastAPI main.py or where your app is created):
 
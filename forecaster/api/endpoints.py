@@ -1,19 +1,30 @@
-from fastapi import APIRouter, UploadFile, Form, HTTPException
-from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
-from .tasks import process_csv_task
+from fastapi import APIRouter, UploadFile, HTTPException
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, Response, PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
+from .tasks import (
+    process_csv_task, dispatch_forecast_batch, forecast_batch_progress, forecast_jobs, forecast_job_state,
+    get_job_stats, get_stage_metrics, FORECAST_COUNTDOWN, QUEUED_STATE
+)
+from .metrics import render_prometheus, stats_families, stage_families
+from .jobs import make_job_key, JOB_DONE
+from kp_forecaster.config import FORECAST_STRATEGIES, FORECAST_STRATEGY, FUTURE_STEPS
+from kp_forecaster.pipeline import make_config, plan_batch_chunks
+from kp_forecaster.data_source import make_data_source, product_filter
 from .db import (
-    validate_and_append_to_db, get_data, append_forecast_results, get_history_forecast,
-    get_train_data_by_product_id, get_forecast_history_by_id, get_all_data,
-    preprocess_uploaded_file  # <-- import the new function
+    validate_and_append_to_db, append_forecast_results, get_history_forecast,
+    get_train_data_by_product_id, get_forecast_history_by_id, export_train_data,
+    refresh_features, get_product_histories, register_forecasts, get_pool_stats, get_cache_stats, export_forecast_csv, get_latest_forecasts,
+    get_product_data_version, DUCKDB_FILE, HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE
 )
 import os
-from datetime import date, timedelta
+import re
+from datetime import date
 from pydantic import BaseModel
-import pandas as pd
-from io import StringIO
+from celery.utils import uuid
 
 # Directory to save uploaded and processed files
 UPLOAD_DIR = "uploads"
+UPLOAD_CHUNK_BYTES = 1024 * 1024 # Bytes read from the request at a time when saving an upload
 OUTPUT_DIR = "output"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -29,9 +40,10 @@ class StoreForecast(BaseModel):
     results: list[ForecastRow]
 
 @router.post("/internal/store-forecast")
-async def store_forecast(payload: StoreForecast):
+def store_forecast(payload: StoreForecast):
     """
-    Internal endpoint: Celery calls this to persist forecast results.
+    Internal endpoint: persists forecast results sent as JSON (workers store
+    theirs directly, see tasks.store_forecast_results).
     """
     try:
         append_forecast_results(payload.product_id, payload.results)
@@ -40,6 +52,58 @@ async def store_forecast(payload: StoreForecast):
         raise HTTPException(status_code=500, detail=str(e))
     return {"status": "ok"}
 
+class StagedForecasts(BaseModel):
+    stage_keys: list[str]
+
+@router.post("/internal/register-forecasts")
+def register_staged(payload: StagedForecasts):
+    """
+    Internal endpoint: Celery calls this when it staged a forecast it could not
+    store itself because the API had the database open.
+    """
+    return register_forecasts(payload.stage_keys)
+
+@router.get("/internal/db-pool")
+async def db_pool_stats():
+    """
+    Internal endpoint: metrics of the shared DuckDB connection.
+    """
+    return get_pool_stats()
+
+@router.get("/internal/job-stats")
+async def job_stats():
+    """
+    Internal endpoint: forecast tasks started and duplicate requests coalesced.
+    """
+    return get_job_stats()
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """
+    Prometheus scrape endpoint: DuckDB pool, train-data cache and forecast
+    job registry stats, and the pipeline stage totals of the workers.
+    """
+    families = (
+        stats_families("db_pool", get_pool_stats(), counters=(
+            "opens", "closes", "reads", "writes", "read_wait_seconds", "write_wait_seconds"),
+            help_text="DuckDB connection pool")
+        + stats_families("train_cache", get_cache_stats(), counters=(
+            "hits", "redis_hits", "misses", "evictions", "stale", "redis_errors"),
+            help_text="Train-data series cache")
+        + stats_families("forecast_jobs", get_job_stats(), counters=(
+            "submitted", "coalesced_running", "coalesced_done", "coalesced", "resubmitted", "expired_pending", "redis_errors"),
+            help_text="Forecast job registry")
+        + stage_families(get_stage_metrics())
+    )
+    return PlainTextResponse(render_prometheus(families), media_type="text/plain; version=0.0.4")
+
+@router.get("/internal/cache-stats")
+async def cache_stats():
+    """
+    Internal endpoint: hit/miss metrics of the train-data cache.
+    """
+    return get_cache_stats()
+
 @router.post("/upload/")
 async def upload_train_csv(
     file: UploadFile = UploadFile(...)
@@ -47,93 +111,155 @@ async def upload_train_csv(
     """
     Endpoint to upload a train CSV file and start processing it asynchronously.
     """
+    # Stream the upload to disk instead of holding the whole request in memory
     file_path = os.path.join(UPLOAD_DIR, file.filename)
     with open(file_path, "wb") as f:
-        f.write(await file.read())
-
-    # Preprocess the uploaded file (Excel/CSV) before validation/append
-    try:
-        processed_path = preprocess_uploaded_file(file_path)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Preprocessing failed: {e}")
+        while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+            f.write(chunk)
 
-    # Validate and append data to DuckDB
+    # Parse, clean and append the file to DuckDB batch by batch
     try:
-        validate_and_append_to_db(processed_path)
+        stats = await run_in_threadpool(validate_and_append_to_db, file_path)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
     return JSONResponse(
-        {"message": "File uploaded and processed successfully."},
+        {"message": "File uploaded and processed successfully.", "ingestion": stats},
         status_code=200
     )
 
 # Endpoint to trigger CSV processing
 @router.post("/process-csv/")
-async def process_csv(
+def process_csv(
     target_product_id: str,
     start_date: date = None,
-    end_date: date = None
+    end_date: date = None,
+    strategy: str = FORECAST_STRATEGY
 ):
     """
     Endpoint to process the uploaded CSV file asynchronously.
+    `strategy` selects 'recursive' or 'direct' multi-horizon forecasting.
+
+    The worker reads the product straight from DuckDB; with start_date and
+    end_date, history ends at start_date (zero-filled) and the forecast runs
+    until end_date.
+
+    A request identical to one already queued or running (same product,
+    horizon, strategy, config and product data) returns that task's ID
+    instead of starting another; once it succeeded, its task ID is returned
+    until the product's data changes. See /internal/job-stats.
     """
-    # Start the background task
-    df = get_data(target_product_id)
-
-    if start_date and end_date:
-        df["TANGGAL"] = pd.to_datetime(df["TANGGAL"])  # Ensure TANGGAL is in datetime format
-        
-        # Create date range from a fixed start or earliest available date
-        fill_start = df["TANGGAL"].min()
-        fill_end = pd.to_datetime(start_date) + timedelta(days=1)
-        
-        if fill_start <= fill_end:
-            date_range = pd.date_range(start=fill_start, end=fill_end, freq="D")
-            fill_df = pd.DataFrame({
-                "TANGGAL": date_range,
-                "BERAT_TOTAL": 0  # You can add more columns with 0s or defaults as needed
-            })
-
-            # Filter the original df to only before start_date (optional)
-            df = df[df["TANGGAL"] <= pd.to_datetime(start_date)]
-
-            # Combine
-            df = pd.concat([fill_df, df], ignore_index=True)
-
-        if df.empty:
-            raise HTTPException(status_code=404, detail="No data found for the specified product ID.")
-    
-    file_path = os.path.join(UPLOAD_DIR, "train.csv")
-    df.to_csv(file_path, index=False)
+    if strategy not in FORECAST_STRATEGIES:
+        raise HTTPException(status_code=400, detail=f"Invalid strategy. Expected one of {list(FORECAST_STRATEGIES)}.")
+    try:
+        product_filter(target_product_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
+    data_source = make_data_source(DUCKDB_FILE, target_product_id,
+                                   end_date=start_date if start_date and end_date else None)
     future_step = (end_date - start_date).days if start_date and end_date else 0
-    task = process_csv_task.apply_async(
-        args=[file_path, target_product_id],
-        kwargs={"future_step": future_step},
-        countdown=5  # Delay the task by 5 seconds
+
+    # Identical requests (same product, horizon, config and data) share one task
+    job_key = make_job_key(
+        "process-csv", product_id=target_product_id, future_step=future_step, strategy=strategy,
+        end_date=data_source["end_date"], config=make_config(future_step),
+        data_version=get_product_data_version(target_product_id)
     )
 
-    if not task:
-        raise HTTPException(status_code=500, detail="Task submission failed.")
-    
+    def start(task_id):
+        # The worker reads its training matrix from the feature store, or aggregates the series in DuckDB
+        try:
+            refresh_features(target_product_id)
+            feature_store = DUCKDB_FILE
+        except Exception as e:
+            print(f"WARNING: Could not refresh features for {target_product_id}: {e}")
+            feature_store = None
+
+        process_csv_task.apply_async(
+            args=[None, target_product_id],
+            kwargs={
+                "future_step": future_step,
+                "strategy": strategy,
+                "feature_store": feature_store,
+                "data_source": data_source,
+            },
+            task_id=task_id,
+            countdown=FORECAST_COUNTDOWN
+        )
+
+    try:
+        task_id, existing = forecast_jobs.submit(job_key, uuid(), start, forecast_job_state)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Task submission failed: {e}")
+
+    if existing == JOB_DONE:
+        return JSONResponse(
+            {"message": "Forecast already computed for this data.", "task_id": task_id, "coalesced": True}
+        )
     return JSONResponse(
-        {"message": "CSV processing started.", "task_id": task.id},
+        {
+            "message": "CSV processing already in progress." if existing else "CSV processing started.",
+            "task_id": task_id,
+            "coalesced": existing is not None,
+        },
         status_code=202
     )
 
+@router.post("/forecast-all/")
+def forecast_all(future_step: int = FUTURE_STEPS):
+    """
+    Endpoint to forecast every product with enough history as one batch.
+
+    train_data is scanned once; products too short to fit are skipped before
+    anything is scheduled, the rest are chunked by history length and fanned
+    out to the workers. Track the batch with /forecast-all/{task_id}.
+    """
+    if future_step <= 0:
+        raise HTTPException(status_code=400, detail="future_step must be positive.")
+
+    histories = get_product_histories()
+    chunks, skipped = plan_batch_chunks(histories, make_config(future_step))
+    if not chunks:
+        raise HTTPException(status_code=404, detail="No product has enough history to forecast.")
+
+    result = dispatch_forecast_batch(chunks, skipped, future_step, DUCKDB_FILE)
+    return JSONResponse(
+        {
+            "message": "Forecast-all batch started.",
+            "task_id": result.id,
+            "products": sum(len(chunk) for chunk in chunks),
+            "chunks": len(chunks),
+            "skipped": len(skipped),
+        },
+        status_code=202
+    )
+
+@router.get("/forecast-all/{task_id}")
+async def get_forecast_all_status(task_id: str):
+    """
+    Endpoint to check the progress of a forecast-all batch.
+    """
+    return JSONResponse(forecast_batch_progress(task_id))
+
 # Endpoint to check status task
 @router.get("/task-status/{task_id}")
 async def get_task_status(task_id: str):
     """
-    Endpoint to check the status of a Celery task.
+    Endpoint to check the status of a Celery task. While a forecast runs
+    (state PROGRESS), `progress` holds its pipeline stage metrics so far.
     """
     task = process_csv_task.AsyncResult(task_id)
-    if task.state == "PENDING":
+    if task.state in ("PENDING", QUEUED_STATE):
         response = {
-            "state": task.state,
+            "state": "PENDING",
             "status": "Pending..."
         }
+    elif task.state == "PROGRESS":
+        response = {
+            "state": task.state,
+            "progress": task.info
+        }
     elif task.state != "FAILURE":
         response = {
             "state": task.state,
@@ -147,32 +273,66 @@ async def get_task_status(task_id: str):
     
     return JSONResponse(response)
 
+def history_page(rows, limit: int):
+    """
+    JSON response of a forecast history page. When the page is full, the
+    X-Next-Cursor header holds the `before` value of the next page.
+    """
+    response = JSONResponse(rows)
+    if rows and len(rows) >= min(limit, HISTORY_MAX_PAGE_SIZE):
+        last = rows[-1]
+        response.headers["X-Next-Cursor"] = str(last["id"] if isinstance(last, dict) else last[0])
+    return response
+
 @router.get("/forecast-history/")
-def get_forecast_history():
+def get_forecast_history(
+    product_id: str = None,
+    since: date = None,
+    until: date = None,
+    before: int = None,
+    limit: int = HISTORY_PAGE_SIZE
+):
     """
-    Endpoint to get the forecast history.
+    Endpoint to get the forecast history, newest first, one page at a time.
+    Filter by product_id and/or the dates forecasts were made; follow the
+    X-Next-Cursor header (as `before`) for older entries.
     """
+    if limit <= 0:
+        raise HTTPException(status_code=400, detail="limit must be positive.")
     try:
-        history = get_history_forecast()
-        return JSONResponse(history)
+        history = get_history_forecast(product_id=product_id, since=since, until=until, before=before, limit=limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return history_page(history, limit)
+
+@router.get("/forecast-latest/")
+def get_forecast_latest():
+    """
+    Endpoint to get the newest forecast of every product.
+    """
+    try:
+        return JSONResponse(get_latest_forecasts(as_dict=True))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
 @router.get("/forecast/{product_id}")
 def get_forecast(
         product_id: str,
+        before: int = None,
+        limit: int = HISTORY_PAGE_SIZE
     ):
     """
-    Endpoint to get the forecast history for a specific product ID.
+    Endpoint to get the forecast history for a specific product ID, newest first.
     """
+    if limit <= 0:
+        raise HTTPException(status_code=400, detail="limit must be positive.")
     try:
-        history = get_history_forecast(as_dict=True)
-        filtered_history = [entry for entry in history if entry["product_id"] == product_id]
-        if not filtered_history:
-            raise HTTPException(status_code=404, detail="No forecast data found for the specified product ID.")
-        return JSONResponse(filtered_history)
+        history = get_history_forecast(as_dict=True, product_id=product_id, before=before, limit=limit)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if not history:
+        raise HTTPException(status_code=404, detail="No forecast data found for the specified product ID.")
+    return history_page(history, limit)
     
 # get train data
 @router.get("/train-data/{product_id}")
@@ -189,50 +349,65 @@ def get_train_data(
         if len(res) == 0:
             raise HTTPException(status_code=404, detail="No train data found.")
         return JSONResponse(res)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/download/{filename}")
-async def download_file(filename: str):
+def download_file(filename: str):
     """
     Endpoint to download a file.
     """
     file_path = os.path.join(OUTPUT_DIR, filename)
-    if not os.path.exists(file_path):
+    if os.path.exists(file_path):
+        return FileResponse(file_path, media_type='application/octet-stream', filename=filename)
+
+    # Forecasts are stored in DuckDB and rendered as CSV on demand
+    match = re.fullmatch(r"forecast_(\d+)\.csv", filename)
+    content = export_forecast_csv(int(match.group(1))) if match else None
+    if content is None:
         raise HTTPException(status_code=404, detail="File not found.")
-    
-    return FileResponse(file_path, media_type='application/octet-stream', filename=filename)
+    return Response(
+        content,
+        media_type='application/octet-stream',
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
 
 @router.get("/forecast-history/{forecast_id}")
-async def get_forecast_by_id(forecast_id: int):
+def get_forecast_by_id(forecast_id: int):
     """
     Endpoint to get forecast results by ID.
     """
     try:
         data = get_forecast_history_by_id(forecast_id)
-
-        return JSONResponse(data)
-
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if data is None:
+        raise HTTPException(status_code=404, detail="Forecast not found.")
+    return JSONResponse(data)
     
 @router.get("/all-train-data")
-async def get_all_train_data():
+def get_all_train_data(
+    format: str = "csv",
+    product_id: str = None,
+    start_date: date = None,
+    end_date: date = None
+):
     """
-    Endpoint to get all train data.
-    Stream as CSV for better performance.
+    Endpoint to get all train data, optionally for one product and/or a date range.
+    Streamed as CSV (default) or Parquet, one record batch at a time.
     """
     try:
-        df = get_all_data()
-
-        def iter_csv():
-            yield df.to_csv(index=False)
-
-        return StreamingResponse(
-            iter_csv(),
-            media_type="text/csv",
-            headers={"Content-Disposition": "attachment; filename=train_data.csv"}
-        )
-
+        chunks = export_train_data(format, product_id, start_date, end_date)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+    media_type = "text/csv" if format == "csv" else "application/vnd.apache.parquet"
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=train_data.{format}"}
+    )
\ No newline at end of file
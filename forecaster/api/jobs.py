@@ -0,0 +1,179 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+# Job states reported by the job_state callable of JobRegistry.submit
+JOB_PENDING = "pending"  # Not started yet, or unknown to the result backend (e.g. lost)
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# Atomically claims KEYS[1] with the value ARGV[1] ('<claim time>@<task ID>') for
+# ARGV[2] seconds if it is free or held by task ARGV[3]; returns the value it holds after
+CLAIM_SCRIPT = """
+local held = redis.call('GET', KEYS[1])
+if held and string.match(held, '[^@]*$') ~= ARGV[3] then
+    return held
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return ARGV[1]
+"""
+
+
+def make_job_key(kind: str, **parts) -> str:
+    """
+    Key identifying a job by everything its result depends on (e.g. product,
+    horizon, pipeline config and data version). Equal parts give equal keys.
+    """
+    digest = hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+    return f"{kind}:{digest}"
+
+
+class JobRegistry:
+    """
+    Maps job keys to the Celery task computing them, so that identical
+    requests share one task instead of each starting their own.
+
+    A request for a key whose task is still queued or running attaches to
+    that task; once it has finished successfully, its result is returned
+    until the key's inputs (e.g. the data version) change. A failed task is
+    replaced by a new one, and so is a task still pending pending_timeout
+    seconds after it was claimed: Celery reports unknown task IDs as pending,
+    so such a task was most likely lost (e.g. purged from the queue).
+
+    With a Redis client the mapping is shared by all API processes. Keys
+    expire after ttl seconds (Celery's own result expiry by default), in Redis
+    and in the in-process mapping that Redis errors fall back to, which also
+    keeps only the max_keys most recent keys.
+    """
+
+    def __init__(self, redis_client=None, namespace: str = "jobs", ttl: int = 24 * 3600,
+                 max_keys: int = 4096, pending_timeout: float = 30 * 60):
+        self.redis = redis_client
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.pending_timeout = pending_timeout
+        self._tasks = OrderedDict()  # job key -> (task ID, claim time)
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "coalesced_running": 0, "coalesced_done": 0,
+                       "resubmitted": 0, "expired_pending": 0, "redis_errors": 0}
+
+    def _redis_call(self, method, *args, **kwargs):
+        if self.redis is None:
+            return None
+        try:
+            return getattr(self.redis, method)(*args, **kwargs)
+        except Exception as e:
+            with self._lock:
+                self._stats["redis_errors"] += 1
+            print(f"WARNING: Job registry Redis {method} failed: {e}")
+            return None
+
+    @staticmethod
+    def _decode(value):
+        """(task ID, claim time) of a Redis value; claim time 0 for values without one."""
+        value = value.decode() if isinstance(value, bytes) else value
+        claimed_at, _, task_id = value.rpartition("@")
+        try:
+            return task_id, float(claimed_at)
+        except ValueError:
+            return value, 0.0
+
+    def _claim(self, job_key: str, task_id: str, expected: str = None):
+        """
+        Records task_id for job_key if the key is free (or expired) or, when
+        expected is given, still held by the task expected. The check and the
+        write are atomic, in-process and in Redis (see CLAIM_SCRIPT), so of
+        several requests replacing the same task only one wins.
+
+        Returns:
+            tuple: (task ID, claim time) the key maps to afterwards.
+        """
+        redis_key = f"{self.namespace}:{job_key}"
+        now = time.time()
+        with self._lock:
+            held = self._tasks.get(job_key)
+            if held is None or now - held[1] > self.ttl or held[0] == expected:
+                self._tasks[job_key] = (task_id, now)
+            self._tasks.move_to_end(job_key)
+            while len(self._tasks) > self.max_keys:
+                self._tasks.popitem(last=False)
+            local = self._tasks[job_key]
+        if self.redis is None:
+            return local
+        shared = self._redis_call("eval", CLAIM_SCRIPT, 1, redis_key, f"{now}@{task_id}", self.ttl, expected or "")
+        if shared is None:
+            return local
+        shared = self._decode(shared)
+        with self._lock:
+            self._tasks[job_key] = shared
+        return shared
+
+    def submit(self, job_key: str, task_id: str, start, job_state):
+        """
+        Returns the task computing job_key, starting it if there is none.
+
+        Args:
+            job_key (str): Key from make_job_key.
+            task_id (str): ID to start a new task under.
+            start (callable): start(task_id) enqueues the task.
+            job_state (callable): job_state(task_id) returns JOB_PENDING,
+                                  JOB_RUNNING, JOB_DONE or JOB_FAILED.
+
+        Returns:
+            tuple: (task ID, JOB_RUNNING/JOB_DONE for an existing task or None
+                   for a task just started).
+        """
+        claimed, claimed_at = self._claim(job_key, task_id)
+        state = None
+        if claimed != task_id:
+            state = job_state(claimed)
+            if state == JOB_PENDING:
+                if time.time() - claimed_at > self.pending_timeout:
+                    state = JOB_FAILED
+                    with self._lock:
+                        self._stats["expired_pending"] += 1
+                else:
+                    state = JOB_RUNNING
+            if state != JOB_FAILED:
+                with self._lock:
+                    self._stats["coalesced_running" if state == JOB_RUNNING else "coalesced_done"] += 1
+                return claimed, state
+            winner, _ = self._claim(job_key, task_id, expected=claimed)
+            if winner != task_id:
+                # Another request replaced the failed task first; share its task
+                with self._lock:
+                    self._stats["coalesced_running"] += 1
+                return winner, JOB_RUNNING
+        try:
+            start(task_id)
+        except Exception:
+            self.forget(job_key, task_id)
+            raise
+        with self._lock:
+            self._stats["submitted"] += 1
+            if state == JOB_FAILED:
+                self._stats["resubmitted"] += 1
+        return task_id, None
+
+    def forget(self, job_key: str, task_id: str):
+        """Drops job_key if it still maps to task_id (e.g. the task could not be enqueued)."""
+        with self._lock:
+            if self._tasks.get(job_key, (None,))[0] == task_id:
+                del self._tasks[job_key]
+        shared = self._redis_call("get", f"{self.namespace}:{job_key}")
+        if shared is not None and self._decode(shared)[0] == task_id:
+            self._redis_call("delete", f"{self.namespace}:{job_key}")
+
+    def stats(self):
+        """Tasks started, requests coalesced into running or finished tasks, and keys held."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["keys"] = len(self._tasks)
+        stats["coalesced"] = stats["coalesced_running"] + stats["coalesced_done"]
+        requests = stats["submitted"] + stats["coalesced"]
+        stats["coalesced_ratio"] = round(stats["coalesced"] / requests, 4) if requests else None
+        return stats
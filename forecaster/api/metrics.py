@@ -0,0 +1,68 @@
+import re
+
+# Prefix of every metric exported to Prometheus
+METRIC_PREFIX = "kp_forecaster"
+
+
+def _metric_name(*parts):
+    return "_".join([METRIC_PREFIX, *(re.sub(r"[^a-zA-Z0-9_]", "_", part) for part in parts)])
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def render_prometheus(families):
+    """
+    Renders metric families in the Prometheus text exposition format (0.0.4).
+
+    Args:
+        families (list): (name, type, help, samples) tuples; samples is a list
+                         of (labels dict, value) pairs. None values are skipped.
+
+    Returns:
+        str: Exposition text.
+    """
+    lines = []
+    for name, kind, help_text, samples in families:
+        samples = [(labels, value) for labels, value in samples if value is not None]
+        if not samples:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{_labels(labels)} {float(value)!r}")
+    return "\n".join(lines) + "\n"
+
+
+def stats_families(subsystem, stats, counters=(), help_text=""):
+    """
+    Metric families for a flat stats dict (e.g. ConnectionManager.stats()):
+    keys in `counters` become counters, other numeric values gauges.
+    """
+    families = []
+    for key, value in stats.items():
+        if isinstance(value, bool):
+            value = int(value)
+        if not isinstance(value, (int, float)):
+            continue
+        kind = "counter" if key in counters else "gauge"
+        name = _metric_name(subsystem, key + ("_total" if kind == "counter" else ""))
+        families.append((name, kind, f"{help_text} {key}".strip(), [({}, value)]))
+    return families
+
+
+def stage_families(stages):
+    """Metric families of the pipeline stage totals from tasks.get_stage_metrics."""
+    return [
+        (_metric_name("pipeline_stage_runs_total"), "counter", "Pipeline stage runs finished",
+         [({"stage": stage}, totals.get("runs")) for stage, totals in sorted(stages.items())]),
+        (_metric_name("pipeline_stage_seconds_total"), "counter", "Seconds spent in a pipeline stage",
+         [({"stage": stage}, totals.get("seconds")) for stage, totals in sorted(stages.items())]),
+        (_metric_name("pipeline_stage_peak_rss_bytes"), "gauge", "Peak RSS of the worker during its latest run of a stage",
+         [({"stage": stage}, totals.get("peak_rss_bytes")) for stage, totals in sorted(stages.items())]),
+    ]
@@ -1,38 +1,331 @@
-import os, requests
-from celery import Celery
-from kp_forecaster.pipeline import run_bma_pipeline
+import os, time, threading, requests
+import duckdb
+from celery import Celery, chord
+from celery.signals import celeryd_after_setup, worker_process_init, task_postrun, after_task_publish
+from celery.result import GroupResult
+from celery.utils import uuid
+from kp_forecaster.pipeline import run_bma_pipeline, run_bma_batch_pipeline
+from kp_forecaster.config import FORECAST_STRATEGY, FUTURE_STEPS, WORKER_CONCURRENCY, WORKER_MAX_RSS_MB
+from kp_forecaster.resources import thread_budget, limit_native_threads, current_rss_bytes
+from kp_forecaster.instrumentation import PipelineMetrics
+from kp_forecaster.forecast_store import store_forecast
+from .jobs import JobRegistry, JOB_PENDING, JOB_RUNNING, JOB_DONE, JOB_FAILED
 
 redis_host = os.getenv("REDIS_HOST", "localhost")
 FASTAPI_URL = os.getenv("FASTAPI_URL", "http://localhost:8000")
+DUCKDB_FILE = os.getenv("DUCKDB_FILE", "data/train.duckdb")
+# Ask the API to register a staged forecast when the worker cannot open the database
+NOTIFY_API = os.getenv("NOTIFY_API", "1") == "1"
+# Share the forecast job registry between API processes through the broker's Redis
+JOB_REGISTRY_REDIS = os.getenv("JOB_REGISTRY_REDIS", "1") == "1"
+FORECAST_COUNTDOWN = 5 # Seconds a forecast task waits before it starts
+FORECAST_LOCK_RETRIES = 5 # Celery retries (exponential backoff) of a forecast whose database stayed locked
+# When the job registry takes a forecast task as lost and resubmits it, based on what the
+# broker and the worker record (see forecast_job_state):
+JOB_PENDING_TIMEOUT = 60 # no state at all (not even QUEUED_STATE) this long after the claim
+QUEUED_STATE = "SENT" # Stored when a forecast task is published, until a worker starts it
+JOB_QUEUED_TIMEOUT = 10 * 60 # queued longer than this, plus
+JOB_QUEUED_SECONDS_PER_TASK = 300 # this for every message waiting in the broker queue
+JOB_HEARTBEAT_SECONDS = 30 # Running forecast tasks republish their progress this often
+JOB_HEARTBEAT_TIMEOUT = 5 * 60 # running without a heartbeat for this long (the worker died)
+# Redis hash with the per-stage totals of every finished pipeline run
+STAGE_METRICS_KEY = "pipeline-stage-metrics"
+# Concurrent tasks per worker (the -c option overrides it) and the RSS ceiling of a worker child
+CELERY_CONCURRENCY = int(os.getenv("CELERY_CONCURRENCY", 0)) or WORKER_CONCURRENCY
+MAX_RSS_MB = int(os.getenv("WORKER_MAX_RSS_MB", WORKER_MAX_RSS_MB))
 
 celery = Celery(
     "tasks",
     broker=f"redis://{redis_host}:6379/0",
     backend=f"redis://{redis_host}:6379/0"
 )
+if CELERY_CONCURRENCY:
+    celery.conf.worker_concurrency = CELERY_CONCURRENCY
+# Running tasks report STARTED, so PENDING only means queued or unknown (see forecast_job_state)
+celery.conf.task_track_started = True
+# Children are replaced after the task during which their RSS passed the ceiling (KiB)
+celery.conf.worker_max_memory_per_child = MAX_RSS_MB * 1024
 
-@celery.task
-def process_csv_task(filepath: str, target_product_id: str, future_step: int = 0):
+# Threads each task may use; set from the worker's actual concurrency at startup
+TASK_THREADS = thread_budget(CELERY_CONCURRENCY)
+
+@celeryd_after_setup.connect
+def set_task_threads(sender, instance, **kwargs):
+    """Splits the cores between the worker's concurrent tasks (runs before the pool forks)."""
+    global TASK_THREADS
+    TASK_THREADS = thread_budget(instance.concurrency)
+    print(f"Worker {sender}: {instance.concurrency} concurrent task(s), {TASK_THREADS} thread(s) per task, "
+          f"children recycled above {MAX_RSS_MB} MiB RSS")
+
+@worker_process_init.connect
+def limit_child_threads(**kwargs):
+    """Caps the BLAS/OpenMP pools of a prefork child at the task thread budget."""
+    limit_native_threads(TASK_THREADS)
+
+@task_postrun.connect
+def report_child_rss(task_id=None, task=None, **kwargs):
+    rss_mb = current_rss_bytes() / 1024 ** 2
+    if rss_mb > MAX_RSS_MB:
+        print(f"WARNING: Worker child at {rss_mb:.0f} MiB RSS after {task.name}[{task_id}], "
+              f"above {MAX_RSS_MB} MiB; it will be replaced")
+
+# A database another process kept locked is retried rather than reported as a failed forecast
+@celery.task(bind=True, autoretry_for=(duckdb.IOException,), max_retries=FORECAST_LOCK_RETRIES,
+             retry_backoff=True, retry_backoff_max=60)
+def process_csv_task(self, filepath: str, target_product_id: str, future_step: int = 0,
+                     strategy: str = FORECAST_STRATEGY, feature_store: str = None, data_source: dict = None):
     if future_step <= 0:
         # If future_step is not provided or is less than or equal to 0, set it to 1
         future_step = 365
-    
-    results = run_bma_pipeline(filepath, target_product_id, future_step=future_step)
-    if not results:
-        return {"status": "failed"}
-
-    future_df = results["future_forecast"]
-    # Convert TANGGAL (Timestamp) to ISO‐formatted string for JSON serialization
-    future_df["TANGGAL"] = future_df["TANGGAL"].dt.strftime("%Y-%m-%d")
-
-    payload = {
-        "product_id": target_product_id,
-        "results": future_df.to_dict(orient="records")
+
+    # Stage metrics are published as PROGRESS meta, shown by /task-status while the task runs;
+    # the heartbeat republishes them so the job registry can tell a live task from a lost one
+    task_id = self.request.id
+    metrics = PipelineMetrics(on_update=lambda snapshot: self.update_state(
+        task_id=task_id, state="PROGRESS", meta={"metrics": snapshot, "heartbeat_at": time.time()}))
+    stop_heartbeat = threading.Event()
+    threading.Thread(target=publish_heartbeats, args=(stop_heartbeat, metrics), daemon=True).start()
+    try:
+        results = run_bma_pipeline(filepath, target_product_id, future_step=future_step, strategy=strategy,
+                                   feature_store=feature_store, data_source=data_source, n_threads=TASK_THREADS,
+                                   metrics=metrics)
+        if not results:
+            return {"status": "failed", "metrics": metrics.to_dict()}
+
+        database = (data_source or {}).get("database") or feature_store or DUCKDB_FILE
+        with metrics.stage("store", rows=len(results["future_forecast"])):
+            stored = store_forecast_results(target_product_id, results["future_forecast"], database)
+        return {**stored, "metrics": metrics.to_dict()}
+    finally:
+        stop_heartbeat.set()
+        record_stage_metrics(metrics.stages)
+
+def publish_heartbeats(stop, metrics: PipelineMetrics):
+    """Republishes a task's progress every JOB_HEARTBEAT_SECONDS until stop is set."""
+    while not stop.wait(JOB_HEARTBEAT_SECONDS):
+        try:
+            metrics.on_update(metrics.to_dict())
+        except Exception as e:
+            print(f"WARNING: Could not publish the task heartbeat: {e}")
+
+@after_task_publish.connect(sender=process_csv_task.name)
+def mark_forecast_queued(headers=None, **kwargs):
+    """Records that a forecast task reached the broker (QUEUED_STATE), and when."""
+    task_id = (headers or {}).get("id")
+    if not task_id:
+        return
+    try:
+        celery.backend.store_result(task_id, {"sent_at": time.time()}, QUEUED_STATE)
+    except Exception as e:
+        print(f"WARNING: Could not record forecast task {task_id} as queued: {e}")
+
+def record_stage_metrics(stages: list):
+    """
+    Adds the stages of a pipeline run to the totals shared through Redis
+    (runs, seconds and the latest peak RSS per stage), read by get_stage_metrics.
+    """
+    if not stages:
+        return
+    try:
+        pipe = celery.backend.client.pipeline()
+        for entry in stages:
+            pipe.hincrby(STAGE_METRICS_KEY, f"{entry['stage']}:runs", 1)
+            pipe.hincrbyfloat(STAGE_METRICS_KEY, f"{entry['stage']}:seconds", entry["seconds"])
+            pipe.hset(STAGE_METRICS_KEY, f"{entry['stage']}:peak_rss_bytes", entry["peak_rss_bytes"])
+        pipe.execute()
+    except Exception as e:
+        print(f"WARNING: Could not record pipeline stage metrics: {e}")
+
+def get_stage_metrics():
+    """
+    Totals of the pipeline stages of all finished runs.
+
+    Returns:
+        dict: Stage name -> runs, seconds and peak_rss_bytes (empty if Redis is unavailable).
+    """
+    try:
+        raw = celery.backend.client.hgetall(STAGE_METRICS_KEY)
+    except Exception as e:
+        print(f"WARNING: Could not read pipeline stage metrics: {e}")
+        return {}
+    stages = {}
+    for field, value in raw.items():
+        stage, name = (field.decode() if isinstance(field, bytes) else field).rsplit(":", 1)
+        stages.setdefault(stage, {})[name] = float(value)
+    return stages
+
+def store_forecast_results(product_id: str, future_df, database: str = DUCKDB_FILE):
+    """
+    Stores a product's future forecast straight into the DuckDB database.
+
+    The forecast is staged as a Parquet file and registered through a short
+    read-write connection. If the API keeps the database open meanwhile, the
+    API is notified to register the staged file itself (when NOTIFY_API is
+    set); otherwise the API registers it on its next history read.
+
+    Returns:
+        dict: status and forecast_id ('staged' with the stage_key while the
+              forecast is not registered yet).
+    """
+    stored = store_forecast(database, product_id, future_df)
+    if stored["forecast_id"] is None and NOTIFY_API:
+        try:
+            resp = requests.post(f"{FASTAPI_URL}/internal/register-forecasts",
+                                 json={"stage_keys": [stored["stage_key"]]}, timeout=30)
+            resp.raise_for_status()
+            stored["forecast_id"] = resp.json().get(stored["stage_key"])
+        except Exception as e:
+            print(f"WARNING: Could not notify the API of staged forecast {stored['stage_key']}: {e}")
+
+    if stored["forecast_id"] is None:
+        return {"status": "staged", "stage_key": stored["stage_key"]}
+    return {"status": "stored", "forecast_id": stored["forecast_id"]}
+
+def make_job_registry():
+    """
+    Registry of the process-csv tasks by job key, Redis-backed if JOB_REGISTRY_REDIS is set.
+    """
+    redis_client = None
+    if JOB_REGISTRY_REDIS:
+        from redis import Redis
+        redis_client = Redis(host=redis_host, port=6379, db=0, socket_timeout=0.5)
+    return JobRegistry(redis_client, namespace="forecast-jobs", ttl=int(celery.conf.result_expires.total_seconds()),
+                       pending_timeout=JOB_PENDING_TIMEOUT)
+
+# Forecast tasks by product, horizon, config and data version
+forecast_jobs = make_job_registry()
+
+def queue_depth():
+    """Messages waiting in the default Celery queue, or None if the broker cannot be asked."""
+    try:
+        with celery.connection_for_read() as conn:
+            return conn.default_channel.queue_declare(queue=celery.conf.task_default_queue,
+                                                      passive=True).message_count
+    except Exception as e:
+        print(f"WARNING: Could not read the Celery queue depth: {e}")
+        return None
+
+def forecast_job_state(task_id: str) -> str:
+    """
+    State of a process-csv task for the job registry: failed when it raised,
+    was revoked or returned status 'failed', done once it stored a forecast.
+
+    A task is also taken as lost (failed) when what the broker and worker
+    record says so: queued for longer than JOB_QUEUED_TIMEOUT plus
+    JOB_QUEUED_SECONDS_PER_TASK per message in the queue (e.g. the queue was
+    purged), or running without a heartbeat for JOB_HEARTBEAT_TIMEOUT (the
+    worker died). Pending means Celery has no record of it at all; the
+    registry resubmits it after JOB_PENDING_TIMEOUT.
+    """
+    result = process_csv_task.AsyncResult(task_id)
+    state = result.state
+    if state in ("FAILURE", "REVOKED"):
+        return JOB_FAILED
+    if state == "SUCCESS":
+        value = result.result
+        return JOB_FAILED if not isinstance(value, dict) or value.get("status") == "failed" else JOB_DONE
+    if state == "PENDING":
+        return JOB_PENDING
+    info = result.info if isinstance(result.info, dict) else {}
+    if state == QUEUED_STATE:
+        depth = queue_depth()
+        waited = time.time() - info.get("sent_at", time.time())
+        if depth is not None and waited > JOB_QUEUED_TIMEOUT + depth * JOB_QUEUED_SECONDS_PER_TASK:
+            return JOB_FAILED
+    if state == "PROGRESS" and time.time() - info.get("heartbeat_at", time.time()) > JOB_HEARTBEAT_TIMEOUT:
+        return JOB_FAILED
+    return JOB_RUNNING
+
+def get_job_stats():
+    """
+    Metrics of the forecast job registry (tasks started, requests coalesced).
+    """
+    return forecast_jobs.stats()
+
+@celery.task
+def forecast_chunk_task(product_ids: list, future_step: int = FUTURE_STEPS, database: str = None):
+    """
+    Forecasts one chunk of a forecast-all batch and stores every product's forecast.
+    Never raises, so one failing chunk does not block the batch callback.
+    """
+    started = time.perf_counter()
+    try:
+        results = run_bma_batch_pipeline(None, product_ids, future_step=future_step, database=database,
+                                         n_threads=TASK_THREADS) or {}
+    except Exception as e:
+        print(f"ERROR forecasting chunk of {len(product_ids)} products: {e}")
+        results = {}
+
+    stored = []
+    for product_id, result in results.items():
+        try:
+            store_forecast_results(product_id, result["future_forecast"], database or DUCKDB_FILE)
+            stored.append(product_id)
+        except Exception as e:
+            print(f"ERROR storing forecast for {product_id}: {e}")
+
+    return {
+        "products": len(product_ids),
+        "forecast": stored,
+        "failed": [product_id for product_id in product_ids if product_id not in stored],
+        "seconds": time.perf_counter() - started,
+    }
+
+@celery.task
+def collect_forecast_batch(chunk_results: list, started_at: float, skipped: list):
+    """
+    Chord callback of a forecast-all batch: totals the chunks and reports throughput.
+    """
+    elapsed = time.time() - started_at
+    forecast = sum(len(chunk["forecast"]) for chunk in chunk_results)
+    summary = {
+        "status": "completed",
+        "chunks": len(chunk_results),
+        "products_forecast": forecast,
+        "products_failed": [product_id for chunk in chunk_results for product_id in chunk["failed"]],
+        "products_skipped": skipped,
+        "elapsed_seconds": round(elapsed, 1),
+        "products_per_minute": round(forecast / elapsed * 60, 2) if elapsed > 0 else None,
     }
+    print(f"Forecast-all batch finished: {forecast} products in {elapsed:.0f}s "
+          f"({summary['products_per_minute']} products/minute), {len(summary['products_failed'])} failed, "
+          f"{len(skipped)} skipped")
+    return summary
 
-    print(f"payload: {payload}")
+def chunk_group_id(batch_id: str) -> str:
+    """ID of the group of chunk tasks belonging to a forecast-all batch."""
+    return f"{batch_id}-chunks"
 
-    resp = requests.post(f"{FASTAPI_URL}/internal/store-forecast", json=payload)
-    resp.raise_for_status()
-    return resp.json()
+def dispatch_forecast_batch(chunks: list, skipped: list, future_step: int, database: str):
+    """
+    Fans the chunks out as a Celery chord whose callback collects the batch.
+
+    Returns:
+        AsyncResult: The callback task; its ID identifies the whole batch.
+    """
+    batch_id = uuid()
+    header = [forecast_chunk_task.s(chunk, future_step, database) for chunk in chunks]
+    batch = chord(header, collect_forecast_batch.s(time.time(), skipped)).set(task_id=chunk_group_id(batch_id))
+    result = batch.apply_async(task_id=batch_id)  # The chord's task_id option names its header group
+    result.parent.save()  # Lets forecast_batch_progress restore the chunks by batch ID
+    return result
+
+def forecast_batch_progress(batch_id: str):
+    """
+    Reports a forecast-all batch: its summary once finished, chunk progress before.
+    """
+    result = celery.AsyncResult(batch_id)
+    if result.state == "SUCCESS":
+        return {"state": result.state, "result": result.result}
+
+    chunks = GroupResult.restore(chunk_group_id(batch_id), app=celery)
+    if chunks is None:
+        return {"state": result.state}
+    finished = [chunk.result for chunk in chunks.results if chunk.successful()]
+    return {
+        "state": result.state if result.state != "PENDING" else "PROGRESS",
+        "chunks_done": chunks.completed_count(),
+        "chunks_total": len(chunks.results),
+        "products_done": sum(chunk["products"] for chunk in finished),
+    }
 
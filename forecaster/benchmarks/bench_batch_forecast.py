@@ -0,0 +1,51 @@
+"""
+Benchmark: lockstep batched recursive forecasting across many products.
+
+Forecasts N synthetic products with the same fitted models, once product by
+product (forecast_recursive) and once in lockstep (forecast_recursive_batch),
+where every model predicts a single N-row matrix per step.
+
+Run from the forecaster directory:
+    PYTHONPATH=. python benchmarks/bench_batch_forecast.py
+"""
+import sys
+import time
+import pandas as pd
+from lightgbm import LGBMRegressor
+from sklearn.linear_model import LinearRegression
+from kp_forecaster.forecasting import forecast_recursive, forecast_recursive_batch
+from bench_forecast_step import make_series, build_training_frame
+
+N_PRODUCTS = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+N_STEPS = 90
+
+if __name__ == "__main__":
+    df_processed = build_training_frame(make_series())
+    feature_names = [col for col in df_processed.columns if col != "TOTAL_JUMLAH"]
+    X, y = df_processed[feature_names], df_processed["TOTAL_JUMLAH"]
+    models = {
+        "LinearRegression": LinearRegression().fit(X, y),
+        "LightGBM": LGBMRegressor(n_estimators=100, random_state=42, verbose=-1).fit(X, y),
+    }
+    weights = {"LinearRegression": 0.5, "LightGBM": 0.5}
+
+    histories, future_dates = {}, {}
+    for i in range(N_PRODUCTS):
+        series = make_series(seed=i)["TOTAL_JUMLAH"]
+        histories[i] = series.values
+        future_dates[i] = pd.date_range(series.index[-1] + pd.Timedelta(days=1), periods=N_STEPS, freq="D")
+
+    start = time.perf_counter()
+    for i in range(N_PRODUCTS):
+        forecast_recursive(models, weights, feature_names, histories[i], future_dates[i])
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    forecast_recursive_batch({i: models for i in range(N_PRODUCTS)}, {i: weights for i in range(N_PRODUCTS)},
+                             feature_names, histories, future_dates)
+    lockstep = time.perf_counter() - start
+
+    print(f"Products: {N_PRODUCTS}, steps: {N_STEPS}, models: {list(models)}")
+    print(f"per product : {sequential:8.2f} s ({N_PRODUCTS / sequential * 60:8.1f} products/min)")
+    print(f"lockstep    : {lockstep:8.2f} s ({N_PRODUCTS / lockstep * 60:8.1f} products/min)")
+    print(f"speedup: {sequential / lockstep:.1f}x")
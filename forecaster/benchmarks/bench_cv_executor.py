@@ -0,0 +1,37 @@
+"""
+Benchmark: wall time of the (model x fold) BMA cross-validation vs worker count.
+
+Runs cross_validate_models on a synthetic training frame with 1, 2, 4, ...
+workers up to the available cores, keeping the total thread budget fixed.
+
+Run from the forecaster directory:
+    PYTHONPATH=. python benchmarks/bench_cv_executor.py [backend]
+"""
+import sys
+import time
+from kp_forecaster.bma import available_cores, cross_validate_models
+from kp_forecaster.pipeline import make_config
+from bench_forecast_step import make_series, build_training_frame
+
+BACKEND = sys.argv[1] if len(sys.argv) > 1 else 'thread'
+
+if __name__ == "__main__":
+    df_processed = build_training_frame(make_series())
+    X = df_processed.drop(columns=["TOTAL_JUMLAH"])
+    y = df_processed["TOTAL_JUMLAH"]
+    n_cores = available_cores()
+
+    worker_counts = [1]
+    while worker_counts[-1] * 2 <= n_cores:
+        worker_counts.append(worker_counts[-1] * 2)
+
+    timings = {}
+    for n_workers in worker_counts:
+        config = {**make_config(), 'N_THREADS': n_cores, 'CV_N_JOBS': n_workers, 'CV_BACKEND': BACKEND}
+        start = time.perf_counter()
+        cross_validate_models(X, y, config)
+        timings[n_workers] = time.perf_counter() - start
+
+    print(f"\nCV on {X.shape[0]} rows x {X.shape[1]} features, {n_cores} cores, backend={BACKEND}")
+    for n_workers, seconds in timings.items():
+        print(f"{n_workers:3d} worker(s): {seconds:8.2f} s  (speedup {timings[1] / seconds:.2f}x)")
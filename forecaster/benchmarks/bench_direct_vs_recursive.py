@@ -0,0 +1,58 @@
+"""
+Benchmark: direct multi-horizon vs recursive future forecasting.
+
+Holds out the last HORIZON days of a synthetic daily series, fits both
+strategies on the remaining history and compares fit time, future forecast
+time and accuracy of the HORIZON-day forecast against the held-out values.
+
+Run from the forecaster directory:
+    PYTHONPATH=. python benchmarks/bench_direct_vs_recursive.py [horizon]
+"""
+import sys
+import time
+from kp_forecaster.pipeline import make_config, fit_bma_models, build_future_dates
+from kp_forecaster.forecasting import forecast_recursive
+from kp_forecaster.direct import fit_direct_models, forecast_direct
+from kp_forecaster.evaluation import evaluate_predictions
+from bench_forecast_step import make_series
+
+HORIZON = int(sys.argv[1]) if len(sys.argv) > 1 else 90
+# Lighter than the production config so the benchmark finishes in minutes
+CONFIG_OVERRIDES = {'N_LAGS': 60, 'N_WEEKS': 12, 'TEST_SIZE': 90}
+
+
+def run_recursive(df, config):
+    start = time.perf_counter()
+    fit = fit_bma_models(df.copy(), config)
+    fitted = time.perf_counter()
+    future_dates = build_future_dates(fit["df_processed"], HORIZON)
+    models = {k: v for k, v in fit["fitted_models"].items() if k in fit["final_weights"]}
+    predictions = forecast_recursive(models, fit["final_weights"], fit["feature_names"],
+                                     fit["df_processed"]["TOTAL_JUMLAH"].values, future_dates)
+    return fitted - start, time.perf_counter() - fitted, predictions
+
+
+def run_direct(df, config):
+    start = time.perf_counter()
+    fit = fit_direct_models(df.copy(), config)
+    fitted = time.perf_counter()
+    future_dates = build_future_dates(fit["target"], HORIZON)
+    predictions = forecast_direct(fit, future_dates)
+    return fitted - start, time.perf_counter() - fitted, predictions
+
+
+if __name__ == "__main__":
+    config = {**make_config(HORIZON), **CONFIG_OVERRIDES}
+    series = make_series()
+    history, actual = series.iloc[:-HORIZON], series["TOTAL_JUMLAH"].values[-HORIZON:]
+
+    results = {}
+    for name, run in (("recursive", run_recursive), ("direct", run_direct)):
+        fit_time, forecast_time, predictions = run(history, config)
+        results[name] = (fit_time, forecast_time, evaluate_predictions(actual, predictions))
+
+    print(f"\nHorizon: {HORIZON} days, config overrides: {CONFIG_OVERRIDES}")
+    print(f"{'strategy':<10} {'fit s':>8} {'forecast s':>11} {'steps/s':>10} {'MSE':>10} {'MAE':>8}")
+    for name, (fit_time, forecast_time, metrics) in results.items():
+        print(f"{name:<10} {fit_time:8.2f} {forecast_time:11.3f} {HORIZON / forecast_time:10.1f} "
+              f"{metrics['MSE']:10.2f} {metrics['MAE']:8.2f}")
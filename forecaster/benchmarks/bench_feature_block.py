@@ -0,0 +1,59 @@
+"""
+Benchmark: time and peak memory of building the lag/rolling feature block.
+
+Compares the column-by-column add_lag_features + add_rolling_features with
+the single-allocation add_lag_block in float64 and float32. Each build is
+followed by the pipeline's dropna, and peak memory is the tracemalloc peak of
+one build, which covers NumPy and pandas buffers.
+
+Run from the forecaster directory:
+    PYTHONPATH=. python benchmarks/bench_feature_block.py
+"""
+import time
+import tracemalloc
+import warnings
+from kp_forecaster.config import N_LAGS, N_WEEKS, ROLL_WINDOWS
+from kp_forecaster.feature_engineering import add_lag_features, add_rolling_features, add_lag_block
+from bench_forecast_step import make_series
+
+N_REPEATS = 5
+
+
+def build_legacy(df):
+    df = add_lag_features(df.copy(), N_LAGS, N_WEEKS)
+    return add_rolling_features(df, ROLL_WINDOWS).dropna()
+
+
+def build_block(dtype):
+    return lambda df: add_lag_block(df, N_LAGS, N_WEEKS, ROLL_WINDOWS, dtype).dropna()
+
+
+def measure(build, df):
+    start = time.perf_counter()
+    for _ in range(N_REPEATS):
+        build(df)
+    elapsed = (time.perf_counter() - start) / N_REPEATS
+
+    tracemalloc.start()
+    frame = build(df)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, frame.memory_usage(deep=True).sum()
+
+
+if __name__ == "__main__":
+    warnings.simplefilter("ignore")  # Fragmentation warnings of the legacy path
+    df = make_series()
+    print(f"Days: {len(df)}, lags: {N_LAGS}, weekly lags: {N_WEEKS}, windows: {ROLL_WINDOWS}")
+
+    results = {}
+    for name, build in [("legacy column inserts", build_legacy),
+                        ("lag block float64", build_block("float64")),
+                        ("lag block float32", build_block("float32"))]:
+        results[name] = measure(build, df)
+        elapsed, peak, size = results[name]
+        print(f"{name:22s}: {elapsed * 1e3:8.1f} ms  peak {peak / 2**20:7.1f} MiB  frame {size / 2**20:6.1f} MiB")
+
+    legacy_time, legacy_peak, _ = results["legacy column inserts"]
+    block_time, block_peak, _ = results["lag block float32"]
+    print(f"float32 block vs legacy: {legacy_time / block_time:.1f}x faster, {legacy_peak / block_peak:.1f}x lower peak memory")
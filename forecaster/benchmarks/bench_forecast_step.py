@@ -0,0 +1,78 @@
+"""
+Benchmark: per-step latency of the recursive future forecast.
+
+Compares the old `create_features_for_step` + `extended_series.loc[...]` path
+with the compiled FeaturePlan / RecursiveForecaster ring buffer. Only feature
+construction and history updates are timed, model prediction is excluded.
+
+Run from the forecaster directory:
+    PYTHONPATH=. python benchmarks/bench_forecast_step.py
+"""
+import time
+import numpy as np
+import pandas as pd
+from kp_forecaster.config import N_LAGS, N_WEEKS, ROLL_WINDOWS
+from kp_forecaster.feature_engineering import (
+    add_lag_features, add_rolling_features, add_time_features, add_ramadhan_feature, create_features_for_step
+)
+from kp_forecaster.forecasting import FeaturePlan, RecursiveForecaster
+
+N_DAYS = 4 * 365
+N_STEPS = 365
+
+
+def make_series(n_days=N_DAYS, seed=42):
+    rng = np.random.default_rng(seed)
+    index = pd.date_range("2019-01-01", periods=n_days, freq="D")
+    seasonal = 50 + 20 * np.sin(2 * np.pi * np.arange(n_days) / 365.25)
+    values = np.maximum(seasonal + rng.normal(0, 10, n_days), 0)
+    return pd.DataFrame({"TOTAL_JUMLAH": values}, index=index)
+
+
+def build_training_frame(df):
+    df = add_lag_features(df, N_LAGS, N_WEEKS)
+    df = add_rolling_features(df, ROLL_WINDOWS)
+    df = add_time_features(df)
+    df = add_ramadhan_feature(df)
+    return df.dropna()
+
+
+def bench_legacy(history, feature_names, future_dates, config):
+    extended_series = history.copy()
+    start = time.perf_counter()
+    for future_date in future_dates:
+        create_features_for_step(future_date, extended_series, feature_names, config)
+        extended_series.loc[future_date] = 1.0
+    return (time.perf_counter() - start) / len(future_dates)
+
+
+def bench_compiled(history, feature_names, future_dates):
+    start = time.perf_counter()
+    plan = FeaturePlan(feature_names)
+    forecaster = RecursiveForecaster(plan, history.values)
+    calendar = plan.calendar_block(future_dates)
+    row = np.empty(plan.n_features)
+    setup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for step in range(len(future_dates)):
+        forecaster.feature_row(calendar[step], out=row)
+        forecaster.push(1.0)
+    return setup, (time.perf_counter() - start) / len(future_dates)
+
+
+if __name__ == "__main__":
+    config = {'N_LAGS': N_LAGS, 'N_WEEKS': N_WEEKS, 'ROLL_WINDOWS': ROLL_WINDOWS}
+    df_processed = build_training_frame(make_series())
+    feature_names = [col for col in df_processed.columns if col != "TOTAL_JUMLAH"]
+    history = df_processed["TOTAL_JUMLAH"]
+    future_dates = pd.date_range(history.index[-1] + pd.Timedelta(days=1), periods=N_STEPS, freq="D")
+
+    legacy = bench_legacy(history, feature_names, future_dates, config)
+    setup, compiled = bench_compiled(history, feature_names, future_dates)
+
+    print(f"Features: {len(feature_names)}, steps: {N_STEPS}")
+    print(f"legacy   create_features_for_step: {legacy * 1e6:10.1f} us/step")
+    print(f"compiled ring buffer             : {compiled * 1e6:10.1f} us/step")
+    print(f"compiled one-off plan/calendar setup: {setup * 1e3:.1f} ms")
+    print(f"speedup: {legacy / compiled:.1f}x")
@@ -0,0 +1,234 @@
+"""
+Benchmark suite: times every stage of the forecasting pipeline on synthetic data.
+
+Transactions come from synthetic.make_transactions (no input files, no
+network). Each scenario is timed `--repeat` times (the model scenarios
+`--repeat-models` times) and the results are written as JSON together with
+the commit, library versions and generator parameters, so runs of different
+commits can be compared:
+
+    PYTHONPATH=. python benchmarks/bench_suite.py --output before.json
+    PYTHONPATH=. python benchmarks/bench_suite.py --output after.json --compare before.json
+
+Scenarios: load_and_prepare_data, filter_product, one per feature function,
+calculate_bma_weights, cv, final_fit and forecast_recursive. Select some with
+--scenarios (comma-separated names or prefixes, e.g. "features,cv").
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+import numpy as np
+import pandas as pd
+from kp_forecaster.config import FUTURE_STEPS
+from kp_forecaster.preprocessing import load_and_prepare_data, filter_product
+from kp_forecaster.feature_engineering import (
+    add_lag_features, add_rolling_features, add_time_features, add_ramadhan_feature, add_holiday_features,
+    add_lag_block
+)
+from kp_forecaster.bma import calculate_bma_weights, cross_validate_models
+from kp_forecaster.models import get_base_models
+from kp_forecaster.forecasting import forecast_recursive
+from kp_forecaster.pipeline import make_config
+from kp_forecaster.resources import available_cores
+from synthetic import make_transactions, product_ids
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+REGRESSION_RATIO = 1.10 # --compare flags scenarios slower than this ratio to the baseline
+
+
+def measure(fn, repeat, setup=None, number=1):
+    """
+    Times fn `repeat` times; each timing runs it `number` times in a row on
+    the value returned by setup() (not timed), or without arguments.
+
+    Returns:
+        dict: min/median/mean seconds per call, repeat, number and fn's last result.
+    """
+    timings, result = [], None
+    for _ in range(repeat):
+        args = () if setup is None else (setup(),)
+        start = time.perf_counter()
+        for _ in range(number):
+            result = fn(*args)
+        timings.append((time.perf_counter() - start) / number)
+    return {
+        "min_seconds": min(timings), "median_seconds": statistics.median(timings),
+        "mean_seconds": statistics.fmean(timings), "repeat": repeat, "number": number, "result": result,
+    }
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                               text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def library_versions():
+    import sklearn, lightgbm, xgboost, catboost
+    return {module.__name__: module.__version__ for module in (np, pd, sklearn, lightgbm, xgboost, catboost)}
+
+
+def selected(name, patterns):
+    return not patterns or any(name == pattern or name.startswith(pattern) for pattern in patterns)
+
+
+def run_suite(args):
+    # add_lag_features inserts columns one by one on purpose (it is the legacy path being timed)
+    warnings.simplefilter("ignore", pd.errors.PerformanceWarning)
+    patterns = [pattern for pattern in (args.scenarios or "").split(",") if pattern]
+    config = make_config(args.future_steps, args.threads)
+    results = {}
+
+    def record(name, fn, repeat=args.repeat, setup=None, number=1, **extra):
+        if not selected(name, patterns):
+            return None
+        timing = measure(fn, repeat, setup, number)
+        result = timing.pop("result")
+        results[name] = {**timing, **extra}
+        print(f"{name:<32} {timing['median_seconds'] * 1000:12.3f} ms (median of {repeat})")
+        return result
+
+    transactions = make_transactions(args.products, args.years, tuple(args.channels.split(",")),
+                                     tuple(args.locations.split(",")), args.sparsity, args.seasonality,
+                                     seed=args.seed)
+    target_id = product_ids(transactions)[0]
+    print(f"{len(transactions)} transactions, {args.products} products, {args.years} years; "
+          f"benchmarking product {target_id}")
+
+    # 1. Loading and per-product aggregation
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "train.csv")
+        transactions.to_csv(csv_path, index=False)
+        df_raw = record("load_and_prepare_data", lambda: load_and_prepare_data(csv_path), rows=len(transactions))
+        if df_raw is None:
+            df_raw = load_and_prepare_data(csv_path)
+    series = record("filter_product", lambda: filter_product(df_raw, target_id), rows=len(df_raw))
+    if series is None:
+        series = filter_product(df_raw, target_id)
+
+    # 2. Feature functions, each on a fresh copy of the daily series
+    fresh = lambda: series.copy()
+    record("features.add_lag_features", lambda df: add_lag_features(df, config['N_LAGS'], config['N_WEEKS']),
+           setup=fresh, rows=len(series))
+    record("features.add_rolling_features", lambda df: add_rolling_features(df, config['ROLL_WINDOWS']),
+           setup=fresh, rows=len(series))
+    record("features.add_time_features", add_time_features, setup=fresh, rows=len(series))
+    record("features.add_ramadhan_feature", add_ramadhan_feature, setup=fresh, rows=len(series))
+    record("features.add_holiday_features", add_holiday_features, setup=fresh, rows=len(series))
+    record("features.add_lag_block",
+           lambda df: add_lag_block(df, config['N_LAGS'], config['N_WEEKS'], config['ROLL_WINDOWS'],
+                                    config['FEATURE_DTYPE']),
+           setup=fresh, rows=len(series))
+
+    # 3. BMA weights from CV scores (fast, so many calls per timing)
+    rng = np.random.default_rng(args.seed)
+    scores = {name: float(mse) for name, mse in zip(get_base_models(), rng.uniform(50, 200, 6))}
+    record("calculate_bma_weights", lambda: calculate_bma_weights(scores), number=1000)
+
+    # 4-6. CV, final fit and the recursive forecast on the training frame
+    if not any(selected(name, patterns) for name in ("cv", "final_fit", "forecast_recursive")):
+        return results
+    df_processed = add_holiday_features(add_ramadhan_feature(add_time_features(
+        add_lag_block(series, config['N_LAGS'], config['N_WEEKS'], config['ROLL_WINDOWS'], config['FEATURE_DTYPE'])
+    )), config['EXTRA_HOLIDAY_FEATURES']).dropna()
+    feature_names = [col for col in df_processed.columns if col != "TOTAL_JUMLAH"]
+    X, y = df_processed[feature_names], df_processed["TOTAL_JUMLAH"]
+    if len(X) <= config['TEST_SIZE']:
+        print(f"ERROR: {len(X)} training rows after feature engineering; increase --years to fit models")
+        return results
+    X_train, y_train = X[:-config['TEST_SIZE']], y[:-config['TEST_SIZE']]
+    shape = {"rows": len(X_train), "columns": X_train.shape[1]}
+
+    record("cv", lambda: cross_validate_models(X_train, y_train, config), repeat=args.repeat_models, **shape)
+
+    fitted = {}
+    for name, model in get_base_models(config['N_THREADS'] or available_cores()).items():
+        fitted[name] = record(f"final_fit.{name}", lambda model=model: model.fit(X_train, y_train),
+                              repeat=args.repeat_models, **shape)
+        if fitted[name] is None:
+            fitted[name] = model.fit(X_train, y_train)
+    weights = calculate_bma_weights({name: 1.0 for name in fitted})
+
+    future_dates = pd.date_range(series.index[-1] + pd.Timedelta(days=1), periods=config['FUTURE_FORECAST_STEP'],
+                                 freq="D")
+    record("forecast_recursive",
+           lambda: forecast_recursive(fitted, weights, feature_names, y.values, future_dates),
+           repeat=args.repeat_models, steps=len(future_dates), models=len(fitted))
+    return results
+
+
+def compare(results, baseline_path):
+    """Prints the median time of every scenario relative to a baseline JSON file."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path} ({baseline['meta'].get('commit')}):")
+    regressions = 0
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        ratio = result["median_seconds"] / max(before["median_seconds"], 1e-12)
+        flag = "  REGRESSION" if ratio > REGRESSION_RATIO else ""
+        regressions += bool(flag)
+        print(f"{name:<32} {before['median_seconds'] * 1000:12.3f} -> {result['median_seconds'] * 1000:12.3f} ms"
+              f"  x{ratio:.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--products", type=int, default=20)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--channels", default="ON,OFF")
+    parser.add_argument("--locations", default="JKT,SBY,BDG")
+    parser.add_argument("--sparsity", type=float, default=0.5)
+    parser.add_argument("--seasonality", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--future-steps", type=int, default=FUTURE_STEPS)
+    parser.add_argument("--threads", type=int, default=None, help="Thread budget of the model scenarios")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--repeat-models", type=int, default=1, help="Repeats of cv, final_fit and forecast_recursive")
+    parser.add_argument("--scenarios", default=None)
+    parser.add_argument("--output", default=None, help="JSON file, default benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", default=None, help="Baseline JSON file to compare with")
+    args = parser.parse_args()
+
+    started = time.time()
+    results = run_suite(args)
+    commit = git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "started_at": pd.Timestamp(started, unit="s").isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cores": available_cores(),
+            "libraries": library_versions(),
+            "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{(commit or 'unknown')[:12]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        sys.exit(1 if compare(results, args.compare) else 0)
+
+
+if __name__ == "__main__":
+    main()
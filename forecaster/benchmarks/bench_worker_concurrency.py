@@ -0,0 +1,57 @@
+"""
+Benchmark: forecast job throughput with 4, 8 and 16 jobs running at once.
+
+Every job fits the BMA models (steps 2-8 of the pipeline) for one synthetic
+product in its own process, like a Celery prefork child. Each concurrency
+level runs twice: with the library defaults (every job uses all cores) and
+with the worker's thread budget (cores // concurrency threads per job,
+propagated into the models and the BLAS/OpenMP limits).
+
+Run from the forecaster directory:
+    PYTHONPATH=. python benchmarks/bench_worker_concurrency.py [concurrency ...]
+"""
+import os
+import sys
+import time
+import multiprocessing
+from kp_forecaster.pipeline import make_config, fit_bma_models
+from kp_forecaster.resources import available_cores, thread_budget, limit_native_threads, current_rss_bytes
+from bench_forecast_step import make_series
+
+CONCURRENCY = [int(arg) for arg in sys.argv[1:]] or [4, 8, 16]
+N_DAYS = 3 * 365
+
+
+def init_child(n_threads):
+    sys.stdout = open(os.devnull, "w") # Keep the pipeline's progress out of the report
+    if n_threads is not None:
+        limit_native_threads(n_threads)
+
+
+def run_job(args):
+    seed, n_threads = args
+    fit_bma_models(make_series(N_DAYS, seed=seed), make_config(n_threads=n_threads))
+    return current_rss_bytes()
+
+
+def run_level(concurrency, n_threads):
+    context = multiprocessing.get_context("fork")
+    start = time.perf_counter()
+    with context.Pool(concurrency, initializer=init_child, initargs=(n_threads,)) as pool:
+        rss = pool.map(run_job, [(seed, n_threads) for seed in range(concurrency)])
+    return time.perf_counter() - start, max(rss)
+
+
+if __name__ == "__main__":
+    n_cores = available_cores()
+    rows = []
+    for concurrency in CONCURRENCY:
+        for mode, n_threads in (("default", None), ("budgeted", thread_budget(concurrency, n_cores))):
+            seconds, peak_rss = run_level(concurrency, n_threads)
+            rows.append((concurrency, mode, n_threads or n_cores, seconds, peak_rss))
+
+    print(f"\nBMA fits of {N_DAYS}-day series, {n_cores} cores")
+    print(f"{'jobs':>4}  {'mode':<9} {'threads/job':>11} {'seconds':>9} {'jobs/min':>9} {'max RSS MiB':>12}")
+    for concurrency, mode, threads, seconds, peak_rss in rows:
+        print(f"{concurrency:4d}  {mode:<9} {threads:11d} {seconds:9.2f} {concurrency / seconds * 60:9.2f} "
+              f"{peak_rss / 1024 ** 2:12.0f}")
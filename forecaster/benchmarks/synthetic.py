@@ -0,0 +1,73 @@
+"""
+Synthetic train_data transactions for the benchmarks.
+
+make_transactions builds rows shaped like the train_data table (one row per
+sale: channel, location, date, the four product ID columns, unit weight,
+quantity and total weight). Every product sells on a random subset of days;
+sale days and quantities follow a yearly and weekly season.
+"""
+import numpy as np
+import pandas as pd
+from kp_forecaster.config import PRODUCT_ID_COLS, DATE_COLUMN, TARGET_COLUMN
+
+TRANSACTION_COLUMNS = ["CHANNEL", "LOKASI", DATE_COLUMN, *PRODUCT_ID_COLS, "BERAT_SATUAN", "JUMLAH", TARGET_COLUMN]
+
+
+def make_transactions(n_products=20, years=3, channels=("ON", "OFF"), locations=("JKT", "SBY", "BDG"),
+                      sparsity=0.5, seasonality=0.3, start="2021-01-01", seed=42):
+    """
+    Generates train_data-shaped transactions.
+
+    Args:
+        n_products (int): Distinct products (KODE_BARANG/KLASIFIKASI/WARNA/UKURAN combinations).
+        years (int): Length of the history, from `start`.
+        channels (tuple): CHANNEL values, drawn uniformly per transaction.
+        locations (tuple): LOKASI values, drawn uniformly per transaction.
+        sparsity (float): Average share of days without any sale of a product (0-1).
+        seasonality (float): Amplitude of the yearly season, relative to the mean (0-1).
+        start (str): First day of the history.
+        seed (int): Random seed; equal arguments give identical frames.
+
+    Returns:
+        pd.DataFrame: One row per transaction with TRANSACTION_COLUMNS, sorted by date.
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start, periods=int(round(365.25 * years)), freq="D")
+    n_days = len(dates)
+
+    # Yearly season (phase per product) and a weekend bump, as day x product multipliers
+    phase = rng.uniform(0, 2 * np.pi, n_products)
+    yearly = 1 + seasonality * np.sin(2 * np.pi * np.arange(n_days)[:, None] / 365.25 + phase)
+    weekly = np.where(dates.dayofweek >= 5, 1.2, 1.0)[:, None]
+    season = yearly * weekly
+
+    # Sale days, more likely in season; 1 + Poisson transactions on each
+    sells = rng.random((n_days, n_products)) < np.clip((1 - sparsity) * season, 0, 1)
+    day_idx, product_idx = np.nonzero(sells)
+    per_day = 1 + rng.poisson(season[day_idx, product_idx])
+    day_idx = np.repeat(day_idx, per_day)
+    product_idx = np.repeat(product_idx, per_day)
+    n_rows = len(day_idx)
+
+    unit_weight = np.round(rng.uniform(0.5, 5.0, n_products), 2)
+    quantity = 1 + rng.poisson(5 * season[day_idx, product_idx])
+    codes = np.array([f"K{i:04d}" for i in range(n_products)])
+    df = pd.DataFrame({
+        "CHANNEL": np.asarray(channels)[rng.integers(0, len(channels), n_rows)],
+        "LOKASI": np.asarray(locations)[rng.integers(0, len(locations), n_rows)],
+        DATE_COLUMN: dates[day_idx],
+        PRODUCT_ID_COLS[0]: codes[product_idx],
+        PRODUCT_ID_COLS[1]: np.array(["A", "B", "C"])[product_idx % 3],
+        PRODUCT_ID_COLS[2]: np.array(["R", "G", "B", "W"])[product_idx % 4],
+        PRODUCT_ID_COLS[3]: np.array(["S", "M", "L"])[product_idx % 3],
+        "BERAT_SATUAN": unit_weight[product_idx],
+        "JUMLAH": quantity,
+        TARGET_COLUMN: np.round(unit_weight[product_idx] * quantity, 2),
+    })
+    return df[TRANSACTION_COLUMNS]
+
+
+def product_ids(df):
+    """Product IDs of a transactions frame, as used by filter_product, most rows first."""
+    ids = df[PRODUCT_ID_COLS].astype(str).agg("_".join, axis=1)
+    return ids.value_counts().index.tolist()
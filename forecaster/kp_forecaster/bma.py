@@ -1,3 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import time
+import numpy as np
+from .models import get_base_models, base_model_names
+from .resources import available_cores
+from .instrumentation import PipelineMetrics
+from .evaluation import evaluate_predictions
+
 def calculate_bma_weights(cv_mse_scores):
     """Calculates BMA weights based on inverse CV MSE."""
     valid_scores = {name: mse for name, mse in cv_mse_scores.items() if mse != float('inf') and mse > 1e-9} # Avoid division by zero or infinity
@@ -27,4 +35,279 @@ def calculate_bma_weights(cv_mse_scores):
         if name not in bma_weights:
             bma_weights[name] = 0.0
 
-    return bma_weights
\ No newline at end of file
+    return bma_weights
+
+def fit_and_score(model, X_tr, y_tr, X_val, y_val):
+    """Fits a model on one CV fold and returns its validation MSE and the seconds it took."""
+    from sklearn.metrics import mean_squared_error
+
+    started = time.perf_counter()
+    model.fit(X_tr, y_tr)
+    return mean_squared_error(y_val, model.predict(X_val)), time.perf_counter() - started
+
+def attainable_weights(fold_errors):
+    """
+    Optimistic BMA weight each model can still reach after the folds seen so far.
+
+    A model is credited with its best fold MSE while every other model keeps its
+    current average MSE. Models without a successful fold yet are left out.
+    """
+    best = {name: 1.0 / max(min(errors), 1e-9) for name, errors in fold_errors.items() if errors}
+    current = {name: 1.0 / max(np.mean(errors), 1e-9) for name, errors in fold_errors.items() if errors}
+    current_total = sum(current.values())
+    return {name: best[name] / (best[name] + current_total - current[name]) for name in best}
+
+def models_to_prune(fold_errors, threshold):
+    """
+    Models to stop cross-validating after the folds seen so far.
+
+    A model is pruned when its attainable weight is below the threshold and its
+    average MSE is worse than the lowest one. The leading models (all of them
+    on a tie) are always kept, so pruning never empties the ensemble, even when
+    the threshold is above 1 / number of models.
+
+    Returns:
+        dict: Attainable weight of every model to prune, by name.
+    """
+    means = {name: np.mean(errors) for name, errors in fold_errors.items() if errors}
+    if not means:
+        return {}
+    best_mean = min(means.values())
+    return {name: weight for name, weight in attainable_weights(fold_errors).items()
+            if weight < threshold and means[name] > best_mean}
+
+def cross_validate_models(X_train, y_train, config, metrics=None):
+    """
+    Runs the (model x fold) CV fits of the base models on a worker pool.
+
+    Every fit gets a fresh clone of its base model with an explicit thread
+    budget, so workers x threads per fit matches the cores available to the run.
+    With CV_PRUNE_THRESHOLD set, folds are run one at a time and models whose
+    attainable BMA weight drops below the threshold are not evaluated further
+    (see models_to_prune; the leading model is never pruned); they get an
+    infinite CV score and therefore a zero weight.
+
+    Args:
+        X_train, y_train: Training features and target.
+        config (dict): Pipeline configuration (N_SPLITS_BMA, RANDOM_STATE,
+                       N_THREADS, CV_N_JOBS, CV_BACKEND, CV_PRUNE_THRESHOLD).
+        metrics (PipelineMetrics, optional): Receives the duration of every fit.
+
+    Returns:
+        dict: Average CV MSE per model name (inf if all folds failed or pruned).
+    """
+    from sklearn.base import clone
+    from sklearn.model_selection import KFold
+
+    kf = KFold(n_splits=config['N_SPLITS_BMA'], shuffle=True, random_state=config['RANDOM_STATE'])
+    folds = list(kf.split(X_train))
+    model_names = base_model_names()
+    prune_threshold = config.get('CV_PRUNE_THRESHOLD')
+    # Folds run together, or one round per fold when pruning between rounds
+    rounds = [list(range(len(folds)))] if prune_threshold is None else [[fold] for fold in range(len(folds))]
+
+    n_cores = config.get('N_THREADS') or available_cores()
+    n_fits = len(model_names) * len(rounds[0])
+    n_workers = max(1, min(config.get('CV_N_JOBS') or n_cores, n_fits))
+    threads_per_fit = max(1, n_cores // n_workers)
+    base_models = get_base_models(threads_per_fit)
+
+    backend = config.get('CV_BACKEND', 'thread')
+    executor_class = ProcessPoolExecutor if backend == 'process' else ThreadPoolExecutor
+    print(f"Running up to {len(model_names) * len(folds)} CV fits on {n_workers} {backend} worker(s), "
+          f"{threads_per_fit} thread(s) per fit")
+
+    fold_errors = {model_name: [] for model_name in base_models}
+    active_models = list(base_models)
+    pruned = {}
+    with executor_class(max_workers=n_workers) as executor:
+        for round_folds in rounds:
+            futures = {
+                (model_name, fold): executor.submit(
+                    fit_and_score, clone(base_models[model_name]),
+                    X_train.iloc[folds[fold][0]], y_train.iloc[folds[fold][0]],
+                    X_train.iloc[folds[fold][1]], y_train.iloc[folds[fold][1]],
+                )
+                for model_name in active_models
+                for fold in round_folds
+            }
+            for (model_name, fold), future in futures.items():
+                try:
+                    mse, seconds = future.result()
+                    fold_errors[model_name].append(mse)
+                    if metrics is not None:
+                        metrics.record_fit(model_name, fold + 1, seconds)
+                except Exception as e:
+                    print(f"  ERROR during CV Fold {fold+1} for {model_name}: {e}")
+
+            if prune_threshold is None or round_folds[-1] == len(folds) - 1:
+                continue
+            for model_name, weight in models_to_prune({name: fold_errors[name] for name in active_models},
+                                                      prune_threshold).items():
+                print(f"  Pruning {model_name} after {round_folds[-1]+1} fold(s): "
+                      f"attainable weight {weight:.4f} < {prune_threshold}")
+                active_models.remove(model_name)
+                pruned[model_name] = round_folds[-1] + 1
+
+    cv_mse_scores = {}
+    for model_name in base_models:
+        errors = fold_errors[model_name]
+        if model_name in pruned:
+            print(f"  {model_name} pruned after {pruned[model_name]} fold(s), CV MSE so far: {np.mean(errors):.4f}")
+            cv_mse_scores[model_name] = float('inf')
+        elif errors:
+            avg_cv_error = np.mean(errors)
+            cv_mse_scores[model_name] = max(avg_cv_error, 1e-9)
+            print(f"  {model_name} Avg CV MSE: {avg_cv_error:.4f}")
+        else:
+            print(f"  {model_name} failed all CV folds.")
+            cv_mse_scores[model_name] = float('inf')
+
+    return cv_mse_scores
+
+def fit_bma_ensemble(X_train, y_train, X_test, y_test, config, metrics=None):
+    """
+    Calculates BMA weights with K-fold CV on the training data, fits the final
+    models and evaluates the weighted forecast on the test set.
+
+    Args:
+        X_train, y_train: Training features and target.
+        X_test, y_test: Test features and target.
+        config (dict): Pipeline configuration (N_SPLITS_BMA, RANDOM_STATE, thread budget).
+        metrics (PipelineMetrics, optional): Receives the cv, final_fit and
+                                             test_prediction stages.
+
+    Returns:
+        dict: Fitted models, final BMA weights, individual and BMA test forecasts,
+              test metrics and CV scores. Returns None if no model survives.
+    """
+    # --- BMA Specific Steps ---
+    if metrics is None:
+        metrics = PipelineMetrics()
+
+    # 4. Define Base Models (final fits run one at a time with the whole thread budget)
+    base_models = get_base_models(config.get('N_THREADS') or available_cores())
+
+    # 5. Calculate BMA Weights using Cross-Validation on Training Data
+    print(f"\n--- Performing {config['N_SPLITS_BMA']}-Fold CV on Training Data for BMA Weights ---")
+    with metrics.stage("cv", rows=len(X_train), columns=X_train.shape[1]):
+        cv_mse_scores = cross_validate_models(X_train, y_train, config, metrics)
+
+    bma_weights = calculate_bma_weights(cv_mse_scores)
+    if bma_weights is None: return None
+    print("\nCalculated BMA Weights:")
+    for name, weight in bma_weights.items():
+        if weight > 0: print(f"  {name}: {weight:.4f}")
+
+    # --- Final Model Fitting and Prediction on Test Set ---
+
+    # 6. Fit Final Models on Full Training Data
+    print("\n--- Fitting Final Models on Full Training Data ---")
+    fitted_models = {}
+    temp_bma_weights = bma_weights.copy() # Work with a copy for renormalization
+
+    with metrics.stage("final_fit", rows=len(X_train), columns=X_train.shape[1]) as stage:
+        stage["models"] = {}
+        for model_name, model in base_models.items():
+            if temp_bma_weights.get(model_name, 0) > 0:
+                print(f"Fitting {model_name}...")
+                started = time.perf_counter()
+                try:
+                    model.fit(X_train, y_train)
+                    fitted_models[model_name] = model
+                except Exception as e:
+                    print(f"  ERROR fitting final {model_name}: {e}")
+                    temp_bma_weights[model_name] = 0 # Set weight to 0 if final fit fails
+                stage["models"][model_name] = round(time.perf_counter() - started, 4)
+
+    # Renormalize weights if any models failed the final fit
+    active_weights = {name: w for name, w in temp_bma_weights.items() if name in fitted_models and w > 0}
+    if not active_weights:
+        print("ERROR: All models for BMA failed to fit.")
+        return None
+    weight_sum = sum(active_weights.values())
+    if weight_sum < 1e-9 :
+         print("ERROR: Sum of weights for successfully fitted models is zero.")
+         return None
+    elif abs(weight_sum - 1.0) > 1e-6 :
+        print("Renormalizing weights after final fit failures.")
+        final_bma_weights = {name: (w / weight_sum if name in active_weights else 0)
+                             for name, w in temp_bma_weights.items()}
+        print("Renormalized BMA Weights:")
+        for name, weight in final_bma_weights.items():
+             if weight > 0: print(f"  {name}: {weight:.4f}")
+    else:
+        final_bma_weights = active_weights # Use the weights of successfully fitted models
+
+    # 7. Generate Forecasts on Test Data
+    print("\n--- Generating Forecasts on Test Data ---")
+    individual_forecasts_test = {}
+    bma_forecast_test = np.zeros(len(X_test))
+    temp_bma_weights_pred = final_bma_weights.copy() # Copy for prediction renormalization
+
+    with metrics.stage("test_prediction", rows=len(X_test), columns=X_test.shape[1]):
+        for name, model in fitted_models.items():
+            weight = temp_bma_weights_pred.get(name, 0)
+            if weight > 0:
+                print(f"Predicting test set with {name} (Weight: {weight:.4f})")
+                try:
+                    forecast = model.predict(X_test)
+                    forecast[forecast < 0] = 0 # Ensure non-negative
+                    individual_forecasts_test[name] = forecast
+                    bma_forecast_test += weight * forecast
+                except Exception as e:
+                    print(f"  ERROR predicting test set with {name}: {e}")
+                    individual_forecasts_test[name] = np.zeros(len(X_test))
+                    temp_bma_weights_pred[name] = 0 # Set weight to 0 if prediction fails
+
+    # Renormalize weights AGAIN if predictions failed for some models
+    active_weights_pred = {name: w for name, w in temp_bma_weights_pred.items() if w > 0 and name in fitted_models}
+    if not active_weights_pred:
+         print("ERROR: All models failed during test set prediction.")
+         return None
+    weight_sum_pred = sum(active_weights_pred.values())
+    if weight_sum_pred < 1e-9 :
+        print("ERROR: Sum of weights for successfully predicting models is zero.")
+        return None
+    elif abs(weight_sum_pred - 1.0) > 1e-6:
+        print("Renormalizing weights after prediction failures on test set.")
+        final_bma_forecast_test = np.zeros(len(X_test))
+        final_bma_weights_for_forecast = {}
+        for name, forecast in individual_forecasts_test.items():
+             if temp_bma_weights_pred.get(name, 0) > 0 :
+                 new_weight = temp_bma_weights_pred[name] / weight_sum_pred
+                 final_bma_weights_for_forecast[name] = new_weight
+                 final_bma_forecast_test += new_weight * forecast
+        bma_forecast_test = final_bma_forecast_test
+        final_weights = final_bma_weights_for_forecast # These are the weights used for test and future
+        print("Final Renormalized BMA Weights used for forecast:")
+        for name, weight in final_weights.items(): print(f"  {name}: {weight:.4f}")
+    else:
+        # If no renormalization needed, the final weights are those that successfully predicted
+        final_weights = active_weights_pred
+
+    print(f"\nFinal BMA Forecast on Test Set (first 5): {np.round(bma_forecast_test[:5], 2)}")
+    print(f"Actual Values on Test Set (first 5): {y_test.values[:5]}")
+
+    # 8. Evaluate BMA Forecast on Test Set
+    print("\n--- Evaluating Final BMA Forecast on Test Set ---")
+    bma_metrics_test = evaluate_predictions(y_test, bma_forecast_test)
+    print(f"[BMA Test Set] MSE: {bma_metrics_test['MSE']:.2f} | MAPE: {bma_metrics_test['MAPE']:.2%}")
+
+    individual_metrics_test = {}
+    for name, forecast in individual_forecasts_test.items():
+        if final_weights.get(name,0) > 0 :
+             metrics = evaluate_predictions(y_test, forecast)
+             individual_metrics_test[name] = metrics
+             print(f"  [{name.upper()} Test Set] MSE: {metrics['MSE']:.2f} | MAPE: {metrics['MAPE']:.2%}")
+
+    return {
+        "fitted_models": fitted_models,
+        "final_weights": final_weights,
+        "individual_forecasts_test": {name: forecast for name, forecast in individual_forecasts_test.items()
+                                      if name in final_weights},
+        "bma_forecast_test": bma_forecast_test,
+        "bma_metrics_test": bma_metrics_test,
+        "individual_metrics_test": individual_metrics_test,
+        "cv_mse_scores": cv_mse_scores,
+    }
@@ -1,13 +1,50 @@
 PRODUCT_ID_COLS = ['KODE_BARANG', 'KLASIFIKASI_BARANG', 'WARNA_BARANG', 'UKURAN_BARANG']
+MISSING_ID_TEXT = 'nan' # A missing ID column in product IDs, as pandas' astype(str) renders NaN
 TARGET_COLUMN = 'BERAT_TOTAL'
 DATE_COLUMN = 'TANGGAL'
 RESAMPLE_FREQ = 'D'
+TRAIN_DATA_TABLE = 'train_data' # DuckDB table with the raw transactions
+# Opening the DuckDB file while another process holds its lock: attempts, and the
+# delay before retry n (n x DUCKDB_RETRY_DELAY seconds). The retries span 6.6 s,
+# well beyond the API's idle release of the file (api.db.DUCKDB_IDLE_RELEASE)
+DUCKDB_OPEN_RETRIES = 12
+DUCKDB_RETRY_DELAY = 0.1
+PRODUCT_TABLE = 'products' # DuckDB product dimension, keyed by an integer product_key
+DAILY_SALES_TABLE = 'daily_product_sales' # DuckDB daily rollup of train_data per product_key
+FORECAST_HISTORY_TABLE = 'forecast_history' # One row per stored forecast
+FORECAST_RESULTS_TABLE = 'forecast_results' # Daily rows of every stored forecast
+FORECAST_LATEST_TABLE = 'forecast_latest' # Newest forecast of every product
+FORECAST_STAGING_TABLE = 'forecast_staging' # Staged forecast files already registered
 
 N_LAGS = 365
 N_WEEKS = 54
 ROLL_WINDOWS = [7, 30]
+FEATURE_DTYPE = 'float32' # dtype of the lag/rolling feature block; float32 halves its memory for the tree models
+EXTRA_HOLIDAY_FEATURES = [] # Holiday calendar features added after is_ramadhan: 'days_to_eid', 'is_holiday'
 
 N_SPLITS_BMA = 5 # Number of folds for cross-validation
+N_THREADS = None # CPU threads available to one pipeline run, None uses all available cores
+CV_N_JOBS = None # Parallel (model x fold) CV fits, None uses one worker per available core
+CV_BACKEND = 'thread' # 'thread' or 'process'; processes cannot be started inside Celery prefork children
+CV_PRUNE_THRESHOLD = None # Stop cross-validating models whose attainable BMA weight falls below this, None disables
+# Celery worker resources: tasks running at once (None = one per core, each task gets
+# cores // concurrency threads) and the RSS above which a worker child is replaced
+WORKER_CONCURRENCY = None
+WORKER_MAX_RSS_MB = 4096
+RSS_SAMPLE_SECONDS = 0.05 # Interval at which a pipeline stage samples the process RSS for its peak
 TEST_SIZE = 365
 FUTURE_STEPS = 365
+BATCH_CHUNK_DAYS = 20000 # Total days of history per forecast-all chunk task
+
+# Future forecast strategy: 'recursive' feeds each BMA prediction back as a lag,
+# 'direct' trains one BMA ensemble per horizon bucket (first, last step ahead)
+FORECAST_STRATEGIES = ('recursive', 'direct')
+FORECAST_STRATEGY = 'recursive'
+DIRECT_HORIZON_BUCKETS = [(1, 7), (8, 30), (31, 365)]
+
+# Fitted pipelines are reused when a product's series and config are unchanged
+USE_MODEL_REGISTRY = True
+MODEL_REGISTRY_DIR = "data/model_registry"
+MODEL_REGISTRY_MAX_BYTES = 2 * 1024 ** 3 # Least recently used entries are evicted above this size
+
 TARGET_ID = "MP000197_KD000028_PL000036_SZ000012"
\ No newline at end of file
@@ -0,0 +1,337 @@
+import time
+import numpy as np
+import pandas as pd
+from .config import PRODUCT_ID_COLS, MISSING_ID_TEXT, DUCKDB_OPEN_RETRIES, DUCKDB_RETRY_DELAY, TARGET_COLUMN, DATE_COLUMN, TRAIN_DATA_TABLE, PRODUCT_TABLE, DAILY_SALES_TABLE
+
+
+def make_data_source(database, product_id, start_date=None, end_date=None):
+    """
+    Describes where the pipeline reads a product's daily series from.
+
+    The spec is a plain dict of strings so it can be passed to Celery tasks.
+
+    Args:
+        database (str): Path of the DuckDB database holding train_data.
+        product_id (str): Product ID (KODE_BARANG_KLASIFIKASI_BARANG_WARNA_BARANG_UKURAN_BARANG).
+        start_date (date/str, optional): First day of history to read.
+        end_date (date/str, optional): Last day of history; days without sales up to
+                                       it are filled with zeros.
+
+    Returns:
+        dict: Data source spec for run_bma_pipeline.
+    """
+    return {
+        "database": database,
+        "product_id": product_id,
+        "start_date": None if start_date is None else pd.Timestamp(start_date).date().isoformat(),
+        "end_date": None if end_date is None else pd.Timestamp(end_date).date().isoformat(),
+    }
+
+
+def product_filter(product_id):
+    """SQL condition and parameters selecting one product in train_data by its ID columns."""
+    parts = product_id.split("_")
+    if len(parts) != len(PRODUCT_ID_COLS):
+        raise ValueError("Invalid product_id format. Expected format: " + "_".join(PRODUCT_ID_COLS))
+    return " AND ".join(f"{expr} = ?" for expr in product_id_columns()), parts
+
+
+def product_id_columns(alias=None):
+    """
+    SQL expressions of the PRODUCT_ID_COLS as they appear in product IDs: text,
+    with MISSING_ID_TEXT for NULL, like preprocessing.load_and_prepare_data.
+    """
+    prefix = f"{alias}." if alias else ""
+    return [f"coalesce(CAST({prefix}{col} AS TEXT), '{MISSING_ID_TEXT}')" for col in PRODUCT_ID_COLS]
+
+
+def product_matches(alias, products_alias="p"):
+    """SQL condition joining rows (alias) to their product dimension row, NULL ID columns included."""
+    return " AND ".join(f"{products_alias}.{col} = {expr}"
+                        for col, expr in zip(PRODUCT_ID_COLS, product_id_columns(alias)))
+
+
+def ensure_product_dimension(conn):
+    """
+    Creates the product dimension and keys every train_data row by product_key.
+
+    Each distinct (KODE_BARANG, KLASIFIKASI_BARANG, WARNA_BARANG, UKURAN_BARANG)
+    gets an integer product_key, stored on train_data and indexed, so products
+    are filtered and grouped on one integer column instead of four text ones.
+    Rows appended without a key (e.g. by older versions) are backfilled.
+    NULL ID columns are keyed like product_id_columns renders them.
+    """
+    id_columns = ", ".join(f"{col} TEXT" for col in PRODUCT_ID_COLS)
+    conn.execute("CREATE SEQUENCE IF NOT EXISTS product_key_seq START 1")
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {PRODUCT_TABLE} (
+        product_key INTEGER PRIMARY KEY DEFAULT nextval('product_key_seq'),
+        product_id TEXT UNIQUE,
+        {id_columns}
+    )
+    """)
+    conn.execute(f"ALTER TABLE {TRAIN_DATA_TABLE} ADD COLUMN IF NOT EXISTS product_key INTEGER")
+
+    # Products registered by older versions with NULL ID columns, whose IDs skipped them
+    any_null = " OR ".join(f"{col} IS NULL" for col in PRODUCT_ID_COLS)
+    conn.execute(f"""
+    UPDATE {PRODUCT_TABLE}
+    SET product_id = concat_ws('_', {", ".join(product_id_columns())}),
+        {", ".join(f"{col} = {expr}" for col, expr in zip(PRODUCT_ID_COLS, product_id_columns()))}
+    WHERE ({any_null})
+      AND concat_ws('_', {", ".join(product_id_columns())}) NOT IN (SELECT product_id FROM {PRODUCT_TABLE})
+    """)
+
+    unkeyed = conn.execute(f"SELECT COUNT(*) FROM {TRAIN_DATA_TABLE} WHERE product_key IS NULL").fetchone()[0]
+    if unkeyed:
+        register_products(conn, TRAIN_DATA_TABLE)
+        conn.execute(f"""
+        UPDATE {TRAIN_DATA_TABLE} SET product_key = p.product_key
+        FROM {PRODUCT_TABLE} p
+        WHERE {TRAIN_DATA_TABLE}.product_key IS NULL AND {product_matches(TRAIN_DATA_TABLE)}
+        """)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {TRAIN_DATA_TABLE}_product_key_idx ON {TRAIN_DATA_TABLE} (product_key)")
+
+
+def ensure_daily_rollup(conn):
+    """
+    Creates the daily_product_sales rollup and builds it if it is out of date.
+
+    The rollup holds one row per product_key and day, from the product's first
+    to its last sale: the day's total TARGET_COLUMN and number of train_data
+    rows, zeros on days without sales. It is rebuilt from train_data when its
+    row counts no longer add up to the keyed train_data rows (e.g. rows were
+    appended by a version without the rollup); appends keep it up to date
+    through add_to_daily_rollup.
+    """
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {DAILY_SALES_TABLE} (
+        product_key INTEGER,
+        {DATE_COLUMN} DATE,
+        total_weight DOUBLE,
+        row_count INTEGER,
+        PRIMARY KEY (product_key, {DATE_COLUMN})
+    )
+    """)
+    keyed_rows, first_date, last_date = conn.execute(f"""
+    SELECT COUNT(*), MIN({DATE_COLUMN}), MAX({DATE_COLUMN}) FROM {TRAIN_DATA_TABLE}
+    WHERE product_key IS NOT NULL AND {DATE_COLUMN} IS NOT NULL
+    """).fetchone()
+    rolled_up = conn.execute(f"SELECT COALESCE(SUM(row_count), 0) FROM {DAILY_SALES_TABLE}").fetchone()[0]
+    if rolled_up != keyed_rows:
+        conn.execute(f"DELETE FROM {DAILY_SALES_TABLE}")
+        if keyed_rows:
+            add_to_daily_rollup(conn, first_date, last_date)
+
+
+def add_to_daily_rollup(conn, start, end):
+    """
+    Adds the train_data rows dated from start to end to the daily rollup.
+
+    Must be called exactly once for newly appended rows, which must be the
+    only train_data rows in that date range that are not rolled up yet (as
+    validate_and_append_to_db guarantees by rejecting overlapping uploads).
+    Days of the affected products that became gaps (between the new rows and
+    their earlier or later sales) are filled with zeros.
+
+    Args:
+        conn: DuckDB connection (read-write).
+        start, end (date): Date range of the appended rows.
+    """
+    conn.execute(f"""
+    INSERT INTO {DAILY_SALES_TABLE}
+    SELECT product_key, {DATE_COLUMN}, SUM({TARGET_COLUMN}), COUNT(*)
+    FROM {TRAIN_DATA_TABLE}
+    WHERE {DATE_COLUMN} BETWEEN ? AND ? AND product_key IS NOT NULL
+    GROUP BY product_key, {DATE_COLUMN}
+    ON CONFLICT DO UPDATE SET
+        total_weight = total_weight + excluded.total_weight,
+        row_count = row_count + excluded.row_count
+    """, [start, end])
+
+    # Per affected product, the days from just after its last sale before the
+    # range (or its first sale in it) to just before its first sale after the
+    # range (or its last sale in it)
+    conn.execute(f"""
+    INSERT OR IGNORE INTO {DAILY_SALES_TABLE}
+    SELECT product_key, CAST(unnest(generate_series(gap_start, gap_end, INTERVAL 1 DAY)) AS DATE), 0, 0
+    FROM (
+        SELECT product_key,
+               COALESCE(MAX({DATE_COLUMN}) FILTER ({DATE_COLUMN} < CAST($1 AS DATE)) + 1,
+                        MIN({DATE_COLUMN}) FILTER ({DATE_COLUMN} >= CAST($1 AS DATE))) AS gap_start,
+               COALESCE(MIN({DATE_COLUMN}) FILTER ({DATE_COLUMN} > CAST($2 AS DATE)) - 1,
+                        MAX({DATE_COLUMN}) FILTER ({DATE_COLUMN} <= CAST($2 AS DATE))) AS gap_end
+        FROM {DAILY_SALES_TABLE}
+        WHERE product_key IN (
+            SELECT product_key FROM {DAILY_SALES_TABLE}
+            WHERE {DATE_COLUMN} BETWEEN $1 AND $2 AND row_count > 0
+        )
+        GROUP BY product_key
+    )
+    """, [start, end])
+
+
+def has_daily_rollup(conn):
+    """Whether the database has the daily_product_sales rollup."""
+    return conn.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", [DAILY_SALES_TABLE]
+    ).fetchone()[0] > 0
+
+
+def register_products(conn, source):
+    """
+    Adds the products found in a table or query to the product dimension.
+
+    ID columns are stored as product_id_columns renders them, so a NULL column
+    becomes MISSING_ID_TEXT and the product_id matches the pandas PRODUCT_ID.
+
+    Args:
+        conn: DuckDB connection (read-write).
+        source (str): Table name or parenthesized query with the PRODUCT_ID_COLS columns.
+
+    Returns:
+        int: Number of new products.
+    """
+    columns = ", ".join(PRODUCT_ID_COLS)
+    as_text = ", ".join(f"{expr} AS {col}" for col, expr in zip(PRODUCT_ID_COLS, product_id_columns()))
+    before = conn.execute(f"SELECT COUNT(*) FROM {PRODUCT_TABLE}").fetchone()[0]
+    conn.execute(f"""
+    INSERT INTO {PRODUCT_TABLE} (product_id, {columns})
+    SELECT concat_ws('_', {columns}) AS product_id, {columns}
+    FROM (SELECT DISTINCT {as_text} FROM {source})
+    WHERE concat_ws('_', {columns}) NOT IN (SELECT product_id FROM {PRODUCT_TABLE})
+    ORDER BY product_id
+    """)
+    return conn.execute(f"SELECT COUNT(*) FROM {PRODUCT_TABLE}").fetchone()[0] - before
+
+
+def lookup_product_key(conn, product_id):
+    """Returns the integer product_key of a product ID, or None if it is unknown."""
+    row = conn.execute(f"SELECT product_key FROM {PRODUCT_TABLE} WHERE product_id = ?", [product_id]).fetchone()
+    return row[0] if row else None
+
+
+def product_condition(conn, product_id):
+    """
+    SQL condition and parameters selecting one product in train_data.
+
+    Uses the integer product_key when the product dimension exists, otherwise
+    the four product ID columns.
+    """
+    product_filter(product_id)  # Validates the format
+    try:
+        key = lookup_product_key(conn, product_id)
+    except Exception: # No product dimension yet
+        return product_filter(product_id)
+    return "product_key = ?", [key]
+
+
+def connect(database, read_only=False, retries=DUCKDB_OPEN_RETRIES):
+    """
+    Opens the DuckDB database, retrying while another process holds the file
+    (DuckDB lets one process write, or several read). Retry n waits
+    n x DUCKDB_RETRY_DELAY seconds.
+
+    Raises:
+        duckdb.IOException: If the file is still locked after all retries.
+    """
+    import duckdb
+
+    for attempt in range(retries):
+        try:
+            return duckdb.connect(database, read_only=read_only)
+        except duckdb.IOException:
+            if attempt == retries - 1:
+                raise
+            time.sleep(DUCKDB_RETRY_DELAY * (attempt + 1))
+
+
+def is_lock_error(error):
+    """Whether error is DuckDB failing to open a file another process holds locked."""
+    import duckdb
+    return isinstance(error, duckdb.IOException)
+
+
+def daily_product_series(conn, product_id, start=None, end=None):
+    """
+    Daily TOTAL_JUMLAH of a product from train_data, gap-filled with zeros like filter_product.
+
+    The days are read from the daily_product_sales rollup when the database
+    has one, otherwise filtering and the daily SUM run over train_data. Only
+    one row per day is fetched, as NumPy arrays, and scattered into the daily
+    range.
+
+    Args:
+        conn: DuckDB connection.
+        product_id (str): Product ID (KODE_BARANG_KLASIFIKASI_BARANG_WARNA_BARANG_UKURAN_BARANG).
+        start (date, optional): First date to return; earlier history is not read.
+        end (date, optional): Last date to return, zero-filled past the last sale.
+
+    Returns:
+        pd.DataFrame: TOTAL_JUMLAH indexed by a contiguous daily DatetimeIndex.
+    """
+    condition, params = product_condition(conn, product_id)
+    if condition.startswith("product_key") and has_daily_rollup(conn):
+        source, total = DAILY_SALES_TABLE, "SUM(total_weight)"
+    else:
+        source, total = TRAIN_DATA_TABLE, f"SUM({TARGET_COLUMN})"
+    if end is not None:
+        condition += f" AND {DATE_COLUMN} <= ?"
+        params = params + [pd.Timestamp(end).date()]
+    first_date, last_date = conn.execute(
+        f"SELECT MIN({DATE_COLUMN}), MAX({DATE_COLUMN}) FROM {source} WHERE {condition}", params
+    ).fetchone()
+    if first_date is None:
+        return pd.DataFrame({"TOTAL_JUMLAH": []}, index=pd.DatetimeIndex([], name=DATE_COLUMN))
+
+    first_date = pd.Timestamp(first_date) if start is None else max(pd.Timestamp(first_date), pd.Timestamp(start))
+    last_date = pd.Timestamp(last_date) if end is None else pd.Timestamp(end)
+    daily = conn.execute(f"""
+    SELECT datediff('day', CAST(? AS DATE), {DATE_COLUMN}) AS day, {total} AS total
+    FROM {source}
+    WHERE {condition} AND {DATE_COLUMN} >= ?
+    GROUP BY {DATE_COLUMN}
+    """, [first_date.date()] + params + [first_date.date()]).fetchnumpy()
+
+    index = pd.date_range(first_date, last_date, freq="D", name=DATE_COLUMN)
+    values = np.zeros(len(index), dtype=np.float64)
+    values[np.asarray(daily["day"], dtype=np.intp)] = np.asarray(daily["total"], dtype=np.float64)
+    return pd.DataFrame({"TOTAL_JUMLAH": values}, index=index)
+
+
+def product_histories(conn):
+    """
+    Scans the daily rollup (or train_data without one) once for the history
+    span of every product.
+
+    Returns:
+        pd.DataFrame: product_id, first_date, last_date and n_days, the length of
+                      the gap-filled daily series from the first to the last sale.
+    """
+    source = DAILY_SALES_TABLE if has_daily_rollup(conn) else TRAIN_DATA_TABLE
+    histories = conn.execute(f"""
+    SELECT p.product_id, MIN(t.{DATE_COLUMN}) AS first_date, MAX(t.{DATE_COLUMN}) AS last_date
+    FROM {source} t JOIN {PRODUCT_TABLE} p USING (product_key)
+    GROUP BY p.product_id
+    ORDER BY p.product_id
+    """).fetchdf()
+    histories["n_days"] = (pd.to_datetime(histories["last_date"]) - pd.to_datetime(histories["first_date"])).dt.days + 1
+    return histories
+
+
+def load_daily_series(source):
+    """
+    Reads the daily series described by a data source spec from DuckDB.
+
+    Args:
+        source (dict): Spec from make_data_source.
+
+    Returns:
+        pd.DataFrame: TOTAL_JUMLAH indexed by a contiguous daily DatetimeIndex,
+                      the same frame filter_product builds from the CSV.
+    """
+    conn = connect(source["database"], read_only=True)
+    try:
+        return daily_product_series(conn, source["product_id"], source.get("start_date"), source.get("end_date"))
+    finally:
+        conn.close()
@@ -0,0 +1,183 @@
+import numpy as np
+import pandas as pd
+from .feature_engineering import build_lag_block, add_time_features, add_ramadhan_feature, add_holiday_features
+from .bma import fit_bma_ensemble
+from .evaluation import evaluate_predictions
+
+
+def horizon_buckets(config, max_horizon):
+    """
+    Returns the configured (first, last) horizon buckets covering 1..max_horizon.
+
+    Buckets starting after max_horizon are dropped, the remaining ones are
+    clipped to max_horizon, and the last one is extended to reach it.
+    """
+    buckets = []
+    for first, last in sorted(config['DIRECT_HORIZON_BUCKETS']):
+        if first > max_horizon:
+            break
+        buckets.append((first, min(last, max_horizon)))
+    if buckets and buckets[-1][1] < max_horizon:
+        buckets[-1] = (buckets[-1][0], max_horizon)
+    return buckets
+
+
+def build_direct_frame(target, horizon, config):
+    """
+    Builds the features for predicting `target` at least `horizon` steps ahead.
+
+    Only values known at the forecast origin are used: lags with an offset of at
+    least `horizon`, rolling means ending `horizon` steps back, and the calendar
+    features of the target date.
+
+    Args:
+        target (pd.Series): Daily target series. Future dates may be present as NaN.
+        horizon (int): Longest horizon the features must be available for.
+        config (dict): Dictionary holding configuration like N_LAGS, ROLL_WINDOWS etc.
+
+    Returns:
+        pd.DataFrame: Feature frame indexed like `target`.
+    """
+    frame = build_lag_block(target, config['N_LAGS'], config['N_WEEKS'], config['ROLL_WINDOWS'],
+                            min_lag=horizon, dtype=config['FEATURE_DTYPE'])
+    frame = add_time_features(frame)
+    frame = add_ramadhan_feature(frame)
+    frame = add_holiday_features(frame, config['EXTRA_HOLIDAY_FEATURES'])
+    return frame
+
+
+def fit_direct_models(df_filtered, config, metrics=None):
+    """
+    Fits one BMA ensemble per horizon bucket for direct multi-horizon forecasting.
+
+    The test set is the last TEST_SIZE days, forecast directly from the day
+    before it, so the test metrics measure the full multi-step forecast.
+
+    Args:
+        df_filtered (pd.DataFrame): Daily TOTAL_JUMLAH series from filter_product.
+        config (dict): Pipeline configuration from make_config.
+        metrics (PipelineMetrics, optional): Receives the stages of every bucket's ensemble.
+
+    Returns:
+        dict: Per-bucket fitted models and weights, test set forecasts and
+              metrics, and CV scores. Returns None if any bucket fails.
+    """
+    target = df_filtered["TOTAL_JUMLAH"]
+    test_size = config['TEST_SIZE']
+    if len(target) <= test_size:
+        print(f"ERROR: Not enough data ({len(target)} samples) for test set size {test_size}")
+        return None
+
+    origin = target.index[-test_size - 1]
+    y_test = target.iloc[-test_size:]
+    max_horizon = max(test_size, config['FUTURE_FORECAST_STEP'])
+
+    buckets = []
+    final_weights, cv_mse_scores = {}, {}
+    bma_forecast_test = np.zeros(test_size)
+    individual_forecasts_test = {}
+
+    for first, last in horizon_buckets(config, max_horizon):
+        label = f"h{first}-{last}"
+        print(f"\n=== Direct Horizon Bucket {label} ===")
+        test_slice = slice(first - 1, min(last, test_size))
+        if first > test_size:
+            print(f"ERROR: Horizon bucket {label} starts after the test set (size {test_size}).")
+            return None
+
+        try:
+            frame = build_direct_frame(target, last, config)
+            feature_names = list(frame.columns)
+            X_train = frame.loc[:origin]
+            y_train = target.loc[:origin]
+            known = X_train.notna().all(axis=1)
+            X_train, y_train = X_train[known], y_train[known]
+            X_test = frame.loc[y_test.index[test_slice]]
+        except Exception as e:
+            print(f"ERROR during direct feature engineering for {label}: {e}")
+            return None
+
+        if X_train.empty or X_test.isna().any().any():
+            print(f"ERROR: Not enough history to train horizon bucket {label}.")
+            return None
+        print(f"Train set size: {len(X_train)}, Test set size: {len(X_test)}")
+
+        ensemble = fit_bma_ensemble(X_train, y_train, X_test, y_test.iloc[test_slice], config, metrics)
+        if ensemble is None:
+            return None
+
+        bma_forecast_test[test_slice] = ensemble["bma_forecast_test"]
+        for name, forecast in ensemble["individual_forecasts_test"].items():
+            individual_forecasts_test.setdefault(name, {})[label] = forecast
+        final_weights[label] = ensemble["final_weights"]
+        cv_mse_scores[label] = ensemble["cv_mse_scores"]
+        buckets.append({
+            "horizons": (first, last),
+            "feature_names": feature_names,
+            "fitted_models": ensemble["fitted_models"],
+            "final_weights": ensemble["final_weights"],
+        })
+
+    # Individual test forecasts only exist for models active in every bucket
+    individual_forecasts_test = {
+        name: np.concatenate([forecasts[label] for label in final_weights])
+        for name, forecasts in individual_forecasts_test.items() if len(forecasts) == len(final_weights)
+    }
+
+    print("\n--- Evaluating Direct BMA Forecast on Test Set ---")
+    bma_metrics_test = evaluate_predictions(y_test, bma_forecast_test)
+    print(f"[Direct BMA Test Set] MSE: {bma_metrics_test['MSE']:.2f} | MAPE: {bma_metrics_test['MAPE']:.2%}")
+    individual_metrics_test = {name: evaluate_predictions(y_test, forecast)
+                               for name, forecast in individual_forecasts_test.items()}
+
+    return {
+        "config": config,
+        "target": target,
+        "buckets": buckets,
+        "final_weights": final_weights,
+        "individual_forecasts_test": individual_forecasts_test,
+        "bma_forecast_test": bma_forecast_test,
+        "y_test": y_test,
+        "test_indices": y_test.index,
+        "bma_metrics_test": bma_metrics_test,
+        "individual_metrics_test": individual_metrics_test,
+        "cv_mse_scores": cv_mse_scores,
+    }
+
+
+def forecast_direct(fit, future_dates):
+    """
+    Forecasts all future dates directly, with one predict call per model and bucket.
+
+    Args:
+        fit (dict): Result of fit_direct_models.
+        future_dates (pd.DatetimeIndex): Consecutive dates following the target series.
+
+    Returns:
+        np.ndarray: BMA forecast for each future date.
+    """
+    config = fit["config"]
+    extended = pd.concat([fit["target"], pd.Series(np.nan, index=future_dates)])
+    predictions = np.zeros(len(future_dates))
+    # Longest look-back of any feature, so only the needed tail of history is featurized
+    max_offset = max(config['N_LAGS'], 7 * config['N_WEEKS']) + max(config['ROLL_WINDOWS'], default=0)
+
+    for bucket in fit["buckets"]:
+        first, last = bucket["horizons"]
+        if first > len(future_dates):
+            break
+        tail = extended.iloc[-(len(future_dates) + last + max_offset):]
+        frame = build_direct_frame(tail, last, config)
+        X = frame.loc[future_dates[first - 1:last], bucket["feature_names"]]
+        step_slice = slice(first - 1, first - 1 + len(X))
+        for model_name, model in bucket["fitted_models"].items():
+            weight = bucket["final_weights"].get(model_name, 0)
+            if weight <= 0:
+                continue
+            try:
+                pred = model.predict(X)
+                predictions[step_slice] += weight * np.maximum(pred, 0)  # Apply weight and ensure non-negative
+            except Exception as e:
+                print(f"  ERROR predicting horizons {first}-{last} with {model_name}: {e}")
+
+    return predictions
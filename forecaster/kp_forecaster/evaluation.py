@@ -1,13 +1,16 @@
-from sklearn.metrics import mean_absolute_percentage_error, mean_squared_error, mean_absolute_error
 import numpy as np
 
+# scikit-learn is imported on first use, so importing the pipeline stays cheap
+
 def evaluate(y_true, y_pred):
+    from sklearn.metrics import mean_absolute_percentage_error, mean_squared_error
     mse = mean_squared_error(y_true, y_pred)
     mape = mean_absolute_percentage_error(y_true, y_pred)
     return {"MSE": mse, "MAPE": mape}
 
 def evaluate_predictions(y_true, y_pred):
     """Calculates MSE and MAPE."""
+    from sklearn.metrics import mean_absolute_percentage_error, mean_squared_error, mean_absolute_error
     mae = mean_absolute_error(y_true, y_pred)
     mse = mean_squared_error(y_true, y_pred)
     # Handle potential zeros in y_true for MAPE calculation
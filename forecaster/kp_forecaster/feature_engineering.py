@@ -1,29 +1,20 @@
+import numpy as np
 import pandas as pd
-ramadhan_dates = {
-    2014: ("2014-06-28", "2014-07-27"),
-    2015: ("2015-06-18", "2015-07-17"),
-    2016: ("2016-06-06", "2016-07-05"),
-    2017: ("2017-05-27", "2017-06-25"),
-    2018: ("2018-05-16", "2018-06-14"),
-    2019: ("2019-05-06", "2019-06-04"),
-    2020: ("2020-04-24", "2020-05-23"),
-    2021: ("2021-04-13", "2021-05-12"),
-    2022: ("2022-04-02", "2022-05-01"),
-    2023: ("2023-03-23", "2023-04-21"),
-}
-
-eid_dates = {year: pd.to_datetime(date[1]) for year, date in ramadhan_dates.items()}
+from numpy.lib.stride_tricks import sliding_window_view
+from .holiday_calendar import get_holiday_calendar
 
 # Create the is_ramadhan column
 def is_ramadhan_day(date):
-    year = date.year
-    if year in ramadhan_dates:
-        start, end = pd.to_datetime(ramadhan_dates[year])
-        return int(start <= date <= end)
-    return 0
+    return get_holiday_calendar().lookup(date, 'is_ramadhan')
 
 def add_ramadhan_feature(df):
-    df['is_ramadhan'] = df.index.to_series().apply(is_ramadhan_day)
+    df['is_ramadhan'] = get_holiday_calendar().features(df.index, ['is_ramadhan'])['is_ramadhan']
+    return df
+
+def add_holiday_features(df, names=('days_to_eid', 'is_holiday')):
+    """Adds holiday calendar features (see holiday_calendar.HOLIDAY_FEATURES) with one vectorized lookup."""
+    for name, values in get_holiday_calendar().features(df.index, names).items():
+        df[name] = values
     return df
 
 def add_time_features(df):
@@ -47,6 +38,62 @@ def add_rolling_features(df, windows=[7, 30]):
         df[f'roll_mean_{window}'] = df['TOTAL_JUMLAH'].shift(1).rolling(window).mean()
     return df
 
+def build_lag_block(target, n_lags=30, n_weeks=54, windows=[7, 30], min_lag=1, dtype="float32"):
+    """
+    Builds all lag, weekly-lag and rolling-mean features of a series in one array.
+
+    Every feature is read from a single strided (sliding-window) view over the
+    NaN-padded target and written into one column-major array, so the block is
+    allocated once instead of inserting hundreds of shifted columns one at a
+    time. Matches add_lag_features and add_rolling_features for min_lag=1.
+
+    Args:
+        target (pd.Series): Daily target series.
+        n_lags (int): Daily lags 1..n_lags.
+        n_weeks (int): Weekly lags 7..7 * n_weeks.
+        windows (list): Rolling-mean windows.
+        min_lag (int): Smallest lag offset to keep; rolling means end min_lag steps back.
+        dtype (str): Feature dtype, float32 halves the memory of the block.
+
+    Returns:
+        pd.DataFrame: Feature block indexed like `target`, NaN where history is missing.
+    """
+    min_lag = max(min_lag, 1)
+    offsets = list(range(min_lag, n_lags + 1))
+    names = [f'lag_{lag}' for lag in offsets]
+    for week in range(1, n_weeks + 1):
+        if week * 7 >= min_lag:
+            offsets.append(week * 7)
+            names.append(f'lag_week_{week}')
+    names += [f'roll_mean_{window}' for window in windows]
+
+    span = max([*offsets, *(min_lag + window - 1 for window in windows)], default=0)
+    padded = np.full(len(target) + span, np.nan, dtype=dtype)
+    padded[span:] = np.asarray(target, dtype=dtype)
+    # Row t of the view is target[t - span .. t], so offset k sits in column span - k
+    view = sliding_window_view(padded, span + 1)
+
+    # Column-major, like the pandas block it becomes, so every column is one contiguous copy
+    block = np.empty((len(target), len(names)), dtype=dtype, order='F')
+    for col, offset in enumerate(offsets):
+        block[:, col] = view[:, span - offset]
+    for col, window in enumerate(windows, start=len(offsets)):
+        first = span - min_lag - window + 1
+        block[:, col] = view[:, first:first + window].mean(axis=1, dtype=np.float64)
+    return pd.DataFrame(block, index=target.index, columns=names)
+
+def add_lag_block(df, n_lags=30, n_weeks=54, windows=[7, 30], dtype="float32"):
+    """
+    Returns `df` with the lag and rolling features of build_lag_block appended.
+
+    The columns of `df` are inserted in front of the block rather than concatenated,
+    so the feature block is never copied.
+    """
+    features = build_lag_block(df['TOTAL_JUMLAH'], n_lags, n_weeks, windows, dtype=dtype)
+    for position, column in enumerate(df.columns):
+        features.insert(position, column, df[column])
+    return features
+
 def create_features_for_step(date, extended_series, feature_columns, config):
     """
     Generates the feature set for a single future date step.
@@ -103,9 +150,11 @@ def create_features_for_step(date, extended_series, feature_columns, config):
     if 'dayofyear' in feature_columns: features['dayofyear'] = date.dayofyear
     # Add other time features if they were used in training
 
-    # Ramadhan feature (match logic from add_ramadhan_feature)
-    if 'is_ramadhan' in feature_columns:
-        features['is_ramadhan'] = is_ramadhan_day(date)
+    # Holiday features (match logic from add_ramadhan_feature/add_holiday_features)
+    calendar = get_holiday_calendar()
+    for name in ('is_ramadhan', 'days_to_eid', 'is_holiday'):
+        if name in feature_columns:
+            features[name] = calendar.lookup(date, name)
 
     # --- Create DataFrame and ensure column consistency ---
     try:
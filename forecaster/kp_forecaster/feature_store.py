@@ -0,0 +1,192 @@
+import json
+import pandas as pd
+from .config import (
+    DATE_COLUMN, N_LAGS, N_WEEKS, ROLL_WINDOWS, FEATURE_DTYPE, EXTRA_HOLIDAY_FEATURES,
+    DUCKDB_OPEN_RETRIES
+)
+from .feature_engineering import add_lag_block, add_time_features, add_ramadhan_feature, add_holiday_features
+from .data_source import connect, daily_product_series
+
+FEATURE_TABLE = "product_features"
+FEATURE_META_TABLE = "product_features_meta"
+# Bump when feature definitions change so the store is rebuilt
+FEATURE_STORE_VERSION = 1
+
+
+def default_feature_config():
+    """Feature configuration from kp_forecaster.config."""
+    return {'N_LAGS': N_LAGS, 'N_WEEKS': N_WEEKS, 'ROLL_WINDOWS': ROLL_WINDOWS, 'FEATURE_DTYPE': FEATURE_DTYPE,
+            'EXTRA_HOLIDAY_FEATURES': EXTRA_HOLIDAY_FEATURES}
+
+
+def feature_lookback(config):
+    """Number of past days any feature of a row can depend on."""
+    return max(config['N_LAGS'], 7 * config['N_WEEKS'], max(config['ROLL_WINDOWS'], default=0))
+
+
+def feature_config_key(config):
+    """Identifies the feature definitions a store was materialized with."""
+    return json.dumps({"version": FEATURE_STORE_VERSION, "N_LAGS": config['N_LAGS'],
+                       "N_WEEKS": config['N_WEEKS'], "ROLL_WINDOWS": list(config['ROLL_WINDOWS']),
+                       "FEATURE_DTYPE": config['FEATURE_DTYPE'],
+                       "EXTRA_HOLIDAY_FEATURES": list(config['EXTRA_HOLIDAY_FEATURES'])})
+
+
+def stored_config_key(conn):
+    """Returns the feature config key of the store, or None if it was never created."""
+    try:
+        row = conn.execute(f"SELECT config_key FROM {FEATURE_META_TABLE}").fetchone()
+    except Exception: # Table missing
+        return None
+    return row[0] if row else None
+
+
+def build_features(daily, config):
+    """Runs the training feature engineering on a daily TOTAL_JUMLAH frame (NaN rows kept)."""
+    df = add_lag_block(daily, config['N_LAGS'], config['N_WEEKS'], config['ROLL_WINDOWS'], config['FEATURE_DTYPE'])
+    df = add_time_features(df)
+    df = add_ramadhan_feature(df)
+    df = add_holiday_features(df, config['EXTRA_HOLIDAY_FEATURES'])
+    return df
+
+
+def ensure_feature_store(conn, config=None):
+    """
+    Creates the feature table for the current feature configuration.
+
+    The table is dropped and recreated when the configuration (N_LAGS, N_WEEKS,
+    ROLL_WINDOWS, FEATURE_DTYPE, EXTRA_HOLIDAY_FEATURES) differs from the one it
+    was materialized with.
+    """
+    config = config or default_feature_config()
+    config_key = feature_config_key(config)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {FEATURE_META_TABLE} (config_key TEXT)")
+    if stored_config_key(conn) == config_key:
+        return
+
+    # Column names follow build_features, taken from a one-day frame
+    sample = build_features(pd.DataFrame({"TOTAL_JUMLAH": [0.0]}, index=pd.DatetimeIndex(["2000-01-01"])), config)
+    feature_columns = ", ".join(f"{col} DOUBLE" for col in sample.columns if col != "TOTAL_JUMLAH")
+    conn.execute(f"DROP TABLE IF EXISTS {FEATURE_TABLE}")
+    conn.execute(f"""
+    CREATE TABLE {FEATURE_TABLE} (
+        product_id TEXT,
+        {DATE_COLUMN} DATE,
+        TOTAL_JUMLAH DOUBLE,
+        {feature_columns}
+    )
+    """)
+    conn.execute(f"DELETE FROM {FEATURE_META_TABLE}")
+    conn.execute(f"INSERT INTO {FEATURE_META_TABLE} VALUES (?)", [config_key])
+
+
+def refresh_product_features(conn, product_id, config=None, since=None):
+    """
+    Brings a product's materialized features up to date with train_data.
+
+    Only rows after the last materialized date are computed, reading just the
+    history their lags need. When `since` is on or before that date (older
+    data was appended), rows from `since` onwards are recomputed instead.
+
+    Args:
+        conn: DuckDB connection (read-write).
+        product_id (str): Product ID.
+        config (dict, optional): Feature configuration, defaults to kp_forecaster.config.
+        since (date, optional): Earliest date of newly appended data.
+
+    Returns:
+        int: Number of feature rows written.
+    """
+    config = config or default_feature_config()
+    ensure_feature_store(conn, config)
+    last_date = conn.execute(
+        f"SELECT MAX({DATE_COLUMN}) FROM {FEATURE_TABLE} WHERE product_id = ?", [product_id]
+    ).fetchone()[0]
+
+    start = None
+    if last_date is not None:
+        start = pd.Timestamp(last_date) + pd.Timedelta(days=1)
+        if since is not None and pd.Timestamp(since) < start:
+            start = pd.Timestamp(since)
+            conn.execute(f"DELETE FROM {FEATURE_TABLE} WHERE product_id = ? AND {DATE_COLUMN} >= ?",
+                         [product_id, start.date()])
+
+    window_start = None if start is None else start - pd.Timedelta(days=feature_lookback(config))
+    daily = daily_product_series(conn, product_id, window_start)
+    if daily.empty:
+        return 0
+    features = build_features(daily, config)
+    if start is not None:
+        features = features[features.index >= start]
+    if features.empty:
+        return 0
+
+    new_rows = features.astype(float).reset_index()
+    new_rows.insert(0, "product_id", product_id)
+    conn.register("new_feature_rows", new_rows)
+    try:
+        conn.execute(f"INSERT INTO {FEATURE_TABLE} BY NAME SELECT * FROM new_feature_rows")
+    finally:
+        conn.unregister("new_feature_rows")
+    return len(new_rows)
+
+
+def refresh_features_after_append(conn, product_ids, since, config=None):
+    """
+    Updates the features of already materialized products after new train_data rows.
+
+    Products that were never materialized are skipped; they are built in full
+    the first time they are refreshed for forecasting.
+
+    Returns:
+        int: Number of products whose features changed.
+    """
+    config = config or default_feature_config()
+    ensure_feature_store(conn, config)
+    tracked = {row[0] for row in conn.execute(f"SELECT DISTINCT product_id FROM {FEATURE_TABLE}").fetchall()}
+    updated = 0
+    for product_id in product_ids:
+        if product_id in tracked and refresh_product_features(conn, product_id, config, since=since):
+            updated += 1
+    return updated
+
+
+def read_product_features(conn, product_id, config=None, end_date=None):
+    """
+    Reads a product's training matrix from the store.
+
+    Raises:
+        ValueError: If the store was materialized with a different feature configuration.
+
+    Returns:
+        pd.DataFrame: TOTAL_JUMLAH and feature columns indexed by date, including
+                      rows with incomplete lags (as before dropna in the pipeline).
+    """
+    config = config or default_feature_config()
+    if stored_config_key(conn) != feature_config_key(config):
+        raise ValueError("Feature store was materialized with a different feature configuration.")
+
+    query = f"SELECT * EXCLUDE (product_id) FROM {FEATURE_TABLE} WHERE product_id = ?"
+    params = [product_id]
+    if end_date is not None:
+        query += f" AND {DATE_COLUMN} <= ?"
+        params.append(end_date)
+    df = conn.execute(query + f" ORDER BY {DATE_COLUMN}", params).fetchdf()
+    df[DATE_COLUMN] = pd.to_datetime(df[DATE_COLUMN]).astype("datetime64[ns]")
+    # Stored as DOUBLE; the lag block goes back to the dtype it was built with
+    block = [col for col in df.columns if col.startswith(("lag_", "roll_mean_"))]
+    df = df.astype({col: config['FEATURE_DTYPE'] for col in block})
+    return df.set_index(DATE_COLUMN).asfreq("D")
+
+
+def load_product_features(database, product_id, config=None, end_date=None, retries=DUCKDB_OPEN_RETRIES):
+    """
+    Opens the DuckDB database read-only and reads a product's training matrix.
+
+    Retries briefly while another process holds the write lock.
+    """
+    conn = connect(database, read_only=True, retries=retries)
+    try:
+        return read_product_features(conn, product_id, config, end_date)
+    finally:
+        conn.close()
@@ -0,0 +1,226 @@
+import os
+import re
+import uuid
+import pandas as pd
+from .config import FORECAST_HISTORY_TABLE, FORECAST_RESULTS_TABLE, FORECAST_LATEST_TABLE, FORECAST_STAGING_TABLE
+
+# Directory, next to the database file, where workers stage forecasts as Parquet
+STAGING_DIR_NAME = "staging"
+STAGE_KEY_PATTERN = re.compile(r"[0-9a-f]{32}")
+# Directory forecasts are downloaded from as CSV (rendered on demand by the API)
+FORECAST_CSV_DIR = "output"
+
+
+def ensure_forecast_tables(conn):
+    """
+    Creates the forecast tables: forecast_history (one row per forecast),
+    forecast_results (its daily rows), forecast_latest (newest forecast per
+    product) and forecast_staging (staged files already registered).
+    """
+    conn.execute(f"""
+        CREATE SEQUENCE IF NOT EXISTS forecast_history_id_seq START 1;
+        CREATE TABLE IF NOT EXISTS {FORECAST_HISTORY_TABLE} (
+            id INTEGER PRIMARY KEY DEFAULT nextval('forecast_history_id_seq'),
+            product_id TEXT,
+            date_start DATE,
+            date_end DATE,
+            csv_path TEXT,
+            timestamp TIMESTAMP DEFAULT NOW()
+        )
+    """)
+
+    # History is listed per product, newest first
+    conn.execute(f"""
+    CREATE INDEX IF NOT EXISTS forecast_history_product_ts_idx ON {FORECAST_HISTORY_TABLE} (product_id, timestamp)
+    """)
+
+    # Newest forecast of every product, kept up to date by insert_forecast
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {FORECAST_LATEST_TABLE} (
+        product_id TEXT PRIMARY KEY,
+        forecast_id INTEGER
+    )
+    """)
+    # Forecast rows of every forecast_history entry
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {FORECAST_RESULTS_TABLE} (
+        forecast_id INTEGER,
+        TANGGAL DATE,
+        TOTAL_JUMLAH DOUBLE,
+        PRIMARY KEY (forecast_id, TANGGAL)
+    )
+    """)
+
+    # Staged forecast files already registered, so that a file left behind
+    # after its transaction committed is not registered twice
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {FORECAST_STAGING_TABLE} (
+        stage_key TEXT PRIMARY KEY,
+        forecast_id INTEGER
+    )
+    """)
+
+
+def backfill_latest_forecasts(conn):
+    """Adds the products missing from forecast_latest (e.g. forecast by older versions)."""
+    conn.execute(f"""
+    INSERT INTO {FORECAST_LATEST_TABLE}
+    SELECT product_id, max(id) FROM {FORECAST_HISTORY_TABLE}
+    WHERE product_id NOT IN (SELECT product_id FROM {FORECAST_LATEST_TABLE})
+    GROUP BY product_id
+    """)
+
+
+def forecast_csv_name(forecast_id):
+    """Download name of a forecast exported on demand from forecast_results."""
+    return f"forecast_{forecast_id}.csv"
+
+
+def insert_forecast(conn, product_id, rows):
+    """
+    Stores one forecast: a forecast_history row, its daily rows in
+    forecast_results (one bulk INSERT ... SELECT) and the forecast_latest entry.
+
+    Runs inside the caller's transaction, if any. csv_path holds the name
+    the forecast is downloaded as; no file is written.
+
+    Args:
+        conn: DuckDB connection (read-write).
+        product_id (str): Product ID.
+        rows (str): Table name or parenthesized query with TANGGAL and TOTAL_JUMLAH.
+
+    Returns:
+        int: ID of the new forecast.
+    """
+    forecast_id = conn.execute("SELECT nextval('forecast_history_id_seq')").fetchone()[0]
+    conn.execute(f"""
+    INSERT INTO {FORECAST_RESULTS_TABLE} (forecast_id, TANGGAL, TOTAL_JUMLAH)
+    SELECT ?, CAST(TANGGAL AS DATE), CAST(TOTAL_JUMLAH AS DOUBLE) FROM {rows}
+    """, [forecast_id])
+    conn.execute(f"""
+    INSERT INTO {FORECAST_HISTORY_TABLE} (id, product_id, date_start, date_end, csv_path)
+    SELECT ?, ?, MIN(TANGGAL), MAX(TANGGAL), ?
+    FROM {FORECAST_RESULTS_TABLE} WHERE forecast_id = ?
+    """, [forecast_id, product_id, os.path.join(FORECAST_CSV_DIR, forecast_csv_name(forecast_id)), forecast_id])
+    conn.execute(
+        f"INSERT OR REPLACE INTO {FORECAST_LATEST_TABLE} (product_id, forecast_id) VALUES (?, ?)",
+        [product_id, forecast_id]
+    )
+    return forecast_id
+
+
+def staging_dir(database):
+    """Directory where forecasts for this database are staged."""
+    return os.path.join(os.path.dirname(os.path.abspath(database)), STAGING_DIR_NAME)
+
+
+def stage_forecast(database, product_id, future_df):
+    """
+    Writes a forecast to the staging directory as a Parquet file.
+
+    The file is written under a temporary name and renamed into place, so a
+    staged file is always complete. It becomes a stored forecast once
+    register_staged_forecasts runs on a read-write connection.
+
+    Args:
+        database (str): Path of the DuckDB database the forecast belongs to.
+        product_id (str): Product ID.
+        future_df (pd.DataFrame): TANGGAL and TOTAL_JUMLAH of the forecast.
+
+    Returns:
+        str: Stage key of the file.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    directory = staging_dir(database)
+    os.makedirs(directory, exist_ok=True)
+    stage_key = uuid.uuid4().hex
+    table = pa.table({
+        "product_id": pa.array([product_id] * len(future_df), type=pa.string()),
+        "TANGGAL": pa.array(pd.to_datetime(future_df["TANGGAL"]).dt.date, type=pa.date32()),
+        "TOTAL_JUMLAH": pa.array(future_df["TOTAL_JUMLAH"].astype("float64")),
+    })
+    path = os.path.join(directory, f"{stage_key}.parquet")
+    pq.write_table(table, path + ".tmp")
+    os.replace(path + ".tmp", path)
+    return stage_key
+
+
+def staged_forecasts(database):
+    """Stage keys of the forecasts waiting in the staging directory."""
+    directory = staging_dir(database)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(entry.name[:-len(".parquet")] for entry in os.scandir(directory) if entry.name.endswith(".parquet"))
+
+
+def register_staged_forecasts(conn, database, stage_keys=None):
+    """
+    Moves staged forecasts into the forecast tables, one transaction each.
+
+    A staged file is deleted once its forecast is committed. Registering a
+    key again (e.g. after a crash before the delete) returns the forecast
+    already stored for it.
+
+    Args:
+        conn: DuckDB connection (read-write).
+        database (str): Path of the database, locating the staging directory.
+        stage_keys (list, optional): Keys to register, default all staged files.
+
+    Returns:
+        dict: Stage key -> forecast ID, for the keys that were registered.
+    """
+    ensure_forecast_tables(conn)
+    registered = {}
+    for stage_key in (staged_forecasts(database) if stage_keys is None else stage_keys):
+        if not STAGE_KEY_PATTERN.fullmatch(stage_key):
+            continue
+        path = os.path.join(staging_dir(database), f"{stage_key}.parquet")
+        row = conn.execute(
+            f"SELECT forecast_id FROM {FORECAST_STAGING_TABLE} WHERE stage_key = ?", [stage_key]
+        ).fetchone()
+        if row is None:
+            if not os.path.exists(path):
+                continue
+            product_id = conn.execute("SELECT product_id FROM read_parquet(?) LIMIT 1", [path]).fetchone()[0]
+            conn.execute("BEGIN TRANSACTION")
+            try:
+                forecast_id = insert_forecast(conn, product_id, "read_parquet('{}')".format(path.replace("'", "''")))
+                conn.execute(f"INSERT INTO {FORECAST_STAGING_TABLE} VALUES (?, ?)", [stage_key, forecast_id])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        else:
+            forecast_id = row[0]
+        if os.path.exists(path):
+            os.remove(path)
+        registered[stage_key] = forecast_id
+    return registered
+
+
+def store_forecast(database, product_id, future_df, retries=10):
+    """
+    Stores a forecast from a process other than the API (e.g. a Celery worker).
+
+    The forecast is staged, then registered through a short read-write
+    connection. If the database stays locked by another process for all
+    retries, the file stays staged for that process to register.
+
+    Returns:
+        dict: stage_key, and forecast_id (None while the forecast is only staged).
+    """
+    import duckdb
+    from .data_source import connect
+
+    stage_key = stage_forecast(database, product_id, future_df)
+    try:
+        conn = connect(database, retries=retries)
+    except duckdb.IOException:
+        return {"stage_key": stage_key, "forecast_id": None}
+    try:
+        forecast_id = register_staged_forecasts(conn, database, [stage_key]).get(stage_key)
+    finally:
+        conn.close()
+    return {"stage_key": stage_key, "forecast_id": forecast_id}
@@ -0,0 +1,259 @@
+import warnings
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from .holiday_calendar import get_holiday_calendar
+
+# Calendar features produced by add_time_features/add_ramadhan_feature/add_holiday_features,
+# keyed by column name. Each entry maps a DatetimeIndex to one value per date.
+CALENDAR_FEATURES = {
+    'day': lambda idx: idx.day,
+    'month': lambda idx: idx.month,
+    'year': lambda idx: idx.year,
+    'dayofweek': lambda idx: idx.dayofweek,
+    'dayofyear': lambda idx: idx.dayofyear,
+    'weekofyear': lambda idx: idx.isocalendar().week.to_numpy(),
+    'week': lambda idx: idx.isocalendar().week.to_numpy(),
+    'is_ramadhan': lambda idx: get_holiday_calendar().features(idx, ['is_ramadhan'])['is_ramadhan'],
+    'days_to_eid': lambda idx: get_holiday_calendar().features(idx, ['days_to_eid'])['days_to_eid'],
+    'is_holiday': lambda idx: get_holiday_calendar().features(idx, ['is_holiday'])['is_holiday'],
+}
+
+
+@lru_cache(maxsize=64)
+def future_calendar(start, periods):
+    """
+    Calendar features of `periods` consecutive days from `start`.
+
+    Future calendars do not depend on the series, so they are computed once per
+    date range and shared by every product forecast over it. The arrays are
+    read-only.
+
+    Returns:
+        dict: Feature name -> np.ndarray of length `periods`.
+    """
+    dates = pd.date_range(start, periods=periods, freq="D")
+    calendar = {}
+    for name, feature in CALENDAR_FEATURES.items():
+        calendar[name] = np.asarray(feature(dates), dtype=np.float64)
+        calendar[name].flags.writeable = False
+    return calendar
+
+
+class FeaturePlan:
+    """
+    Compiled layout of a trained feature vector.
+
+    The trained `feature_names` are parsed once into integer index arrays so a
+    feature row can be filled by fancy indexing instead of name lookups:
+    lag slots and their offsets (`lag_i` -> i, `lag_week_i` -> 7 * i), rolling
+    slots and their windows (`roll_mean_w`) and calendar slots. Columns the plan
+    does not recognise are left at 0, matching the old reindex(fill_value=0).
+    """
+
+    def __init__(self, feature_names):
+        self.feature_names = list(feature_names)
+        self.n_features = len(self.feature_names)
+
+        lag_slots, lag_offsets = [], []
+        roll_slots, roll_windows = [], []
+        self.calendar_slots = {}
+        for slot, name in enumerate(self.feature_names):
+            if name.startswith('lag_week_'):
+                lag_slots.append(slot)
+                lag_offsets.append(7 * int(name[len('lag_week_'):]))
+            elif name.startswith('lag_'):
+                lag_slots.append(slot)
+                lag_offsets.append(int(name[len('lag_'):]))
+            elif name.startswith('roll_mean_'):
+                roll_slots.append(slot)
+                roll_windows.append(int(name[len('roll_mean_'):]))
+            elif name in CALENDAR_FEATURES:
+                self.calendar_slots[name] = slot
+
+        self.lag_slots = np.array(lag_slots, dtype=np.intp)
+        self.lag_offsets = np.array(lag_offsets, dtype=np.intp)
+        self.roll_slots = np.array(roll_slots, dtype=np.intp)
+        self.roll_windows = np.array(roll_windows, dtype=np.intp)
+        # Offsets (1..w) gathered from the ring buffer for each rolling window
+        self.roll_offsets = [np.arange(1, w + 1, dtype=np.intp) for w in roll_windows]
+        self.max_offset = int(max([1, *lag_offsets, *roll_windows]))
+
+    def calendar_block(self, dates):
+        """
+        Builds the calendar part of the feature matrix for a range of dates.
+
+        Args:
+            dates (pd.DatetimeIndex): Dates to create calendar features for.
+
+        Returns:
+            np.ndarray: Array of shape (len(dates), n_features) with only the
+                        calendar slots filled; all other slots are 0.
+        """
+        dates = pd.DatetimeIndex(dates)
+        block = np.zeros((len(dates), self.n_features), dtype=np.float64)
+        if len(dates) and dates.equals(pd.date_range(dates[0], periods=len(dates), freq="D")):
+            calendar = future_calendar(dates[0], len(dates))
+            for name, slot in self.calendar_slots.items():
+                block[:, slot] = calendar[name]
+        else:
+            for name, slot in self.calendar_slots.items():
+                block[:, slot] = np.asarray(CALENDAR_FEATURES[name](dates), dtype=np.float64)
+        return block
+
+
+class RecursiveForecaster:
+    """
+    Preallocated ring buffer holding the target history for recursive forecasting.
+
+    Only the last `plan.max_offset` values are kept. Every step reads the lag and
+    rolling values straight out of the buffer and `push` overwrites the oldest
+    slot, so advancing the forecast never allocates pandas objects.
+    """
+
+    def __init__(self, plan, history):
+        self.plan = plan
+        history = np.asarray(history, dtype=np.float64)
+        self._capacity = plan.max_offset
+        self._buffer = np.zeros(self._capacity, dtype=np.float64)
+        tail = history[-self._capacity:]
+        self._buffer[:len(tail)] = tail
+        self._head = len(tail) % self._capacity  # Next slot to write
+        self._count = len(history)  # Total number of known values
+        self._total = float(history.sum())  # Running sum for the short-history fallback
+
+    def _fallback(self):
+        # Same fallback as create_features_for_step: mean of all known values
+        return self._total / self._count if self._count else 0.0
+
+    def feature_row(self, calendar_row, out=None):
+        """
+        Fills the feature vector for the next step.
+
+        Args:
+            calendar_row (np.ndarray): Row of `FeaturePlan.calendar_block` for the step.
+            out (np.ndarray, optional): Preallocated array to write into.
+
+        Returns:
+            np.ndarray: Feature vector of length `plan.n_features`.
+        """
+        plan = self.plan
+        if out is None:
+            out = np.empty(plan.n_features, dtype=np.float64)
+        out[:] = calendar_row
+
+        if len(plan.lag_slots):
+            values = self._buffer[(self._head - plan.lag_offsets) % self._capacity]
+            if self._count < self._capacity:
+                values[plan.lag_offsets > self._count] = self._fallback()
+            out[plan.lag_slots] = values
+
+        for slot, window, offsets in zip(plan.roll_slots, plan.roll_windows, plan.roll_offsets):
+            if self._count >= window:
+                out[slot] = self._buffer[(self._head - offsets) % self._capacity].mean()
+            else:
+                out[slot] = self._fallback()
+        return out
+
+    def push(self, value):
+        """Appends a new value (actual or predicted) to the history."""
+        self._buffer[self._head] = value
+        self._head = (self._head + 1) % self._capacity
+        self._count += 1
+        self._total += value
+
+
+def forecast_recursive(models, weights, feature_names, history, future_dates):
+    """
+    Recursively forecasts future values with a weighted (BMA) ensemble.
+
+    Args:
+        models (dict): Fitted models keyed by name.
+        weights (dict): BMA weight per model name.
+        feature_names (list): Column names the models were trained on.
+        history (array-like): Known target values in chronological order.
+        future_dates (pd.DatetimeIndex): Dates to forecast.
+
+    Returns:
+        np.ndarray: BMA forecast for each future date.
+    """
+    return forecast_recursive_batch(
+        {0: models}, {0: weights}, feature_names, {0: history}, {0: future_dates}
+    )[0]
+
+
+def group_models(product_ids, models, weights):
+    """
+    Groups products by the fitted model objects they use.
+
+    Returns:
+        list: (model_name, model, row indices, row weights) per distinct model
+              object, so a model shared by several products predicts once for all.
+    """
+    groups = {}
+    for row, product_id in enumerate(product_ids):
+        for model_name, model in models[product_id].items():
+            weight = weights[product_id].get(model_name, 0)
+            if weight <= 0:
+                continue
+            group = groups.setdefault(id(model), (model_name, model, [], []))
+            group[2].append(row)
+            group[3].append(weight)
+    return [(name, model, np.array(rows, dtype=np.intp), np.array(row_weights, dtype=np.float64))
+            for name, model, rows, row_weights in groups.values()]
+
+
+def forecast_recursive_batch(models, weights, feature_names, histories, future_dates):
+    """
+    Recursively forecasts several products in lockstep with weighted (BMA) ensembles.
+
+    All products advance one step at a time. At each step their feature rows are
+    stacked into one matrix so every distinct model object predicts once for all
+    the products using it. Products can have their own fitted models, or share
+    the same ones by passing the same models dictionary for each product.
+
+    Args:
+        models (dict): Per product ID, fitted models keyed by name.
+        weights (dict): Per product ID, BMA weight per model name.
+        feature_names (list): Column names the models were trained on (same for all products).
+        histories (dict): Per product ID, known target values in chronological order.
+        future_dates (dict): Per product ID, the dates to forecast. Every product
+                             must forecast the same number of steps.
+
+    Returns:
+        dict: Per product ID, np.ndarray BMA forecast for each future date.
+    """
+    product_ids = list(histories)
+    n_steps = len(future_dates[product_ids[0]])
+    if any(len(future_dates[pid]) != n_steps for pid in product_ids):
+        raise ValueError("All products must forecast the same number of steps.")
+
+    plan = FeaturePlan(feature_names)
+    forecasters = [RecursiveForecaster(plan, histories[pid]) for pid in product_ids]
+    calendars = [plan.calendar_block(future_dates[pid]) for pid in product_ids]
+    groups = group_models(product_ids, models, weights)
+    predictions = np.zeros((len(product_ids), n_steps), dtype=np.float64)
+
+    with warnings.catch_warnings():
+        # Models were fitted on DataFrames; rows are passed as plain arrays
+        warnings.filterwarnings("ignore", message="X does not have valid feature names")
+        for step in range(n_steps):
+            # Fresh matrix per step: some libraries mark prediction inputs read-only
+            X_step = np.empty((len(product_ids), plan.n_features), dtype=np.float64)
+            for row, forecaster in enumerate(forecasters):
+                forecaster.feature_row(calendars[row][step], out=X_step[row])
+
+            bma_pred_step = np.zeros(len(product_ids), dtype=np.float64)
+            for model_name, model, rows, row_weights in groups:
+                try:
+                    X_model = X_step if len(rows) == len(product_ids) else X_step[rows]
+                    pred = np.asarray(model.predict(X_model), dtype=np.float64)
+                    bma_pred_step[rows] += row_weights * np.maximum(pred, 0)  # Apply weight and ensure non-negative
+                except Exception as e:
+                    print(f"  ERROR predicting future step {step + 1} with {model_name} for {len(rows)} product(s): {e}")
+
+            predictions[:, step] = bma_pred_step
+            for row, forecaster in enumerate(forecasters):
+                forecaster.push(bma_pred_step[row])
+
+    return {pid: predictions[row] for row, pid in enumerate(product_ids)}
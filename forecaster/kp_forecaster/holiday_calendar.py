@@ -0,0 +1,93 @@
+import os
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+# Ranges of holiday periods, one row per period: kind,name,start,end (inclusive).
+# kind is 'ramadhan', 'eid' (Eid al-Fitr, also a national holiday) or 'holiday', the
+# other gazetted Indonesian national holidays, including the lunar ones (Eid al-Adha,
+# Nyepi, Chinese New Year, Vesak, Islamic New Year, Prophet's Birthday, Isra Mi'raj).
+# Election days and collective leave (cuti bersama) are not included.
+DEFAULT_HOLIDAY_FILE = os.path.join(os.path.dirname(__file__), "holidays.csv")
+HOLIDAY_FEATURES = ('is_ramadhan', 'days_to_eid', 'is_holiday')
+# days_to_eid when no Eid is known within this many days (e.g. past the end of the file)
+DAYS_TO_EID_CAP = 365
+
+
+class HolidayCalendar:
+    """
+    Date-indexed lookup table of holiday features.
+
+    The table covers whole years from the first to the last year of the
+    holiday file, one row per day, so a training frame is joined with a single
+    vectorized take and a future step is looked up by its day offset. Dates
+    outside the table have no Ramadhan or holiday flag and a capped days_to_eid.
+    """
+
+    def __init__(self, periods):
+        self.start = pd.Timestamp(year=periods["start"].min().year, month=1, day=1)
+        end = pd.Timestamp(year=periods["end"].max().year, month=12, day=31)
+        n_days = (end - self.start).days + 1
+
+        self.columns = {name: np.zeros(n_days, dtype=np.int64) for name in HOLIDAY_FEATURES}
+        eid_days = []
+        for kind, first, last in zip(periods["kind"], periods["start"], periods["end"]):
+            span = slice((first - self.start).days, (last - self.start).days + 1)
+            if kind == "ramadhan":
+                self.columns["is_ramadhan"][span] = 1
+            elif kind in ("eid", "holiday"):
+                self.columns["is_holiday"][span] = 1
+            if kind == "eid":
+                eid_days.append((first - self.start).days)
+
+        # Days until the next Eid starts (0 on the first day of Eid)
+        eid_days = np.array(sorted(eid_days), dtype=np.int64)
+        days = np.arange(n_days, dtype=np.int64)
+        next_eid = np.searchsorted(eid_days, days)
+        to_eid = np.full(n_days, DAYS_TO_EID_CAP, dtype=np.int64)
+        known = next_eid < len(eid_days)
+        to_eid[known] = eid_days[next_eid[known]] - days[known]
+        self.columns["days_to_eid"] = np.minimum(to_eid, DAYS_TO_EID_CAP)
+        self.defaults = {'is_ramadhan': 0, 'days_to_eid': DAYS_TO_EID_CAP, 'is_holiday': 0}
+
+    def features(self, dates, names=HOLIDAY_FEATURES):
+        """
+        Looks up holiday features for many dates at once.
+
+        Args:
+            dates (pd.DatetimeIndex): Dates to look up.
+            names (iterable): Features to return, a subset of HOLIDAY_FEATURES.
+
+        Returns:
+            dict: Feature name -> np.ndarray with one value per date.
+        """
+        offsets = (pd.DatetimeIndex(dates).normalize() - self.start).days.to_numpy()
+        inside = (offsets >= 0) & (offsets < len(self.columns["is_ramadhan"]))
+        positions = np.where(inside, offsets, 0)
+        return {name: np.where(inside, self.columns[name][positions], self.defaults[name]) for name in names}
+
+    def lookup(self, date, name):
+        """Returns one holiday feature for a single date."""
+        offset = (pd.Timestamp(date).normalize() - self.start).days
+        if 0 <= offset < len(self.columns[name]):
+            return int(self.columns[name][offset])
+        return self.defaults[name]
+
+
+def load_holiday_periods(path=DEFAULT_HOLIDAY_FILE):
+    """
+    Reads the holiday periods file.
+
+    Returns:
+        pd.DataFrame: kind, name, start and end columns with parsed dates.
+    """
+    periods = pd.read_csv(path)
+    periods["start"] = pd.to_datetime(periods["start"])
+    periods["end"] = pd.to_datetime(periods["end"])
+    return periods
+
+
+@lru_cache(maxsize=None)
+def get_holiday_calendar(path=DEFAULT_HOLIDAY_FILE):
+    """Returns the HolidayCalendar for a holiday file, built once per process."""
+    return HolidayCalendar(load_holiday_periods(path))
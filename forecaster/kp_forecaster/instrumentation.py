@@ -0,0 +1,86 @@
+import threading
+import time
+from contextlib import contextmanager
+from .config import RSS_SAMPLE_SECONDS
+from .resources import current_rss_bytes
+
+
+def _sample_rss(stop, peak):
+    """Keeps peak[0] at the highest RSS seen every RSS_SAMPLE_SECONDS until stop is set."""
+    while not stop.wait(RSS_SAMPLE_SECONDS):
+        peak[0] = max(peak[0], current_rss_bytes())
+
+
+class PipelineMetrics:
+    """
+    Timing and memory of the stages of one pipeline run.
+
+    Every stage records its duration, the process RSS at its end and its change
+    over the stage, the peak RSS sampled while the stage ran (so a reused
+    worker process does not report the peak of an earlier task) and, where
+    the stage knows them, the rows and columns it worked on. CV fits are
+    recorded one by one (model, fold, seconds); they may be recorded from
+    worker threads.
+
+    on_update(snapshot) is called with to_dict() whenever a stage starts or
+    ends, e.g. to publish progress of a Celery task.
+    """
+
+    def __init__(self, on_update=None):
+        self.on_update = on_update
+        self.started = time.perf_counter()
+        self.stages = []
+        self.cv_fits = []
+        self.current = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, **counts):
+        """
+        Times the enclosed block as stage `name`. Yields the stage entry, so
+        counts only known inside the block can be added (entry["rows"] = ...).
+        """
+        entry = {"stage": name, **counts}
+        self.current = name
+        self._notify()
+        rss_start = current_rss_bytes()
+        peak, stop = [rss_start], threading.Event()
+        sampler = threading.Thread(target=_sample_rss, args=(stop, peak), name=f"rss-{name}", daemon=True)
+        sampler.start()
+        started = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            entry["seconds"] = round(time.perf_counter() - started, 4)
+            stop.set()
+            sampler.join()
+            entry["rss_bytes"] = current_rss_bytes()
+            entry["rss_delta_bytes"] = entry["rss_bytes"] - rss_start
+            entry["peak_rss_bytes"] = max(peak[0], entry["rss_bytes"])
+            with self._lock:
+                self.stages.append(entry)
+            self.current = None
+            self._notify()
+
+    def record_fit(self, model, fold, seconds):
+        """Records one CV fit."""
+        with self._lock:
+            self.cv_fits.append({"model": model, "fold": fold, "seconds": round(seconds, 4)})
+
+    def to_dict(self):
+        """JSON-serializable snapshot: finished stages, CV fits, running stage and total time."""
+        with self._lock:
+            return {
+                "stages": [dict(entry) for entry in self.stages],
+                "cv_fits": [dict(fit) for fit in self.cv_fits],
+                "current_stage": self.current,
+                "total_seconds": round(time.perf_counter() - self.started, 4),
+            }
+
+    def _notify(self):
+        if self.on_update is None:
+            return
+        try:
+            self.on_update(self.to_dict())
+        except Exception as e:
+            print(f"WARNING: Could not publish pipeline metrics: {e}")
@@ -1,28 +1,62 @@
-from lightgbm import LGBMRegressor
-from xgboost import XGBRegressor
-from catboost import CatBoostRegressor
-from sklearn.linear_model import LinearRegression
-from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
+from importlib import import_module
+
+# Base models of the BMA ensemble, by name: constructor path ('module:Class'),
+# constructor arguments, and the argument a thread budget overrides (None when
+# the model is single-threaded). Libraries are imported when a model is first built,
+# so importing this module (and the API) does not load any ML library.
+BASE_MODELS = {
+    "LinearRegression": ("sklearn.linear_model:LinearRegression", {}, "n_jobs"),
+    "RandomForest": ("sklearn.ensemble:RandomForestRegressor",
+                     {"n_estimators": 50, "random_state": 42, "n_jobs": 1}, "n_jobs"),
+    "GradientBoosting": ("sklearn.ensemble:GradientBoostingRegressor", {"n_estimators": 50, "random_state": 42}, None),
+    "XGBoost": ("xgboost:XGBRegressor",
+                {"n_estimators": 100, "random_state": 42, "objective": "reg:squarederror"}, "n_jobs"),
+    "LightGBM": ("lightgbm:LGBMRegressor", {"n_estimators": 100, "random_state": 42, "verbose": -1}, "n_jobs"),
+    "CatBoost": ("catboost:CatBoostRegressor", {"n_estimators": 100, "random_state": 42, "verbose": 0},
+                 "thread_count"),
+}
+
+# Models of the single-model comparison (run_pipeline), all single-threaded
+SINGLE_MODELS = {
+    "LinearRegression": ("sklearn.linear_model:LinearRegression", {}),
+    "RandomForest": ("sklearn.ensemble:RandomForestRegressor", {"n_estimators": 50, "random_state": 42, "n_jobs": 1}),
+    "GradientBoosting": ("sklearn.ensemble:GradientBoostingRegressor", {"n_estimators": 50, "random_state": 42}),
+    "XGBoost": ("xgboost:XGBRegressor", {"n_estimators": 100, "random_state": 42, "n_jobs": 1}),
+    "LightGBM": ("lightgbm:LGBMRegressor", {"n_estimators": 100, "random_state": 42, "verbose": -1, "n_jobs": 1}),
+    "CatBoost": ("catboost:CatBoostRegressor", {"n_estimators": 100, "random_state": 42, "verbose": 0, "thread_count": 1}),
+}
+
+_constructors = {}
+
+
+def load_constructor(path):
+    """Imports and returns the class at 'module:Class', once per process."""
+    constructor = _constructors.get(path)
+    if constructor is None:
+        module_name, class_name = path.split(":")
+        constructor = _constructors[path] = getattr(import_module(module_name), class_name)
+    return constructor
+
+
+def base_model_names():
+    """Names of the BMA base models, without importing their libraries."""
+    return list(BASE_MODELS)
+
 
 def get_models():
-    return {
-        "LinearRegression": LinearRegression(),
-        "RandomForest": RandomForestRegressor(n_estimators=50, random_state=42, n_jobs=1),
-        "GradientBoosting": GradientBoostingRegressor(n_estimators=50, random_state=42, n_jobs=1),
-        "XGBoost": XGBRegressor(n_estimators=100, random_state=42, n_jobs=1),
-        "LightGBM": LGBMRegressor(n_estimators=100, random_state=42, verbose=-1, n_jobs=1),
-        "CatBoost": CatBoostRegressor(n_estimators=100, random_state=42, verbose=0, n_jobs=1),
-    }
-
-def get_base_models(): # Removed input_shape parameter
-    """Returns a dictionary of base models for BMA."""
-    models = {
-        "LinearRegression": LinearRegression(),
-        "RandomForest": RandomForestRegressor(n_estimators=50, random_state=42, n_jobs=1),
-        "GradientBoosting": GradientBoostingRegressor(n_estimators=50, random_state=42),
-        "XGBoost": XGBRegressor(n_estimators=100, random_state=42, objective='reg:squarederror'), # Specify objective
-        "LightGBM": LGBMRegressor(n_estimators=100, random_state=42, verbose=-1),
-        "CatBoost": CatBoostRegressor(n_estimators=100, random_state=42, verbose=0),
-        # Removed LSTM entry
-    }
-    return models
\ No newline at end of file
+    return {name: load_constructor(path)(**kwargs) for name, (path, kwargs) in SINGLE_MODELS.items()}
+
+
+def get_base_models(n_threads=None):
+    """
+    Returns a dictionary of base models for BMA.
+
+    Args:
+        n_threads (int, optional): Thread budget given to every model that can
+                                   use several threads. Library defaults when None.
+    """
+    models = {}
+    for name, (path, kwargs, thread_arg) in BASE_MODELS.items():
+        threads = {} if n_threads is None or thread_arg is None else {thread_arg: n_threads}
+        models[name] = load_constructor(path)(**{**kwargs, **threads})
+    return models
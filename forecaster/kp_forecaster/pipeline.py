@@ -1,13 +1,16 @@
 import pandas as pd
 from .preprocessing import load_and_prepare_data, filter_product
-from .feature_engineering import add_lag_features, add_rolling_features, add_time_features, add_ramadhan_feature, create_features_for_step
-from .models import get_models, get_base_models
-from .evaluation import evaluate, evaluate_predictions
+from .feature_engineering import add_lag_features, add_rolling_features, add_lag_block, add_time_features, add_ramadhan_feature, add_holiday_features
+from .forecasting import forecast_recursive, forecast_recursive_batch
+from .direct import fit_direct_models, forecast_direct
+from .registry import ModelRegistry, registry_key
+from .feature_store import load_product_features, feature_lookback
+from .data_source import load_daily_series, make_data_source, is_lock_error
+from .models import get_models
+from .evaluation import evaluate
 from .config import *
-from .bma import calculate_bma_weights
-from sklearn.model_selection import KFold
-from sklearn.metrics import mean_squared_error
-import numpy as np
+from .bma import fit_bma_ensemble
+from .instrumentation import PipelineMetrics
 
 def run_pipeline(filepath):
     df = load_and_prepare_data(filepath)
@@ -34,72 +37,75 @@ def run_pipeline(filepath):
     
     return results
 
-def run_bma_pipeline(file_path, target_product_id, future_step=FUTURE_STEPS):
+def make_config(future_step=FUTURE_STEPS, n_threads=None):
     """
-    Runs the full pipeline including BMA weight calculation, evaluation,
-    and future forecasting. (LSTM functionality removed)
-
-    Args:
-        filepath (str): Path to the data file.
-        target_product_id (str/int): The ID of the product to forecast.
-
-    Returns:
-        dict: A dictionary containing BMA weights, individual model forecasts (test set),
-              the BMA forecast (test set), actual values (test set), evaluation metrics,
-              CV scores, and the future forecast series.
-              Returns None if the pipeline fails.
+    Stores the pipeline configuration in a dictionary for easier passing.
+    `n_threads` overrides N_THREADS, e.g. with the thread budget of a worker task.
     """
-    # --- Load Configuration ---
-    # Store config in a dictionary for easier passing
-    config = {
-        'N_LAGS': N_LAGS, 'N_WEEKS': N_WEEKS, 'ROLL_WINDOWS': ROLL_WINDOWS,
+    return {
+        'N_LAGS': N_LAGS, 'N_WEEKS': N_WEEKS, 'ROLL_WINDOWS': ROLL_WINDOWS, 'FEATURE_DTYPE': FEATURE_DTYPE,
+        'EXTRA_HOLIDAY_FEATURES': EXTRA_HOLIDAY_FEATURES,
         'TEST_SIZE': TEST_SIZE, 'N_SPLITS_BMA': N_SPLITS_BMA,
-        'RANDOM_STATE': 42, 'FUTURE_FORECAST_STEP': future_step
+        'N_THREADS': n_threads or N_THREADS, 'CV_N_JOBS': CV_N_JOBS, 'CV_BACKEND': CV_BACKEND,
+        'CV_PRUNE_THRESHOLD': CV_PRUNE_THRESHOLD,
+        'RANDOM_STATE': 42, 'FUTURE_FORECAST_STEP': future_step,
+        'DIRECT_HORIZON_BUCKETS': DIRECT_HORIZON_BUCKETS
     }
 
+def fit_bma_models(df_filtered, config, df_featured=None, metrics=None):
+    """
+    Runs feature engineering, BMA weight calculation, final model fitting and
+    test set evaluation (steps 2-8 of the BMA pipeline) for one product.
 
-    print(f"--- Starting BMA Pipeline for Product {target_product_id} ---")
+    Args:
+        df_filtered (pd.DataFrame): Daily TOTAL_JUMLAH series from filter_product.
+        config (dict): Pipeline configuration from make_config.
+        df_featured (pd.DataFrame, optional): Features already materialized in the
+                                              feature store; computed when None.
+        metrics (PipelineMetrics, optional): Receives the features, cv, final_fit
+                                             and test_prediction stages.
 
-    # 1. Load and Prepare Data
-    try:
-        df_raw = load_and_prepare_data(file_path)
-        df_filtered = filter_product(df_raw, target_product_id)
-        if df_filtered.empty:
-            print(f"ERROR: No data found for product {target_product_id}")
-            return None
-    except Exception as e:
-        print(f"ERROR during data loading/filtering: {e}")
-        return None
+    Returns:
+        dict: Processed training frame, feature names, fitted models, final BMA
+              weights, test set forecasts and metrics, and CV scores.
+              Returns None if any stage fails.
+    """
+    if metrics is None:
+        metrics = PipelineMetrics()
 
     # 2. Feature Engineering
-    try:
-        # Keep the df before dropping NAs, might be useful for feature calculation history
-        df_featured = add_lag_features(df_filtered, config['N_LAGS'], config['N_WEEKS'])
-        df_featured = add_rolling_features(df_featured, config['ROLL_WINDOWS'])
-        df_featured = add_time_features(df_featured)
-        df_featured = add_ramadhan_feature(df_featured) # Optional
-
-        df_processed = df_featured.dropna() # This df is used for training/testing
-
-        if df_processed.empty:
-            print("ERROR: DataFrame is empty after feature engineering and dropping NA.")
+    with metrics.stage("features", input_rows=len(df_filtered)) as stage:
+        try:
+            if df_featured is None:
+                # Keep the df before dropping NAs, might be useful for feature calculation history
+                df_featured = add_lag_block(df_filtered, config['N_LAGS'], config['N_WEEKS'],
+                                            config['ROLL_WINDOWS'], config['FEATURE_DTYPE'])
+                df_featured = add_time_features(df_featured)
+                df_featured = add_ramadhan_feature(df_featured) # Optional
+                df_featured = add_holiday_features(df_featured, config['EXTRA_HOLIDAY_FEATURES'])
+
+            df_processed = df_featured.dropna() # This df is used for training/testing
+
+            if df_processed.empty:
+                print("ERROR: DataFrame is empty after feature engineering and dropping NA.")
+                return None
+
+            # Define features (X) and target (y) based on processed data
+            # Ensure target is excluded, and any other non-feature columns like PRODUCT_ID
+            potential_non_features = ["TOTAL_JUMLAH", "PRODUCT_ID"]
+            feature_names = [col for col in df_processed.columns if col not in potential_non_features]
+
+            if not feature_names:
+                 print("ERROR: No feature columns found after processing.")
+                 return None
+
+            X = df_processed[feature_names]
+            y = df_processed["TOTAL_JUMLAH"]
+
+        except Exception as e:
+            print(f"ERROR during feature engineering: {e}")
             return None
-
-        # Define features (X) and target (y) based on processed data
-        # Ensure target is excluded, and any other non-feature columns like PRODUCT_ID
-        potential_non_features = ["TOTAL_JUMLAH", "PRODUCT_ID"]
-        feature_names = [col for col in df_processed.columns if col not in potential_non_features]
-
-        if not feature_names:
-             print("ERROR: No feature columns found after processing.")
-             return None
-
-        X = df_processed[feature_names]
-        y = df_processed["TOTAL_JUMLAH"]
-
-    except Exception as e:
-        print(f"ERROR during feature engineering: {e}")
-        return None
+        stage["rows"], stage["columns"] = X.shape
 
     # Check if enough data for split
     if len(X) <= config['TEST_SIZE']:
@@ -112,216 +118,347 @@ def run_bma_pipeline(file_path, target_product_id, future_step=FUTURE_STEPS):
     print(f"Train set size: {len(X_train)}, Test set size: {len(X_test)}")
     test_indices = X_test.index # Store index for test set results
 
-    # --- BMA Specific Steps ---
+    # 4-8. Cross-validated BMA weights, final fit and test set evaluation
+    ensemble = fit_bma_ensemble(X_train, y_train, X_test, y_test, config, metrics)
+    if ensemble is None:
+        return None
+
+    return {
+        "df_processed": df_processed,
+        "feature_names": feature_names,
+        "y_test": y_test,
+        "test_indices": test_indices,
+        **ensemble,
+    }
 
-    # 4. Define Base Models
-    base_models = get_base_models()
+def fit_or_load(df_filtered, config, strategy, registry=None, df_featured=None, metrics=None):
+    """
+    Returns the fit for a product, from the model registry when its series and
+    config are unchanged, otherwise by running CV and the final fit (and storing it).
+    `df_featured` are the product's feature store rows, if it was loaded from there.
+    `metrics` (PipelineMetrics) receives the stages that run.
+    """
+    if metrics is None:
+        metrics = PipelineMetrics()
+    if registry is not None:
+        with metrics.stage("registry_lookup") as stage:
+            key = registry_key(df_filtered["TOTAL_JUMLAH"], config, strategy)
+            fit = registry.get(key)
+            stage["hit"] = fit is not None
+        if fit is not None:
+            print(f"Model registry hit ({key[:12]}): skipping CV and final fit.")
+            return fit
+
+    if strategy == 'direct':
+        fit = fit_direct_models(df_filtered, config, metrics)
+    else:
+        fit = fit_bma_models(df_filtered, config, df_featured, metrics)
 
-    # 5. Calculate BMA Weights using Cross-Validation on Training Data
-    print(f"\n--- Performing {config['N_SPLITS_BMA']}-Fold CV on Training Data for BMA Weights ---")
-    kf = KFold(n_splits=config['N_SPLITS_BMA'], shuffle=True, random_state=config['RANDOM_STATE'])
-    cv_mse_scores = {}
+    if fit is not None and registry is not None:
+        try:
+            registry.put(key, fit)
+        except Exception as e:
+            print(f"WARNING: Could not store fit in the model registry: {e}")
+    return fit
 
-    for model_name, model in base_models.items():
-        print(f"Cross-validating {model_name}...")
-        fold_errors = []
-        for fold, (train_index, val_index) in enumerate(kf.split(X_train)):
-            X_tr, X_val = X_train.iloc[train_index], X_train.iloc[val_index]
-            y_tr, y_val = y_train.iloc[train_index], y_train.iloc[val_index]
-            try:
-                current_model = model # Assumes fit overwrites previous state
-                current_model.fit(X_tr, y_tr)
-                y_pred_val = current_model.predict(X_val)
-                error = mean_squared_error(y_val, y_pred_val)
-                fold_errors.append(error)
-            except Exception as e:
-                print(f"  ERROR during CV Fold {fold+1} for {model_name}: {e}")
-        if fold_errors:
-            avg_cv_error = np.mean(fold_errors)
-            cv_mse_scores[model_name] = max(avg_cv_error, 1e-9)
-            print(f"  {model_name} Avg CV MSE: {avg_cv_error:.4f}")
-        else:
-            print(f"  {model_name} failed all CV folds.")
-            cv_mse_scores[model_name] = float('inf')
+def build_future_dates(df_processed, future_step):
+    """Returns the dates following the last training date (of a frame or series), at the data frequency."""
+    # Determine the frequency of the data (e.g., 'W-MON', 'D') for date range generation
+    # Infer frequency from the training data index if possible
+    inferred_freq = pd.infer_freq(df_processed.index)
+    if inferred_freq is None:
+        # Default or raise error if frequency cannot be determined - IMPORTANT
+        print("WARNING: Could not infer data frequency. Assuming weekly ('W-MON'). Adjust if necessary.")
+        inferred_freq = 'W-MON' # Or 'D' for daily, 'M' for monthly etc.
 
-    bma_weights = calculate_bma_weights(cv_mse_scores)
-    if bma_weights is None: return None
-    print("\nCalculated BMA Weights:")
-    for name, weight in bma_weights.items():
-        if weight > 0: print(f"  {name}: {weight:.4f}")
+    last_date = df_processed.index[-1]
+    return pd.date_range(start=last_date + pd.Timedelta(days=1 if inferred_freq == 'D' else 7), # Adjust step based on freq
+                         periods=future_step, freq=inferred_freq)
+
+def assemble_results(fit, future_dates, future_predictions):
+    """Builds the pipeline results dictionary from a fit and its future forecast."""
+    final_weights = fit["final_weights"]
+    test_indices = fit["test_indices"]
+    future_pred_series = pd.Series(future_predictions, index=future_dates, name='Forecast')
+    return {
+        "final_bma_weights": final_weights, # Weights used for test set and future forecast
+        "individual_forecasts_test": {name: pd.Series(forecast, index=test_indices)
+                                      for name, forecast in fit["individual_forecasts_test"].items()},
+        "bma_forecast_test": pd.Series(fit["bma_forecast_test"], index=test_indices),
+        "actual_values_test": pd.DataFrame({'TANGGAL': test_indices, 'TOTAL_JUMLAH': fit["y_test"]}),
+        "predictions_test": pd.DataFrame({'TANGGAL': test_indices, 'TOTAL_JUMLAH': fit["bma_forecast_test"]}),
+        "bma_metrics_test": fit["bma_metrics_test"],
+        "individual_metrics_test": fit["individual_metrics_test"],
+        "cv_mse_scores": fit["cv_mse_scores"],
+        "future_forecast": pd.DataFrame({'TANGGAL': future_dates, 'TOTAL_JUMLAH': future_pred_series}),
+    }
 
-    # --- Final Model Fitting and Prediction on Test Set ---
+def run_bma_pipeline(file_path, target_product_id, future_step=FUTURE_STEPS, strategy=FORECAST_STRATEGY,
+                     use_registry=USE_MODEL_REGISTRY, feature_store=None, data_source=None, n_threads=None,
+                     metrics=None):
+    """
+    Runs the full pipeline including BMA weight calculation, evaluation,
+    and future forecasting. (LSTM functionality removed)
 
-    # 6. Fit Final Models on Full Training Data
-    print("\n--- Fitting Final Models on Full Training Data ---")
-    fitted_models = {}
-    temp_bma_weights = bma_weights.copy() # Work with a copy for renormalization
+    Data is read from the first source that works: the feature store, the
+    `data_source` DuckDB query, then the CSV at `file_path`.
 
-    for model_name, model in base_models.items():
-        if temp_bma_weights.get(model_name, 0) > 0:
-            print(f"Fitting {model_name}...")
-            try:
-                model.fit(X_train, y_train)
-                fitted_models[model_name] = model
-            except Exception as e:
-                print(f"  ERROR fitting final {model_name}: {e}")
-                temp_bma_weights[model_name] = 0 # Set weight to 0 if final fit fails
+    Args:
+        file_path (str, optional): Path to the CSV data file, used as a fallback.
+        target_product_id (str/int): The ID of the product to forecast.
+        future_step (int): Number of future steps to forecast.
+        strategy (str): 'recursive' (default) or 'direct' multi-horizon forecasting.
+        use_registry (bool): Reuse fitted models from the model registry when possible.
+        feature_store (str, optional): DuckDB database holding the materialized product
+                                       features the training matrix is read from.
+        data_source (dict, optional): Spec from data_source.make_data_source; its daily
+                                      series is aggregated inside DuckDB. Its end_date
+                                      also bounds the feature store history.
+        n_threads (int, optional): Threads the run may use (see resources.thread_budget),
+                                   default N_THREADS.
+        metrics (PipelineMetrics, optional): Collects the duration, RSS and row/column
+                                             counts of every stage; a new one when None.
 
-    # Renormalize weights if any models failed the final fit
-    active_weights = {name: w for name, w in temp_bma_weights.items() if name in fitted_models and w > 0}
-    if not active_weights:
-        print("ERROR: All models for BMA failed to fit.")
+    Returns:
+        dict: A dictionary containing BMA weights, individual model forecasts (test set),
+              the BMA forecast (test set), actual values (test set), evaluation metrics,
+              CV scores, the future forecast series and the stage metrics.
+              Returns None if the pipeline fails.
+
+    Raises:
+        duckdb.IOException: If the data source stayed locked by another process
+                            and there is no CSV to fall back to.
+    """
+    # --- Load Configuration ---
+    config = make_config(future_step, n_threads)
+    if metrics is None:
+        metrics = PipelineMetrics()
+    if strategy not in FORECAST_STRATEGIES:
+        print(f"ERROR: Unknown forecast strategy '{strategy}'. Expected one of {FORECAST_STRATEGIES}")
         return None
-    weight_sum = sum(active_weights.values())
-    if weight_sum < 1e-9 :
-         print("ERROR: Sum of weights for successfully fitted models is zero.")
-         return None
-    elif abs(weight_sum - 1.0) > 1e-6 :
-        print("Renormalizing weights after final fit failures.")
-        final_bma_weights = {name: (w / weight_sum if name in active_weights else 0)
-                             for name, w in temp_bma_weights.items()}
-        print("Renormalized BMA Weights:")
-        for name, weight in final_bma_weights.items():
-             if weight > 0: print(f"  {name}: {weight:.4f}")
-    else:
-        final_bma_weights = active_weights # Use the weights of successfully fitted models
-
-    # 7. Generate Forecasts on Test Data
-    print("\n--- Generating Forecasts on Test Data ---")
-    individual_forecasts_test = {}
-    bma_forecast_test = np.zeros(len(X_test))
-    temp_bma_weights_pred = final_bma_weights.copy() # Copy for prediction renormalization
-
-    for name, model in fitted_models.items():
-        weight = temp_bma_weights_pred.get(name, 0)
-        if weight > 0:
-            print(f"Predicting test set with {name} (Weight: {weight:.4f})")
+
+    print(f"--- Starting BMA Pipeline for Product {target_product_id} ({strategy}) ---")
+
+    # 1. Load and Prepare Data
+    with metrics.stage("load") as stage:
+        start_date, end_date = (data_source.get("start_date"), data_source.get("end_date")) if data_source else (None, None)
+        df_featured, df_filtered = None, None
+        if feature_store:
+            try:
+                df_featured = load_product_features(feature_store, target_product_id, config, end_date)
+                if df_featured.empty:
+                    print(f"WARNING: Product {target_product_id} not in the feature store")
+                    df_featured = None
+                elif end_date is not None and df_featured.index[-1] < pd.Timestamp(end_date):
+                    # History must reach end_date (zero-filled), which only the series query does
+                    df_featured = None
+            except Exception as e:
+                print(f"WARNING: Could not read the feature store: {e}")
+                df_featured = None
+        if df_featured is not None:
+            if start_date is not None:
+                df_featured = df_featured.loc[pd.Timestamp(start_date):]
+            df_filtered = df_featured[["TOTAL_JUMLAH"]]
+
+        if df_filtered is None and data_source:
             try:
-                forecast = model.predict(X_test)
-                forecast[forecast < 0] = 0 # Ensure non-negative
-                individual_forecasts_test[name] = forecast
-                bma_forecast_test += weight * forecast
+                df_filtered = load_daily_series(data_source)
+                if df_filtered.empty:
+                    print(f"WARNING: No data found in DuckDB for product {target_product_id}")
+                    df_filtered = None
             except Exception as e:
-                print(f"  ERROR predicting test set with {name}: {e}")
-                individual_forecasts_test[name] = np.zeros(len(X_test))
-                temp_bma_weights_pred[name] = 0 # Set weight to 0 if prediction fails
-
-    # Renormalize weights AGAIN if predictions failed for some models
-    active_weights_pred = {name: w for name, w in temp_bma_weights_pred.items() if w > 0 and name in fitted_models}
-    if not active_weights_pred:
-         print("ERROR: All models failed during test set prediction.")
-         return None
-    weight_sum_pred = sum(active_weights_pred.values())
-    if weight_sum_pred < 1e-9 :
-        print("ERROR: Sum of weights for successfully predicting models is zero.")
+                if is_lock_error(e) and not file_path:
+                    raise  # Nothing to fall back to; the caller may retry once the file is free
+                print(f"WARNING: Could not read the data source: {e}")
+                df_filtered = None
+
+        if df_filtered is None:
+            if not file_path:
+                print(f"ERROR: No data found for product {target_product_id}")
+                return None
+            print(f"Loading {file_path}")
+            try:
+                df_raw = load_and_prepare_data(file_path)
+                df_filtered = filter_product(df_raw, target_product_id)
+                if df_filtered.empty:
+                    print(f"ERROR: No data found for product {target_product_id}")
+                    return None
+            except Exception as e:
+                print(f"ERROR during data loading/filtering: {e}")
+                return None
+        stage["rows"], stage["columns"] = df_filtered.shape
+
+    # 2-8. Feature engineering, BMA weights, final fit and test set evaluation
+    # (or the stored fit when this product's data and config were fitted before)
+    registry = ModelRegistry(MODEL_REGISTRY_DIR, MODEL_REGISTRY_MAX_BYTES) if use_registry else None
+    fit = fit_or_load(df_filtered, config, strategy, registry, df_featured, metrics)
+    if fit is None:
         return None
-    elif abs(weight_sum_pred - 1.0) > 1e-6:
-        print("Renormalizing weights after prediction failures on test set.")
-        final_bma_forecast_test = np.zeros(len(X_test))
-        final_bma_weights_for_forecast = {}
-        for name, forecast in individual_forecasts_test.items():
-             if temp_bma_weights_pred.get(name, 0) > 0 :
-                 new_weight = temp_bma_weights_pred[name] / weight_sum_pred
-                 final_bma_weights_for_forecast[name] = new_weight
-                 final_bma_forecast_test += new_weight * forecast
-        bma_forecast_test = final_bma_forecast_test
-        final_weights = final_bma_weights_for_forecast # These are the weights used for test and future
-        print("Final Renormalized BMA Weights used for forecast:")
-        for name, weight in final_weights.items(): print(f"  {name}: {weight:.4f}")
-    else:
-        # If no renormalization needed, the final weights are those that successfully predicted
-        final_weights = active_weights_pred
 
-    print(f"\nFinal BMA Forecast on Test Set (first 5): {np.round(bma_forecast_test[:5], 2)}")
-    print(f"Actual Values on Test Set (first 5): {y_test.values[:5]}")
+    # --- 9. Forecast Future Values ---
+    with metrics.stage("future_forecast", rows=config['FUTURE_FORECAST_STEP']):
+        print(f"\n--- Forecasting {config['FUTURE_FORECAST_STEP']} Steps into the Future ---")
 
-    # 8. Evaluate BMA Forecast on Test Set
-    print("\n--- Evaluating Final BMA Forecast on Test Set ---")
-    bma_metrics_test = evaluate_predictions(y_test, bma_forecast_test)
-    print(f"[BMA Test Set] MSE: {bma_metrics_test['MSE']:.2f} | MAPE: {bma_metrics_test['MAPE']:.2%}")
+        if strategy == 'direct':
+            future_dates = build_future_dates(fit["target"], config['FUTURE_FORECAST_STEP'])
+            print(f"Generating direct forecast for horizon buckets: {list(fit['final_weights'].keys())}")
+            future_predictions = forecast_direct(fit, future_dates)
+        else:
+            future_dates = build_future_dates(fit["df_processed"], config['FUTURE_FORECAST_STEP'])
 
-    individual_metrics_test = {}
-    for name, forecast in individual_forecasts_test.items():
-        if final_weights.get(name,0) > 0 :
-             metrics = evaluate_predictions(y_test, forecast)
-             individual_metrics_test[name] = metrics
-             print(f"  [{name.upper()} Test Set] MSE: {metrics['MSE']:.2f} | MAPE: {metrics['MAPE']:.2%}")
+            # Use only models and weights that were successful through fitting and test prediction
+            active_models_for_future = {k: v for k, v in fit["fitted_models"].items() if k in fit["final_weights"]}
 
+            print(f"Generating future forecast using models: {list(active_models_for_future.keys())}")
 
-    # --- 9. Forecast Future Values ---
-    print(f"\n--- Forecasting {config['FUTURE_FORECAST_STEP']} Steps into the Future ---")
+            # Recursive forecast seeded with the historical target values used for training
+            future_predictions = forecast_recursive(
+                active_models_for_future, fit["final_weights"], fit["feature_names"],
+                fit["df_processed"]["TOTAL_JUMLAH"].values, future_dates
+            )
+        future_pred_series = pd.Series(future_predictions, index=future_dates, name='Forecast')
 
-    # Determine the frequency of the data (e.g., 'W-MON', 'D') for date range generation
-    # Infer frequency from the training data index if possible
-    inferred_freq = pd.infer_freq(df_processed.index)
-    if inferred_freq is None:
-        # Default or raise error if frequency cannot be determined - IMPORTANT
-        print("WARNING: Could not infer data frequency. Assuming weekly ('W-MON'). Adjust if necessary.")
-        inferred_freq = 'W-MON' # Or 'D' for daily, 'M' for monthly etc.
+    print("\nFuture Forecast (first 5 steps):")
+    print(future_pred_series.head())
 
-    last_date = df_processed.index[-1]
-    future_dates = pd.date_range(start=last_date + pd.Timedelta(days=1 if inferred_freq == 'D' else 7), # Adjust step based on freq
-                                 periods=config['FUTURE_FORECAST_STEP'], freq=inferred_freq)
+    # --- 10. Return Results ---
+    results = assemble_results(fit, future_dates, future_predictions)
+    results["metrics"] = metrics.to_dict()
 
-    # Initialize the series for recursive forecasting with historical target values
-    # Using df_processed ensures alignment with data used for training features
-    extended_series = df_processed["TOTAL_JUMLAH"].copy()
-    future_predictions = []
+    print(f"\n--- BMA Pipeline for Product {target_product_id} Finished ---")
+    return results
 
-    # Use only models and weights that were successful through fitting and test prediction
-    active_models_for_future = {k: v for k, v in fitted_models.items() if k in final_weights}
+def min_history_days(config):
+    """Shortest daily history (first to last sale) the BMA pipeline can fit and test."""
+    return feature_lookback(config) + config['TEST_SIZE'] + config['N_SPLITS_BMA'] + 1
 
-    print(f"Generating future forecast using models: {list(active_models_for_future.keys())}")
+def plan_batch_chunks(histories, config, chunk_days=BATCH_CHUNK_DAYS):
+    """
+    Splits the products worth forecasting into chunks of similar total work.
+
+    Products with less history than min_history_days are skipped up front.
+    The rest are ordered by history length, so products of similar length share
+    a lockstep forecast, and packed into chunks of at most `chunk_days` days of
+    history (a longer product gets a chunk of its own).
+
+    Args:
+        histories (pd.DataFrame): product_id and n_days per product, as returned
+                                  by data_source.product_histories.
+        config (dict): Pipeline configuration from make_config.
+        chunk_days (int): Budget of history days per chunk.
+
+    Returns:
+        tuple: (list of product ID lists, one per chunk; list of skipped product IDs)
+    """
+    enough = histories["n_days"] >= min_history_days(config)
+    skipped = histories.loc[~enough, "product_id"].tolist()
+    eligible = histories[enough].sort_values("n_days", ascending=False)
+
+    chunks, chunk, chunk_total = [], [], 0
+    for product_id, n_days in zip(eligible["product_id"], eligible["n_days"]):
+        if chunk and chunk_total + n_days > chunk_days:
+            chunks.append(chunk)
+            chunk, chunk_total = [], 0
+        chunk.append(product_id)
+        chunk_total += n_days
+    if chunk:
+        chunks.append(chunk)
+    return chunks, skipped
+
+def run_bma_batch_pipeline(file_path, target_product_ids, future_step=FUTURE_STEPS, use_registry=USE_MODEL_REGISTRY,
+                           database=None, n_threads=None):
+    """
+    Runs the BMA pipeline for many products, forecasting the future in lockstep.
 
-    for future_date in future_dates:
-        # Create features for the current future step
-        feature_df = create_features_for_step(future_date, extended_series, feature_names, config)
+    Every product is trained with its own models (steps 2-8), then all products
+    advance through the recursive forecast together so each model predicts once
+    per step for the whole batch instead of once per product. Products whose
+    fits use different feature columns are forecast in separate lockstep groups.
 
-        if feature_df is None:
-             print(f"ERROR: Failed to create features for {future_date}. Stopping future forecast.")
-             # Handle this - maybe return partial results or None
-             future_pred_series = pd.Series(future_predictions, index=future_dates[:len(future_predictions)], name='Forecast') # Partial results
-             break # Exit the loop
+    Args:
+        file_path (str, optional): Path to the CSV data file, used when `database` is
+                                   not given or a product cannot be read from it.
+        target_product_ids (list): The IDs of the products to forecast.
+        future_step (int): Number of future steps to forecast.
+        use_registry (bool): Reuse fitted models from the model registry when possible.
+        database (str, optional): DuckDB database each product's daily series is
+                                  aggregated from (see data_source.load_daily_series).
+        n_threads (int, optional): Threads the run may use (see resources.thread_budget),
+                                   default N_THREADS.
 
-        # --- Perform BMA prediction for the single future step ---
-        bma_pred_step = 0
-        for model_name, model in active_models_for_future.items():
-            weight = final_weights.get(model_name, 0) # Should always be > 0 here
+    Returns:
+        dict: Pipeline results (as returned by run_bma_pipeline) keyed by product ID,
+              for the products that were fitted successfully.
+              Returns None if no product could be fitted.
+    """
+    config = make_config(future_step, n_threads)
+
+    print(f"--- Starting Batch BMA Pipeline for {len(target_product_ids)} Products ---")
+
+    # 1. Load and Prepare Data (the CSV only once, when it is needed)
+    df_raw = None
+    if file_path and not database:
+        try:
+            df_raw = load_and_prepare_data(file_path)
+        except Exception as e:
+            print(f"ERROR during data loading: {e}")
+            return None
+
+    # 2-8. Fit each product independently
+    registry = ModelRegistry(MODEL_REGISTRY_DIR, MODEL_REGISTRY_MAX_BYTES) if use_registry else None
+    fits = {}
+    for product_id in target_product_ids:
+        print(f"\n--- Fitting Product {product_id} ---")
+        df_filtered = None
+        if database:
             try:
-                # Predict expects a DataFrame
-                pred = model.predict(feature_df)[0] # Get single prediction value
-                bma_pred_step += weight * max(pred, 0) # Apply weight and ensure non-negative
+                df_filtered = load_daily_series(make_data_source(database, product_id))
+                if df_filtered.empty:
+                    print(f"WARNING: No data found in DuckDB for product {product_id}")
+                    df_filtered = None
             except Exception as e:
-                 print(f"  ERROR predicting future step with {model_name} for {future_date}: {e}")
-                 # How to handle model failure here? Could skip model, renormalize weights for the step, or stop.
-                 # For simplicity, we might ignore the failing model's contribution for this step,
-                 # but this will slightly skew the BMA result. A more robust solution might be needed.
-                 pass # Ignoring contribution for now
-
-        # Store prediction and update the series for the next step's feature calculation
-        future_predictions.append(bma_pred_step)
-        # Use .loc for safe assignment with timestamp index
-        extended_series.loc[future_date] = bma_pred_step
-
-    else: # If the loop completed without break
-        # Create final future predictions series
-        future_pred_series = pd.Series(future_predictions, index=future_dates, name='Forecast')
-        print("\nFuture Forecast (first 5 steps):")
-        print(future_pred_series.head())
-
-    # --- 10. Return Results ---
-    results = {
-        "final_bma_weights": final_weights, # Weights used for test set and future forecast
-        "individual_forecasts_test": {name: pd.Series(forecast, index=test_indices)
-                                      for name, forecast in individual_forecasts_test.items() if name in final_weights},
-        "bma_forecast_test": pd.Series(bma_forecast_test, index=test_indices),
-        "actual_values_test": pd.DataFrame({'TANGGAL': df_filtered.index[-config['TEST_SIZE']:], 'TOTAL_JUMLAH': y_test}),
-        "predictions_test": pd.DataFrame({'TANGGAL': df_filtered.index[-config['TEST_SIZE']:], 'TOTAL_JUMLAH': bma_forecast_test}),
-        "bma_metrics_test": bma_metrics_test,
-        "individual_metrics_test": individual_metrics_test,
-        "cv_mse_scores": cv_mse_scores,
-        "future_forecast": pd.DataFrame({'TANGGAL': future_dates, 'TOTAL_JUMLAH': future_pred_series}),
-    }
+                print(f"WARNING: Could not read product {product_id} from {database}: {e}")
+        if df_filtered is None and file_path:
+            try:
+                if df_raw is None:
+                    df_raw = load_and_prepare_data(file_path)
+                df_filtered = filter_product(df_raw, product_id)
+            except Exception as e:
+                print(f"ERROR during loading/filtering of product {product_id}: {e}")
+                continue
+        if df_filtered is None or df_filtered.empty:
+            print(f"ERROR: No data found for product {product_id}")
+            continue
+        fit = fit_or_load(df_filtered, config, 'recursive', registry)
+        if fit is not None:
+            fits[product_id] = fit
+
+    if not fits:
+        print("ERROR: No product could be fitted.")
+        return None
 
-    print(f"\n--- BMA Pipeline for Product {target_product_id} Finished ---")
-    return results
\ No newline at end of file
+    # 9. Lockstep recursive forecast across all fitted products
+    print(f"\n--- Forecasting {config['FUTURE_FORECAST_STEP']} Steps into the Future for {len(fits)} Products ---")
+    future_dates = {pid: build_future_dates(fit["df_processed"], config['FUTURE_FORECAST_STEP'])
+                    for pid, fit in fits.items()}
+    # Products share one lockstep forecast per feature layout, so no product gets another's columns
+    layouts = {}
+    for pid, fit in fits.items():
+        layouts.setdefault(tuple(fit["feature_names"]), []).append(pid)
+    future_predictions = {}
+    for feature_names, pids in layouts.items():
+        future_predictions.update(forecast_recursive_batch(
+            {pid: {k: v for k, v in fits[pid]["fitted_models"].items() if k in fits[pid]["final_weights"]}
+             for pid in pids},
+            {pid: fits[pid]["final_weights"] for pid in pids},
+            list(feature_names),
+            {pid: fits[pid]["df_processed"]["TOTAL_JUMLAH"].values for pid in pids},
+            {pid: future_dates[pid] for pid in pids},
+        ))
+
+    # 10. Return Results
+    results = {pid: assemble_results(fit, future_dates[pid], future_predictions[pid])
+               for pid, fit in fits.items()}
+
+    print(f"\n--- Batch BMA Pipeline Finished for {len(results)} Products ---")
+    return results
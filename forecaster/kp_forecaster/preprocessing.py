@@ -4,12 +4,23 @@ from kp_forecaster.config import PRODUCT_ID_COLS, TARGET_COLUMN, DATE_COLUMN, RE
 def load_and_prepare_data(file_path):
     df = pd.read_csv(file_path, parse_dates=[DATE_COLUMN])
     for col in PRODUCT_ID_COLS:
-        df[col] = df[col].astype(str)
-    df['PRODUCT_ID'] = df[PRODUCT_ID_COLS].agg('_'.join, axis=1)
+        df[col] = df[col].astype(str).astype('category')
+    # PRODUCT_ID is categorical: the '_'-joined ID is built once per distinct product
+    # and rows hold integer codes, so filtering and grouping compare integers
+    codes, products = pd.MultiIndex.from_frame(df[PRODUCT_ID_COLS]).factorize()
+    df['PRODUCT_ID'] = pd.Categorical.from_codes(codes, ['_'.join(product) for product in products])
     return df
 
 def filter_product(df, product_id):
-    df = df[df['PRODUCT_ID'] == product_id]
+    product_ids = df['PRODUCT_ID']
+    if isinstance(product_ids.dtype, pd.CategoricalDtype):
+        # Probe the categories once, then compare integer codes
+        if product_id not in product_ids.cat.categories:
+            df = df.iloc[:0]
+        else:
+            df = df[product_ids.cat.codes.to_numpy() == product_ids.cat.categories.get_loc(product_id)]
+    else:
+        df = df[product_ids == product_id]
     df = df.groupby(pd.Grouper(key=DATE_COLUMN, freq=RESAMPLE_FREQ))[TARGET_COLUMN].sum().reset_index()
     df = df.rename(columns={TARGET_COLUMN: 'TOTAL_JUMLAH'}).set_index(DATE_COLUMN)
     df = df.asfreq(RESAMPLE_FREQ, fill_value=0)
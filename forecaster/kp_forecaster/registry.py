@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import numpy as np
+from .models import get_base_models
+
+# Bump when the layout of stored fits changes so old entries are never reused
+REGISTRY_FORMAT_VERSION = 1
+
+# Config keys that only affect how fast a fit runs, not what it produces
+RUNTIME_CONFIG_KEYS = ('N_THREADS', 'CV_N_JOBS', 'CV_BACKEND')
+
+
+def registry_key(series, config, strategy):
+    """
+    Content hash of a product's daily series, the pipeline config and the model set.
+
+    Args:
+        series (pd.Series): Daily TOTAL_JUMLAH series of the product.
+        config (dict): Pipeline configuration from make_config.
+        strategy (str): Forecast strategy ('recursive' or 'direct').
+
+    Returns:
+        str: Hex digest identifying the fit.
+    """
+    relevant_config = {k: v for k, v in config.items() if k not in RUNTIME_CONFIG_KEYS}
+    if strategy != 'direct':
+        # Only direct bucket models depend on the forecast horizon
+        relevant_config.pop('FUTURE_FORECAST_STEP', None)
+        relevant_config.pop('DIRECT_HORIZON_BUCKETS', None)
+    models = {name: repr(sorted(model.get_params().items())) for name, model in get_base_models().items()}
+
+    digest = hashlib.sha256()
+    digest.update(series.index.asi8.tobytes())
+    digest.update(np.ascontiguousarray(series.to_numpy(dtype=np.float64)).tobytes())
+    digest.update(json.dumps(
+        {"version": REGISTRY_FORMAT_VERSION, "strategy": strategy, "config": relevant_config, "models": models},
+        sort_keys=True, default=str,
+    ).encode())
+    return digest.hexdigest()
+
+
+class ModelRegistry:
+    """
+    On-disk store of fitted BMA pipelines keyed by registry_key.
+
+    Each entry is one pickle holding the fitted models, BMA weights, CV scores,
+    feature names and test results. Reading an entry refreshes its modification
+    time, and once the directory grows past `max_bytes` the least recently used
+    entries are evicted.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def get(self, key):
+        """Returns the stored fit for `key`, or None if it is missing or unreadable."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                fit = pickle.load(f)
+            os.utime(path)  # Mark as recently used
+            return fit
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"WARNING: Could not read model registry entry {key}: {e}")
+            return None
+
+    def put(self, key, fit):
+        """Stores a fit atomically, then evicts least recently used entries if needed."""
+        fit = dict(fit)
+        if "df_processed" in fit:
+            # Forecasting only needs the target history, not the full feature matrix
+            fit["df_processed"] = fit["df_processed"][["TOTAL_JUMLAH"]]
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(fit, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Removes least recently used entries until the registry fits in max_bytes."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".pkl"):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:  # Removed concurrently
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
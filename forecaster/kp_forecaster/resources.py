@@ -0,0 +1,64 @@
+import os
+
+# Environment variables read by BLAS/OpenMP runtimes when they start threads
+NATIVE_THREAD_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                      "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+
+def available_cores():
+    """Returns the number of CPU cores this process is allowed to run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError: # Not available on every platform
+        return os.cpu_count() or 1
+
+
+def thread_budget(concurrency=None, cores=None):
+    """
+    Threads one task may use when `concurrency` tasks share the host's cores.
+
+    Args:
+        concurrency (int, optional): Tasks running at the same time, e.g. the
+                                     Celery worker concurrency. Default one per core.
+        cores (int, optional): Cores to share, default available_cores().
+
+    Returns:
+        int: Thread budget per task, at least 1.
+    """
+    cores = cores or available_cores()
+    return max(1, cores // (concurrency or cores))
+
+
+def limit_native_threads(n_threads):
+    """
+    Caps the BLAS and OpenMP thread pools of this process at n_threads.
+
+    Thread pools already loaded (numpy's BLAS, LightGBM/XGBoost's OpenMP) are
+    limited through threadpoolctl; the environment variables cover runtimes
+    loaded later and child processes.
+    """
+    from threadpoolctl import threadpool_limits
+
+    for name in NATIVE_THREAD_VARS:
+        os.environ[name] = str(n_threads)
+    threadpool_limits(limits=n_threads)
+
+
+def current_rss_bytes():
+    """
+    Resident set size of this process in bytes, or its peak RSS where
+    /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    """Highest resident set size this process reached so far, in bytes."""
+    import resource
+    import sys
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024 # bytes on macOS, KiB elsewhere
@@ -0,0 +1,41 @@
+"""
+Checks the CV pruning rule (kp_forecaster.bma.models_to_prune) on fold
+errors chosen by hand, without fitting any model.
+
+Run from the forecaster directory:
+    PYTHONPATH=. python scripts/check_cv_pruning.py
+"""
+import sys
+from kp_forecaster.bma import models_to_prune
+
+MODELS = ["LinearRegression", "RandomForest", "GradientBoosting", "XGBoost", "LightGBM", "CatBoost"]
+
+# (description, fold errors by model, threshold, models that must survive the round)
+CASES = [
+    ("equal errors keep every model", {name: [100.0] for name in MODELS}, 0.2, set(MODELS)),
+    ("similar errors keep the leader", {name: [100.0 + i] for i, name in enumerate(MODELS)}, 0.2, {MODELS[0]}),
+    ("threshold above 1 keeps the leader", {name: [100.0 + i, 90.0] for i, name in enumerate(MODELS)}, 1.5,
+     {MODELS[0]}),
+    ("tied leaders are both kept", {**{name: [200.0] for name in MODELS}, MODELS[2]: [50.0], MODELS[4]: [50.0]},
+     0.3, {MODELS[2], MODELS[4]}),
+    ("models without a fold yet are kept", {**{name: [100.0 + i] for i, name in enumerate(MODELS)}, MODELS[5]: []},
+     0.2, {MODELS[0], MODELS[5]}),
+]
+
+
+def main():
+    failures = 0
+    for description, fold_errors, threshold, survivors in CASES:
+        kept = set(fold_errors) - set(models_to_prune(fold_errors, threshold))
+        problems = []
+        if not kept:
+            problems.append("ensemble emptied")
+        if not survivors <= kept:
+            problems.append(f"pruned {', '.join(sorted(survivors - kept))}")
+        failures += bool(problems)
+        print(f"{description:<40} {'FAIL: ' + '; '.join(problems) if problems else 'ok'}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Checks that the API and the Celery worker modules import quickly and without
+any ML library.
+
+Each module is imported in a fresh interpreter (in a temporary working
+directory, since importing the API opens data/train.duckdb). The check fails
+when the import takes longer than its budget or loads a library that should
+only be imported once a model is built (see kp_forecaster.models).
+
+Run from the forecaster directory:
+    python scripts/check_import_budget.py [--budget SECONDS]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# Seconds each module may take to import in a fresh interpreter
+IMPORT_BUDGETS = {"api.main": 2.5, "api.tasks": 2.5}
+# Libraries that must not be loaded by these imports
+LAZY_LIBRARIES = ("sklearn", "lightgbm", "xgboost", "catboost", "matplotlib", "seaborn")
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - started
+print(json.dumps({{"seconds": seconds, "loaded": sorted(name for name in {lazy!r} if name in sys.modules)}}))
+"""
+
+
+def probe(module, forecaster_dir):
+    """Imports `module` in a new interpreter; returns its import seconds and the lazy libraries it loaded."""
+    env = {**os.environ, "PYTHONPATH": forecaster_dir, "JOB_REGISTRY_REDIS": "0", "TRAIN_CACHE_REDIS": "0"}
+    with tempfile.TemporaryDirectory() as cwd:
+        completed = subprocess.run([sys.executable, "-c", PROBE.format(module=module, lazy=LAZY_LIBRARIES)],
+                                   cwd=cwd, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time budget check of the API and worker modules.")
+    parser.add_argument("--budget", type=float, default=None, help="Budget in seconds for every module")
+    args = parser.parse_args()
+    forecaster_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    failures = 0
+    for module, budget in IMPORT_BUDGETS.items():
+        budget = args.budget or budget
+        result = probe(module, forecaster_dir)
+        problems = []
+        if result["seconds"] > budget:
+            problems.append(f"over budget ({budget:.2f} s)")
+        if result["loaded"]:
+            problems.append(f"loaded {', '.join(result['loaded'])}")
+        failures += bool(problems)
+        print(f"{module:<12} {result['seconds']:6.2f} s  {'FAIL: ' + '; '.join(problems) if problems else 'ok'}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Checks that DuckDB and pandas build the same product ID for every row,
+including rows with missing (NULL/NaN) product ID columns.
+
+The same transactions are keyed through the product dimension
+(kp_forecaster.data_source.ensure_product_dimension) and loaded with
+kp_forecaster.preprocessing.load_and_prepare_data; every row must get the
+same ID from both, and distinct products distinct IDs.
+
+Run from the forecaster directory:
+    PYTHONPATH=. python scripts/check_product_ids.py
+"""
+import os
+import sys
+import tempfile
+import duckdb
+from kp_forecaster.config import PRODUCT_ID_COLS, TRAIN_DATA_TABLE, PRODUCT_TABLE
+from kp_forecaster.data_source import ensure_product_dimension
+from kp_forecaster.preprocessing import load_and_prepare_data
+
+# id, TANGGAL and the four product ID columns; None is a missing value
+ROWS = [
+    (1, "2024-01-01", "K01", "A", "R", "S"),
+    (2, "2024-01-01", "K01", None, "R", "S"),
+    (3, "2024-01-02", "K01", "R", "S", None),
+    (4, "2024-01-02", "K02", None, None, None),
+    (5, "2024-01-03", None, "A", "R", "S"),
+    (6, "2024-01-03", "K01", None, "R", "S"),
+]
+
+
+def main():
+    columns = ["id", "TANGGAL", *PRODUCT_ID_COLS]
+    conn = duckdb.connect()
+    conn.execute(f"CREATE TABLE {TRAIN_DATA_TABLE} (id INTEGER, TANGGAL DATE, "
+                 + ", ".join(f"{col} TEXT" for col in PRODUCT_ID_COLS) + ", BERAT_TOTAL FLOAT)")
+    conn.executemany(f"INSERT INTO {TRAIN_DATA_TABLE} ({', '.join(columns)}) VALUES (?, ?, ?, ?, ?, ?)", ROWS)
+    ensure_product_dimension(conn)
+    sql_ids = dict(conn.execute(f"""
+    SELECT t.id, p.product_id FROM {TRAIN_DATA_TABLE} t LEFT JOIN {PRODUCT_TABLE} p USING (product_key)
+    """).fetchall())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "train.csv")
+        conn.execute(f"COPY (SELECT * EXCLUDE (product_key) FROM {TRAIN_DATA_TABLE}) TO '{csv_path}' (HEADER)")
+        df = load_and_prepare_data(csv_path)
+    pandas_ids = dict(zip(df["id"], df["PRODUCT_ID"].astype(str)))
+
+    failures = 0
+    for row in ROWS:
+        sql_id, pandas_id = sql_ids.get(row[0]), pandas_ids.get(row[0])
+        ok = sql_id is not None and sql_id == pandas_id
+        failures += not ok
+        print(f"row {row[0]} {str(row[2:]):<34} duckdb={sql_id!s:<16} pandas={pandas_id!s:<16} {'ok' if ok else 'FAIL'}")
+    distinct_products = len({row[2:] for row in ROWS})
+    distinct_ids = len(set(sql_ids.values()))
+    if distinct_ids != distinct_products:
+        failures += 1
+        print(f"FAIL: {distinct_products} products got {distinct_ids} distinct IDs")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()